@@ -0,0 +1,41 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""AODN ingest tooling feeding IMOS coastal wave buoy data into wis2box"""
+
+import os
+from pathlib import Path
+
+WIS2BOX_DATA = Path(__file__).resolve().parents[1] / 'wis2box-data'
+
+WAVE_BUOY_TEMPLATE = WIS2BOX_DATA / 'mappings' / 'wave_buoy_template.json'
+STATION_LIST = WIS2BOX_DATA / 'metadata' / 'station' / 'station_list.csv'
+
+# local state (high-water marks, queues, caches) kept between pipeline runs
+STATE_DIR = Path(os.environ.get('AODN_PIPELINE_STATE_DIR',
+                                Path.home() / '.aodn_pipeline'))
+
+# wis2box.env of the deployment the pipeline publishes to
+WIS2BOX_ENV = Path(os.environ.get(
+    'WIS2BOX_ENV', Path(__file__).resolve().parents[2] / 'wis2box' / 'wis2box.env'))  # noqa
+
+# incoming path for wave buoy data, matching wave-buoys.yml topic_hierarchy
+WAVE_BUOY_TOPIC = 'au-imos/data/core/ocean/surface-based-observations/wave-buoys'  # noqa
@@ -0,0 +1,625 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Checkpointed, parallel backfill of historical wave buoy observations
+
+Onboarding a buoy republishes years of IMOS delayed-mode data.  The
+requested stations and months are split into (station, month) work units
+which a process pool converts and uploads independently.  Every finished
+unit is checkpointed in SQLite, so a killed backfill resumes with the
+units it had not finished; rows of a half-sent unit are skipped by the
+dedup cache when it is redone.
+
+Uploads are rate limited in observations per second, shared between the
+workers, so that the backfill leaves wis2box room for the real-time feed.
+The high-water marks of the real-time ingestion are left untouched.
+
+With `--bulk-api` the observations are encoded as BUFR4 and expanded into
+GeoJSON documents which are loaded into the wis2box API through the
+Elasticsearch `_bulk` API, instead of being uploaded for wis2box to index
+one document at a time.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from datetime import timedelta
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+from aodn_pipeline import STATE_DIR, WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC, WIS2BOX_ENV  # noqa
+from aodn_pipeline.backpressure import TokenBucket
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import convert_dataset, load_template
+from aodn_pipeline.dedup import DEDUP_DB, FingerprintCache
+from aodn_pipeline.es_bulk import (API_INDEX, BULK_DOCUMENTS, BULK_WORKERS,
+                                   RELAXED_REFRESH, BulkIndexer, bulk_sink,
+                                   load_api_backend, relaxed_refresh)
+from aodn_pipeline.ingest import (OUTPUT_FORMATS, directory_sink, send_frame,
+                                  storage_sink)
+from aodn_pipeline.reader import (MEMORY_BUDGET, chunk_rows, iter_chunks,
+                                  open_pruned)
+from aodn_pipeline.state import connect
+from aodn_pipeline.stations import NATIONAL_SITES, load_national_sites
+from aodn_pipeline.upload import load_storage_config
+
+LOGGER = logging.getLogger(__name__)
+
+BACKFILL_DB = STATE_DIR / 'backfill.sqlite3'
+
+# checkpoints of backfills loaded straight into the wis2box API
+BACKFILL_API_DB = STATE_DIR / 'backfill-api.sqlite3'
+
+# delayed-mode and aggregate files of a site; any file whose TIME range
+# overlaps a month contributes to its unit
+SOURCE_PATTERN = 'IMOS_COASTAL-WAVE-BUOYS_*_{site}_*WAVE-PARAMETERS*.nc'
+
+# observations per second sent by all workers together
+BACKFILL_RATE = 50
+
+# statuses of units that are not redone when a backfill resumes
+DONE_STATUSES = ('ok', 'empty')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backfill_unit (
+    wigos_station_identifier TEXT NOT NULL,
+    month TEXT NOT NULL,
+    status TEXT NOT NULL,
+    observations INTEGER NOT NULL DEFAULT 0,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    objects INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    updated TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+    PRIMARY KEY (wigos_station_identifier, month)
+);
+"""
+
+# per-process context set up once by init_worker
+_WORKER = {}
+
+
+class Checkpoints:
+    """Outcome of backfill work units keyed by station and month"""
+
+    def __init__(self, path: Path = BACKFILL_DB):
+        self.path = Path(path)
+        self.conn = connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def done(self) -> set:
+        """
+        List the finished units
+
+        :returns: `set` of (wigos_station_identifier, month) tuples
+        """
+
+        placeholders = ','.join('?' * len(DONE_STATUSES))
+        return set(self.conn.execute(
+            'SELECT wigos_station_identifier, month FROM backfill_unit '
+            f'WHERE status IN ({placeholders})', DONE_STATUSES))
+
+    def record(self, result: dict) -> None:
+        """
+        Checkpoint the result of a unit
+
+        :param result: `dict` from `process_unit`
+
+        :returns: None
+        """
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO backfill_unit (wigos_station_identifier, '
+            'month, status, observations, duplicates, objects, seconds, '
+            'error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (result['wigos_station_identifier'], result['month'],
+             result['status'], result['observations'], result['duplicates'],
+             result['objects'], result['seconds'], result['error']))
+
+    def reset(self, units: list) -> int:
+        """
+        Forget the checkpoints of units so that they are redone
+
+        :param units: `list` of (wigos_station_identifier, month) tuples
+
+        :returns: `int` of forgotten checkpoints
+        """
+
+        self.conn.execute('BEGIN')
+        forgotten = sum(self.conn.execute(
+            'DELETE FROM backfill_unit WHERE wigos_station_identifier = ? '
+            'AND month = ?', unit).rowcount for unit in units)
+        self.conn.execute('COMMIT')
+
+        return forgotten
+
+    def status(self) -> list:
+        """
+        Summarise the checkpoints per station
+
+        :returns: `list` of `dict` with counts of units per status
+        """
+
+        rows = self.conn.execute(
+            'SELECT wigos_station_identifier, status, COUNT(*), '
+            'SUM(observations), MIN(month), MAX(month) FROM backfill_unit '
+            'GROUP BY wigos_station_identifier, status '
+            'ORDER BY wigos_station_identifier, status').fetchall()
+
+        return [dict(zip(('wigos_station_identifier', 'status', 'units',
+                          'observations', 'first_month', 'last_month'), row))
+                for row in rows]
+
+
+def month_range(start: str, end: str) -> list:
+    """
+    List the months between two months, inclusive
+
+    :param start: `str` of first month, YYYY-MM
+    :param end: `str` of last month, YYYY-MM
+
+    :returns: `list` of `str` of YYYY-MM
+    """
+
+    months = np.arange(np.datetime64(start, 'M'), np.datetime64(end, 'M') + 1)
+    if not len(months):
+        raise ValueError(f'Empty month range {start} to {end}')
+
+    return [str(month) for month in months]
+
+
+def work_units(stations: list, months: list, done: set = ()) -> list:
+    """
+    Split a backfill into (station, month) units, oldest month first
+
+    :param stations: `list` of station `dict` with `site_name`
+    :param months: `list` of `str` of YYYY-MM
+    :param done: `set` of (wigos_station_identifier, month) to leave out
+
+    :returns: `list` of (station, month) tuples
+    """
+
+    return [(station, month) for month in months for station in stations
+            if (station['wigos_station_identifier'], month) not in done]
+
+
+def paced_sink(sink: Callable[[str, bytes], None],
+               bucket: TokenBucket) -> Callable[[str, bytes], None]:
+    """
+    Wrap a sink so that objects wait for one token per observation
+
+    CSV objects count one observation per line after the header, other
+    objects one observation each.
+
+    :param sink: callable taking an object key and its content
+    :param bucket: `TokenBucket` of observations per second
+
+    :returns: callable taking an object key and its content
+    """
+
+    def wrapper(key, data):
+        observations = 1
+        if key.endswith('.csv'):
+            observations = max(data.count(b'\n') - 1, 1)
+        bucket.acquire(observations)
+        sink(key, data)
+
+    wrapper.__wrapped__ = sink
+    return wrapper
+
+
+def init_worker(template_path: Path, storage_config: dict, output_dir: Path,
+                prefix: str, output_format: str, rate: float, workers: int,
+                dedup_path: Path = None,
+                memory_budget: int = MEMORY_BUDGET,
+                api_config: dict = None) -> None:
+    """
+    Set up the template, dedup cache and paced sink of a worker process
+
+    Each worker sends at an equal share of `rate`.  With `api_config`
+    each worker loads documents with its own `BulkIndexer`.
+
+    :returns: None
+    """
+
+    indexer = None
+    if api_config:
+        indexer = BulkIndexer(api_config['url'], api_config['index'],
+                              api_config['batch_size'],
+                              workers=api_config['workers'])
+        sink = bulk_sink(indexer)
+    elif output_dir:
+        sink = directory_sink(output_dir)
+    else:
+        sink = storage_sink(storage_config)
+    if rate:
+        share = rate / workers
+        sink = paced_sink(sink, TokenBucket(share, burst=max(share, 1)))
+
+    template = load_template(template_path)
+    _WORKER.update({
+        'template': template,
+        'encoder': BufrEncoder(template) if output_format == 'bufr4' else None,  # noqa
+        'output_format': output_format,
+        'dedup': FingerprintCache(dedup_path) if dedup_path else None,
+        'sink': sink,
+        'indexer': indexer,
+        'prefix': prefix,
+        'memory_budget': memory_budget
+    })
+
+
+def process_unit(station: dict, month: str, source_dir: Path,
+                 pattern: str = SOURCE_PATTERN) -> dict:
+    """
+    Convert and send the observations of a station in one month
+
+    :param station: `dict` of station metadata with `site_name`
+    :param month: `str` of YYYY-MM
+    :param source_dir: `Path` of directory holding IMOS NetCDF files
+    :param pattern: `str` of glob pattern with a `{site}` placeholder
+
+    :returns: `dict` of the unit result
+    """
+
+    start = time.perf_counter()
+    result = {
+        'wigos_station_identifier': station['wigos_station_identifier'],
+        'month': month,
+        'status': 'empty',
+        'observations': 0,
+        'duplicates': 0,
+        'objects': 0,
+        'documents': 0,
+        'error': None
+    }
+
+    first = np.datetime64(month, 'M')
+    begin, end = first.astype('datetime64[ns]'), (first + 1).astype('datetime64[ns]')  # noqa
+    dedup = _WORKER['dedup']
+    indexer = _WORKER['indexer']
+    indexed = indexer.documents if indexer is not None else 0
+
+    try:
+        files = sorted(Path(source_dir).glob(pattern.format(site=station['site_name'])))  # noqa
+        if not files:
+            result['status'] = 'missing'
+        for nc_file in files:
+            with open_pruned(nc_file, _WORKER['template']) as ds:
+                times = ds['TIME'].values
+                selected = np.flatnonzero((times >= begin) & (times < end))
+                if not len(selected):
+                    continue
+                window = ds.isel(TIME=selected)
+                rows = chunk_rows(window, _WORKER['memory_budget'])
+                for chunk in iter_chunks(window, rows):
+                    frame = convert_dataset(chunk.load(), station,
+                                            _WORKER['template'])
+                    values = None
+                    if dedup is not None and not frame.empty:
+                        observations = len(frame)
+                        frame, values = dedup.filter(frame)
+                        result['duplicates'] += observations - len(frame)
+                    if frame.empty:
+                        continue
+                    sent = send_frame(frame, _WORKER['template'],
+                                      _WORKER['sink'], _WORKER['prefix'],
+                                      _WORKER['output_format'],
+                                      _WORKER['encoder'])
+                    if indexer is not None and indexer.flush():
+                        raise RuntimeError('documents failed to index, see the worker log')  # noqa
+                    if values is not None:
+                        dedup.add(values, station['wigos_station_identifier'])  # noqa
+                    result['observations'] += len(frame)
+                    result['objects'] += len(sent)
+        if result['observations'] or result['duplicates']:
+            result['status'] = 'ok'
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = f'{type(err).__name__}: {err}'
+
+    if indexer is not None:
+        result['documents'] = indexer.documents - indexed
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def progress(done: int, total: int, elapsed: float,
+             observations: int) -> str:
+    """
+    Describe the progress of a backfill with an ETA from its throughput
+
+    :param done: `int` of units finished in this run
+    :param total: `int` of units to finish in this run
+    :param elapsed: `float` of seconds since the run started
+    :param observations: `int` of observations sent in this run
+
+    :returns: `str` of progress
+    """
+
+    units_per_second = done / elapsed if elapsed else 0
+    eta = (total - done) / units_per_second if units_per_second else 0
+
+    return (f'[{done}/{total}] {done / total:.0%}, '
+            f'{units_per_second * 60:.1f} units/min, '
+            f'{observations / elapsed if elapsed else 0:.0f} observations/s, '
+            f'ETA {timedelta(seconds=round(eta))}')
+
+
+def run(units: list, source_dir: Path, checkpoints: Checkpoints,
+        workers: int = None, rate: float = BACKFILL_RATE,
+        template_path: Path = WAVE_BUOY_TEMPLATE,
+        storage_config: dict = None, output_dir: Path = None,
+        prefix: str = WAVE_BUOY_TOPIC, output_format: str = 'csv',
+        pattern: str = SOURCE_PATTERN, dedup_path: Path = DEDUP_DB,
+        memory_budget: int = MEMORY_BUDGET, quiet: bool = False,
+        api_config: dict = None) -> list:
+    """
+    Process backfill units in a bounded process pool, checkpointing each
+
+    :param units: `list` of (station, month) from `work_units`
+    :param source_dir: `Path` of directory holding IMOS NetCDF files
+    :param checkpoints: `Checkpoints` the unit results are recorded in
+    :param workers: `int` of worker processes (default: CPU count)
+    :param rate: `float` of observations per second of all workers, 0 for
+                 no limit
+    :param template_path: `Path` of csv2bufr mapping template
+    :param storage_config: `dict` from `load_storage_config`
+    :param output_dir: `Path` to write objects to instead of uploading
+    :param prefix: `str` of incoming path objects are stored under
+    :param output_format: `str` of output format, "csv" or "bufr4"
+    :param pattern: `str` of glob pattern with a `{site}` placeholder
+    :param dedup_path: `Path` of the fingerprint database, or None
+    :param memory_budget: `int` of bytes a chunk may take while converted
+    :param quiet: `bool` whether to leave out the progress lines
+    :param api_config: `dict` of `url`, `index`, `batch_size`, `workers`
+                       and `refresh_interval` of the Elasticsearch index
+                       to load documents into instead of sending objects
+
+    :returns: `list` of unit result `dict`
+    """
+
+    results = []
+    workers = workers or os.cpu_count()
+    initargs = (template_path, storage_config, output_dir, prefix,
+                output_format, rate, workers, dedup_path, memory_budget,
+                api_config)
+
+    refresh = nullcontext()
+    if api_config and api_config['refresh_interval'] is not None:
+        refresh = relaxed_refresh(api_config['url'], api_config['index'],
+                                  api_config['refresh_interval'])
+
+    start = time.perf_counter()
+    observations = 0
+    with refresh, ProcessPoolExecutor(max_workers=workers,
+                                      initializer=init_worker,
+                                      initargs=initargs) as executor:
+        futures = {
+            executor.submit(process_unit, station, month, source_dir, pattern): (station, month)  # noqa
+            for station, month in units
+        }
+        for future in as_completed(futures):
+            station, month = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as err:
+                result = {
+                    'wigos_station_identifier': station['wigos_station_identifier'],  # noqa
+                    'month': month,
+                    'status': 'failed',
+                    'observations': 0,
+                    'duplicates': 0,
+                    'objects': 0,
+                    'documents': 0,
+                    'error': f'worker died: {err}',
+                    'seconds': 0
+                }
+            checkpoints.record(result)
+            results.append(result)
+            observations += result['observations']
+
+            if not quiet:
+                print(f"{progress(len(results), len(units), time.perf_counter() - start, observations)} "  # noqa
+                      f"{result['wigos_station_identifier']} {month}: {result['status']}"  # noqa
+                      f" {result['observations']} observations"
+                      + (f" ({result['error']})" if result['error'] else ''),
+                      flush=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='backfill historical IMOS wave buoy observations into wis2box')  # noqa
+    parser.add_argument('source_dir', type=Path,
+                        help='directory holding IMOS delayed-mode wave parameters NetCDF files')  # noqa
+    parser.add_argument('--start', required=True,
+                        help='first month to backfill, YYYY-MM')
+    parser.add_argument('--end', required=True,
+                        help='last month to backfill, YYYY-MM')
+    parser.add_argument('--sites', type=Path, default=NATIONAL_SITES,
+                        help='IMOS national site list')
+    parser.add_argument('--station', action='append', default=[],
+                        help='only backfill this WIGOS identifier or site name (repeatable)')  # noqa
+    parser.add_argument('--pattern', default=SOURCE_PATTERN,
+                        help='file name glob pattern with a {site} placeholder')  # noqa
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--rate', type=float, default=BACKFILL_RATE,
+                        help='observations per second sent by all workers (0 for no limit)')  # noqa
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--checkpoints', type=Path,
+                        help=f'checkpoint database of finished units (default: {BACKFILL_DB}, or {BACKFILL_API_DB} with --bulk-api)')  # noqa
+    parser.add_argument('--dedup-db', type=Path, default=DEDUP_DB,
+                        help='fingerprint database of published observations')  # noqa
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--prefix', default=WAVE_BUOY_TOPIC,
+                        help='incoming path objects are stored under')
+    parser.add_argument('--format', dest='output_format',
+                        choices=OUTPUT_FORMATS, default='csv',
+                        help='send CSV for csv2bufr or encode BUFR4 in-process')  # noqa
+    parser.add_argument('--output-dir', type=Path,
+                        help='write objects to this directory instead of uploading')  # noqa
+    parser.add_argument('--memory-budget', type=float,
+                        default=MEMORY_BUDGET / 1024 / 1024,
+                        help='MiB a chunk of TIME steps may take in a worker')  # noqa
+    parser.add_argument('--bulk-api', action='store_true',
+                        help='load GeoJSON documents into the wis2box API through _bulk instead of sending objects (implies --format bufr4)')  # noqa
+    parser.add_argument('--api-backend-url',
+                        help='Elasticsearch URL (default: WIS2BOX_API_BACKEND_URL)')  # noqa
+    parser.add_argument('--api-index', default=API_INDEX,
+                        help='Elasticsearch index of the collection')
+    parser.add_argument('--bulk-size', type=int, default=BULK_DOCUMENTS,
+                        help='documents per _bulk request')
+    parser.add_argument('--bulk-workers', type=int, default=BULK_WORKERS,
+                        help='concurrent _bulk requests per worker process')
+    parser.add_argument('--refresh-interval', default=RELAXED_REFRESH,
+                        help='refresh interval of the index while loading (-1 for none, "keep" to leave it)')  # noqa
+    parser.add_argument('--redo', action='store_true',
+                        help='forget the checkpoints of the selected units and redo them')  # noqa
+    parser.add_argument('--plan', action='store_true',
+                        help='list the units still to do and exit')
+    parser.add_argument('--status', action='store_true',
+                        help='summarise the checkpoints and exit')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not print progress per unit')
+    parser.add_argument('--json', action='store_true',
+                        help='print the summary as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    stations = load_national_sites(args.sites)
+    if args.station:
+        selected = set(args.station)
+        stations = [s for s in stations
+                    if {s['wigos_station_identifier'], s['site_name']} & selected]  # noqa
+    months = month_range(args.start, args.end)
+
+    checkpoints_path = args.checkpoints or (BACKFILL_API_DB if args.bulk_api else BACKFILL_DB)  # noqa
+
+    with Checkpoints(checkpoints_path) as checkpoints:
+        if args.status:
+            for row in checkpoints.status():
+                print(f"{row['wigos_station_identifier']}: {row['units']} {row['status']} units "  # noqa
+                      f"({row['first_month']} to {row['last_month']}), "
+                      f"{row['observations']} observations")
+            return
+
+        if args.redo:
+            checkpoints.reset([(s['wigos_station_identifier'], m)
+                               for s, m in work_units(stations, months)])
+
+        done = checkpoints.done()
+        units = work_units(stations, months, done)
+        skipped = len(stations) * len(months) - len(units)
+        print(f'{len(units)} units to do for {len(stations)} stations and '
+              f'{len(months)} months, {skipped} already done', flush=True)
+
+        if args.plan:
+            for station, month in units:
+                print(f"  {station['wigos_station_identifier']} ({station['station_name']}) {month}")  # noqa
+            return
+
+        storage_config, api_config = None, None
+        dedup_path, output_format = args.dedup_db, args.output_format
+        if args.bulk_api:
+            # documents have deterministic ids, reloading overwrites them
+            dedup_path, output_format = None, 'bufr4'
+            api_config = {
+                'url': load_api_backend(args.env_file, args.api_backend_url),
+                'index': args.api_index,
+                'batch_size': args.bulk_size,
+                'workers': args.bulk_workers,
+                'refresh_interval': None if args.refresh_interval == 'keep' else args.refresh_interval  # noqa
+            }
+        elif not args.output_dir:
+            storage_config = load_storage_config(args.env_file,
+                                                 args.storage_source)
+
+        start = time.perf_counter()
+        results = run(units, args.source_dir, checkpoints, args.workers,
+                      args.rate, args.template, storage_config,
+                      args.output_dir, args.prefix, output_format,
+                      args.pattern, dedup_path,
+                      int(args.memory_budget * 1024 * 1024), args.quiet,
+                      api_config)
+        elapsed = time.perf_counter() - start
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    summary = {
+        'units': len(results),
+        'skipped': skipped,
+        'elapsed': elapsed,
+        'status': counts,
+        'observations': sum(r['observations'] for r in results),
+        'duplicates': sum(r['duplicates'] for r in results),
+        'objects': sum(r['objects'] for r in results),
+        'documents': sum(r['documents'] for r in results),
+        'failures': [r for r in results if r['status'] == 'failed']
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=4))
+    else:
+        print(f"Backfilled {summary['units']} units in {elapsed:.1f}s: "
+              f"{summary['observations']} observations as "
+              f"{summary['objects']} objects, {summary['duplicates']} "
+              'duplicates skipped')
+        if api_config:
+            print(f"  {summary['documents']} documents loaded into "
+                  f"{api_config['index']}: "
+                  f"{summary['documents'] / elapsed if elapsed else 0:.0f} documents/s")  # noqa
+        print('  ' + ', '.join(f'{k}: {v}' for k, v in sorted(counts.items())))  # noqa
+        for failure in summary['failures']:
+            print(f"  FAILED {failure['wigos_station_identifier']} {failure['month']}: {failure['error']}")  # noqa
+
+    sys.exit(1 if summary['failures'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,572 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Upload rate control keeping the wis2box broker queues short
+
+Every object stored in wis2box-incoming becomes a MinIO notification on
+`wis2box/storage`, which mosquitto queues for wis2box-management up to
+WIS2BOX_BROKER_QUEUE_MAX messages and then drops.  `AIMDThrottle` paces
+uploads with a token bucket whose rate grows while the queue stays short
+and is halved once it fills or processing lags behind, the way TCP
+congestion control probes for the highest rate that loses nothing.
+
+The queue depth is estimated from two signals of `BrokerMonitor`:
+
+- objects uploaded but not yet published by wis2box-management, matched
+  with the WIS2 notifications on `origin/a/wis2/#` by the
+  WIGOS_<wsi>_<timestamp> name their key and `data_id` share, so the
+  notifications of other uploaders are not counted
+- the number of messages mosquitto stores, from
+  `$SYS/broker/store/messages/count`, where the broker publishes it
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from dotenv import dotenv_values
+import paho.mqtt.client as mqtt
+
+from aodn_pipeline import WIS2BOX_ENV
+
+LOGGER = logging.getLogger(__name__)
+
+STORE_COUNT_TOPIC = '$SYS/broker/store/messages/count'
+DONE_TOPIC = 'origin/a/wis2/#'
+
+# objects and notifications share the WIGOS_<wsi>_<YYYYmmddTHHMMSS> name
+NAME_PATTERN = re.compile(r'WIGOS_[0-9A-Za-z-]+_\d{8}T\d{6}')
+
+# notifications kept for objects whose upload is not recorded yet
+EARLY_MAX = 1000
+
+# share of WIS2BOX_BROKER_QUEUE_MAX the queue may fill before backing off
+QUEUE_SHARE = 0.5
+
+# share of the target depth at which slow start ends
+SLOW_START_SHARE = 0.25
+
+
+def correlation_key(name: str) -> str:
+    """
+    Extract the name an object and its notifications share
+
+    :param name: `str` of object key, data_id or link
+
+    :returns: `str` of WIGOS_<wsi>_<timestamp>, or the file name without
+              extension if the name does not follow the convention
+    """
+
+    match = NAME_PATTERN.search(name)
+    if match:
+        return match.group(0)
+
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def load_broker_config(env_file: Path = WIS2BOX_ENV,
+                       broker: str = None) -> dict:
+    """
+    Read the wis2box broker settings from wis2box.env
+
+    :param env_file: `Path` of wis2box.env
+    :param broker: `str` of broker URL (mqtt://host:port) overriding
+                   WIS2BOX_BROKER_HOST and WIS2BOX_BROKER_PORT, which
+                   usually point at the in-compose hostname mosquitto
+
+    :returns: `dict` of broker settings
+    """
+
+    env = dotenv_values(env_file)
+    url = urlparse(broker or f"mqtt://{env.get('WIS2BOX_BROKER_HOST', 'localhost')}:{env.get('WIS2BOX_BROKER_PORT', 1883)}")  # noqa
+
+    return {
+        'host': url.hostname,
+        'port': url.port or 1883,
+        'username': url.username or env.get('WIS2BOX_BROKER_USERNAME'),
+        'password': url.password or env.get('WIS2BOX_BROKER_PASSWORD'),
+        'queue_max': int(env.get('WIS2BOX_BROKER_QUEUE_MAX', 1000))
+    }
+
+
+class TokenBucket:
+    """Blocking token bucket with an adjustable rate"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        """
+        :param rate: `float` of tokens added per second
+        :param burst: `float` of tokens that may accumulate
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float, burst: float = None) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.burst = burst or self.burst
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens, waiting while the bucket is empty
+
+        Requests larger than the burst wait for a full bucket and leave
+        the bucket in debt, so the long-run rate still holds.
+
+        :param tokens: `float` of tokens to take
+
+        :returns: `float` of seconds waited
+        """
+
+        waited = 0
+        while True:
+            with self._lock:
+                self._refill()
+                needed = min(tokens, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class BrokerMonitor:
+    """MQTT subscriber estimating the notification queue of wis2box"""
+
+    def __init__(self, config: dict, done_topic: str = DONE_TOPIC,
+                 client_id: str = None, share: float = 1.0):
+        """
+        :param config: `dict` from `load_broker_config`
+        :param done_topic: `str` of topic filter of processed notifications
+        :param client_id: `str` of MQTT client identifier
+        :param share: `float` of the broker store count attributed to
+                      this uploader, 1 / workers when several processes
+                      upload side by side
+        """
+
+        self._lock = threading.Lock()
+        # correlation key of each object not yet published, by upload time
+        self._sent = collections.OrderedDict()
+        self.share = share
+        # keys of notifications that arrived before their upload was
+        # recorded, bounded as notifications of other uploaders land here
+        self._credit = collections.OrderedDict()
+        self.sent = 0
+        self.processed = 0
+        self.lost = 0
+        self.stored = None
+        self.stored_at = None
+
+        subscribed = threading.Event()
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=client_id or f'aodn-pipeline-backpressure-{os.getpid()}')  # noqa
+        if config.get('username'):
+            self.client.username_pw_set(config['username'],
+                                        config.get('password'))
+        self.client.on_subscribe = lambda *args: subscribed.set()
+        self.client.message_callback_add(done_topic, self.on_done)
+        self.client.message_callback_add(STORE_COUNT_TOPIC, self.on_stored)
+        self.client.connect(config['host'], config['port'])
+        self.client.subscribe([(done_topic, 0), (STORE_COUNT_TOPIC, 0)])
+        self.client.loop_start()
+        if not subscribed.wait(10):
+            raise TimeoutError(f"No SUBACK from {config['host']}:{config['port']}")  # noqa
+
+    def on_done(self, client, userdata, message) -> None:
+        try:
+            notification = json.loads(message.payload)
+            names = [notification.get('properties', {}).get('data_id')]
+            names.extend(link.get('href')
+                         for link in notification.get('links', []))
+        except (ValueError, AttributeError):
+            return
+        keys = {correlation_key(name) for name in names
+                if isinstance(name, str) and name}
+
+        with self._lock:
+            for key in keys:
+                if self._sent.pop(key, None) is not None:
+                    self.processed += 1
+                    return
+            for key in keys:
+                self._credit[key] = None
+            while len(self._credit) > EARLY_MAX:
+                self._credit.popitem(last=False)
+
+    def on_stored(self, client, userdata, message) -> None:
+        try:
+            stored = int(message.payload)
+        except ValueError:
+            return
+        with self._lock:
+            self.stored = stored
+            self.stored_at = time.monotonic()
+
+    def record_sent(self, key: str) -> None:
+        """
+        Count an object stored in wis2box-incoming
+
+        :param key: `str` of object key
+
+        :returns: None
+        """
+
+        key = correlation_key(key)
+        with self._lock:
+            self.sent += 1
+            if key in self._credit:
+                del self._credit[key]
+                self.processed += 1
+            elif key not in self._sent:
+                self._sent[key] = time.monotonic()
+
+    def depth(self, max_age: float = 60) -> int:
+        """
+        Estimate the number of notifications waiting for wis2box-management
+
+        :param max_age: `float` of seconds after which the $SYS store count
+                        is ignored
+
+        :returns: `int` of queued notifications
+        """
+
+        with self._lock:
+            depth = len(self._sent)
+            if self.stored_at and time.monotonic() - self.stored_at < max_age:  # noqa
+                depth = max(depth, int(self.stored * self.share))
+            return depth
+
+    def expire(self, max_age: float) -> int:
+        """
+        Give up on objects not published after a number of seconds, whose
+        notifications were presumably dropped
+
+        :param max_age: `float` of seconds after which an object is lost
+
+        :returns: `int` of objects given up on
+        """
+
+        oldest = time.monotonic() - max_age
+        expired = 0
+        with self._lock:
+            while self._sent and next(iter(self._sent.values())) < oldest:
+                self._sent.popitem(last=False)
+                expired += 1
+            self.lost += expired
+
+        return expired
+
+    def lag(self) -> float:
+        """
+        Age of the oldest object not yet published by wis2box-management
+
+        :returns: `float` of seconds
+        """
+
+        with self._lock:
+            if not self._sent:
+                return 0.0
+            return time.monotonic() - next(iter(self._sent.values()))
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class AIMDThrottle:
+    """
+    Token bucket paced by additive increase, multiplicative decrease of
+    its rate on the queue depth reported by a `BrokerMonitor`
+    """
+
+    def __init__(self, monitor: BrokerMonitor, queue_max: int = 1000,
+                 rate: float = 50, min_rate: float = 1,
+                 max_rate: float = 10000, increase: float = 10,
+                 decrease: float = 0.5, max_lag: float = 20,
+                 interval: float = 0.2):
+        """
+        :param monitor: `BrokerMonitor` of the wis2box broker
+        :param queue_max: `int` of WIS2BOX_BROKER_QUEUE_MAX
+        :param rate: `float` of initial objects per second
+        :param min_rate: `float` of lowest objects per second
+        :param max_rate: `float` of highest objects per second
+        :param increase: `float` of objects per second added per interval
+        :param decrease: `float` factor the rate is multiplied by when
+                         the queue fills
+        :param max_lag: `float` of seconds after which an unpublished
+                        object counts as lost
+        :param interval: `float` of seconds between rate adjustments
+        """
+
+        self.monitor = monitor
+        self.target = max(int(queue_max * QUEUE_SHARE), 1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_lag = max_lag
+        self.interval = interval
+
+        # double the rate each interval until the queue starts to build
+        self.slow_start = True
+        self.decreases = 0
+        self.waited = 0.0
+        self._limited = False
+        self._last_decrease = 0.0
+        self.bucket = TokenBucket(rate, self.burst(rate))
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='aimd-throttle')
+        self._thread.start()
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def burst(self, rate: float) -> float:
+        # at most a tenth of a second of uploads at once
+        return max(rate / 10, 1)
+
+    def acquire(self) -> None:
+        """Wait until the next upload may start"""
+
+        waited = self.bucket.acquire()
+        if waited:
+            self.waited += waited
+            self._limited = True
+
+    def sent(self, key: str) -> None:
+        """
+        Record an object stored in wis2box-incoming
+
+        :param key: `str` of object key
+
+        :returns: None
+        """
+
+        self.monitor.record_sent(key)
+
+    def adjust(self) -> float:
+        """
+        Adapt the rate to the current queue depth and lost notifications
+
+        The rate is decreased at most once per `max(interval, lag)` so
+        that a queue still draining from the previous decrease does not
+        collapse it further, and only increased while it held uploads
+        back, so an idle producer does not build up an unused rate.
+
+        :returns: `float` of the new rate
+        """
+
+        lost = self.monitor.expire(self.max_lag)
+        depth = self.monitor.depth()
+        lag = self.monitor.lag()
+        rate = self.rate
+        now = time.monotonic()
+        limited, self._limited = self._limited, False
+
+        if lost or depth > self.target:
+            self.slow_start = False
+            if now - self._last_decrease >= max(self.interval, lag):
+                self.decreases += 1
+                self._last_decrease = now
+                rate = max(rate * self.decrease, self.min_rate)
+                LOGGER.debug(f'queue {depth}/{self.target}, {lost} lost: rate {rate:.1f}/s')  # noqa
+        elif self.slow_start and depth > self.target * SLOW_START_SHARE:
+            self.slow_start = False
+        elif limited and self.slow_start:
+            rate = min(rate * 2, self.max_rate)
+        elif limited:
+            rate = min(rate + self.increase, self.max_rate)
+
+        if rate != self.rate:
+            self.bucket.set_rate(rate, self.burst(rate))
+        return rate
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.adjust()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.monitor.close()
+
+
+def create_throttle(config: dict, workers: int = 1,
+                    **kwargs) -> AIMDThrottle:
+    """
+    Create the throttle of one of several uploading processes
+
+    Each process gets an equal share of the queue, and AIMD makes
+    processes sharing the queue converge on equal rates.
+
+    :param config: `dict` from `load_broker_config`
+    :param workers: `int` of processes uploading side by side
+    :param kwargs: extra keyword arguments passed to `AIMDThrottle`
+
+    :returns: `AIMDThrottle`
+    """
+
+    monitor = BrokerMonitor(config, share=1 / workers)
+    return AIMDThrottle(monitor, config['queue_max'] // workers, **kwargs)
+
+
+def drain(monitor: BrokerMonitor, timeout: float) -> bool:
+    """
+    Wait for wis2box to publish every uploaded object
+
+    :param monitor: `BrokerMonitor` of the wis2box broker
+    :param timeout: `float` of seconds to wait
+
+    :returns: `bool` of whether the queue drained
+    """
+
+    deadline = time.monotonic() + timeout
+    while monitor.depth() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    return not monitor.depth()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='measure paced uploads against the wis2box notification queue')  # noqa
+    parser.add_argument('--objects', type=int, default=2000,
+                        help='number of objects to upload')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='object size in bytes')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent PUT requests')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='initial uploads per second')
+    parser.add_argument('--no-throttle', action='store_true',
+                        help='upload as fast as possible for comparison')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='seconds to wait for the queue to drain')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage and broker settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--broker',
+                        help='broker URL (default: WIS2BOX_BROKER_HOST and WIS2BOX_BROKER_PORT)')  # noqa
+    parser.add_argument('--standin', action='store_true',
+                        help='upload to in-process S3 and MQTT stand-ins')
+    parser.add_argument('--process-rate', type=float, default=200,
+                        help='notifications the stand-in processes per second')  # noqa
+    parser.add_argument('--queue-max', type=int, default=1000,
+                        help='WIS2BOX_BROKER_QUEUE_MAX of the stand-in')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from aodn_pipeline.upload import BulkUploader, benchmark, load_storage_config  # noqa
+
+    s3 = broker = None
+    if args.standin:
+        from aodn_pipeline.standins import (MQTTStandIn, S3StandIn,
+                                            wis2_notification)
+        broker = MQTTStandIn().start()
+        broker.process(args.process_rate, args.queue_max,
+                       transform=wis2_notification)
+        s3 = S3StandIn(['wis2box-incoming']).start()
+        s3.on_put.append(broker.notify_storage())
+        storage_config = {'source': s3.url, 'incoming': 'wis2box-incoming',
+                          'username': 'wis2box', 'password': 'wis2box'}
+        broker_config = {'host': broker.address[0],
+                         'port': broker.address[1],
+                         'queue_max': args.queue_max}
+    else:
+        storage_config = load_storage_config(args.env_file,
+                                             args.storage_source)
+        broker_config = load_broker_config(args.env_file, args.broker)
+
+    monitor = BrokerMonitor(broker_config)
+    throttle = None
+    if not args.no_throttle:
+        throttle = AIMDThrottle(monitor, broker_config['queue_max'], args.rate)
+
+    try:
+        with BulkUploader(storage_config, args.concurrency,
+                          throttle=throttle) as uploader:
+            results = benchmark(uploader, args.objects, args.size)
+        if not throttle:
+            for n in range(results['objects']):
+                monitor.record_sent(f'benchmark/object-{n:06d}.bufr4')
+        start = time.perf_counter()
+        results['drained'] = drain(monitor, args.timeout)
+        results['drain_seconds'] = time.perf_counter() - start
+        results['processed'] = monitor.processed
+        if throttle:
+            results['final_rate'] = throttle.rate
+            results['decreases'] = throttle.decreases
+        if broker:
+            results['dropped'] = broker.dropped
+    finally:
+        if throttle:
+            throttle.close()
+        else:
+            monitor.close()
+        for standin in (s3, broker):
+            if standin:
+                standin.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f"{results['objects']} objects in {results['elapsed']:.2f}s "
+          f"({results['objects_per_second']:.0f} objects/s), "
+          f"{results['processed']} published by wis2box, "
+          f"queue drained in {results['drain_seconds']:.2f}s")
+    if throttle:
+        print(f"  final rate {results['final_rate']:.0f}/s after "
+              f"{results['decreases']} decreases")
+    if broker:
+        print(f"  {results['dropped']} notifications dropped")
+
+
+if __name__ == '__main__':
+    main()
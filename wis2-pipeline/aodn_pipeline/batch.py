@@ -0,0 +1,202 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Batching of wave buoy observations into multi-subset BUFR messages
+
+Observations are grouped by batching window, either per station (e.g. all
+readings of a buoy within an hour) or across stations (all buoys reporting
+in the same time slot), and each group is encoded as one compressed
+multi-subset message.  A backfill then produces one object, MinIO event and
+notification per batch instead of per 30-minute reading.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from aodn_pipeline import (STATION_LIST, WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC,
+                           WIS2BOX_ENV)
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import (convert_dataset, load_station,
+                                   load_template, observation_times)
+from aodn_pipeline.ingest import directory_sink
+from aodn_pipeline.upload import BulkUploader, load_storage_config
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_BY = ('station', 'slot')
+
+# upper bound of subsets per message, keeping messages well below the
+# size limits of wis2box-management and the broker
+MAX_SUBSETS = 1000
+
+
+def batch_groups(frame: pd.DataFrame, window: int, by: str = 'station',
+                 max_subsets: int = MAX_SUBSETS) -> list:
+    """
+    Split observations into batches
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+    :param window: `int` of batching window in seconds
+    :param by: `str` of "station" to batch each station separately or
+               "slot" to batch all stations of a time slot together
+    :param max_subsets: `int` of maximum observations per batch
+
+    :returns: `list` of (`numpy.datetime64` window start,
+              `pandas.DataFrame`) tuples
+    """
+
+    if by not in BATCH_BY:
+        raise ValueError(f'Invalid batching {by}, expected one of {BATCH_BY}')  # noqa
+
+    seconds = observation_times(frame).astype(np.int64)
+    slots = seconds // window * window
+
+    keys = [slots]
+    if by == 'station':
+        keys.append(frame['wigos_station_identifier'].to_numpy())
+
+    batches = []
+    for key, group in frame.groupby(keys, sort=True):
+        start = np.datetime64(int(key[0]), 's')
+        for offset in range(0, len(group), max_subsets):
+            batches.append((start, group.iloc[offset:offset + max_subsets]))
+
+    return batches
+
+
+def batch_filename(start: np.datetime64, batch: pd.DataFrame,
+                   by: str, part: int = 0) -> str:
+    """
+    Name a batch object after its window start, and its station when
+    batching per station
+
+    :param start: `numpy.datetime64` of window start
+    :param batch: `pandas.DataFrame` of observations in the batch
+    :param by: `str` of batching, "station" or "slot"
+    :param part: `int` of part number when a window holds several batches
+
+    :returns: `str` of filename ending in _batch.bufr4
+    """
+
+    timestamp = pd.Timestamp(start).strftime('%Y%m%dT%H%M%S')
+    suffix = f'_{part}' if part else ''
+
+    if by == 'station':
+        wsi = batch['wigos_station_identifier'].iloc[0]
+        return f'WIGOS_{wsi}_{timestamp}{suffix}_batch.bufr4'
+
+    return f'WAVE-BUOYS_{timestamp}{suffix}_batch.bufr4'
+
+
+def encode_batches(frame: pd.DataFrame, encoder: BufrEncoder, window: int,
+                   by: str = 'station', max_subsets: int = MAX_SUBSETS,
+                   prefix: str = WAVE_BUOY_TOPIC):
+    """
+    Encode observations as batched multi-subset BUFR messages
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+    :param encoder: `BufrEncoder` of the mapping template
+    :param window: `int` of batching window in seconds
+    :param by: `str` of batching, "station" or "slot"
+    :param max_subsets: `int` of maximum observations per message
+    :param prefix: `str` of incoming path objects are stored under
+
+    :returns: generator of (key, message bytes, subsets) tuples
+    """
+
+    names = {}
+    for start, batch in batch_groups(frame, window, by, max_subsets):
+        name = batch_filename(start, batch, by)
+        names[name] = names.get(name, -1) + 1
+        if names[name]:
+            name = batch_filename(start, batch, by, names[name])
+        yield f'{prefix}/{name}', encoder.encode(batch), len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='encode IMOS wave buoy NetCDF as batched multi-subset BUFR')  # noqa
+    parser.add_argument('nc_files', type=Path, nargs='+',
+                        help='IMOS wave parameters NetCDF files')
+    parser.add_argument('--window', type=int, default=3600,
+                        help='batching window in seconds')
+    parser.add_argument('--by', choices=BATCH_BY, default='station',
+                        help='batch per station or across stations per time slot')  # noqa
+    parser.add_argument('--max-subsets', type=int, default=MAX_SUBSETS,
+                        help='maximum observations per message')
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='wis2box station list')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent uploads')
+    parser.add_argument('--prefix', default=WAVE_BUOY_TOPIC,
+                        help='incoming path objects are stored under')
+    parser.add_argument('--output-dir', type=Path,
+                        help='write messages to this directory instead of uploading')  # noqa
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    template = load_template(args.template)
+    frames = []
+    for nc_file in args.nc_files:
+        with xr.open_dataset(nc_file, engine='h5netcdf') as ds:
+            station = load_station(ds.attrs.get('site_name'),
+                                   station_list=args.station_list)
+            frames.append(convert_dataset(ds, station, template))
+    frame = pd.concat(frames, ignore_index=True)
+
+    messages = encode_batches(frame, BufrEncoder(template), args.window,
+                              args.by, args.max_subsets, args.prefix)
+
+    count = subsets = size = 0
+    if args.output_dir:
+        sink = directory_sink(args.output_dir)
+        for key, message, n in messages:
+            sink(key, message)
+            count, subsets, size = count + 1, subsets + n, size + len(message)
+    else:
+        config = load_storage_config(args.env_file, args.storage_source)
+        with BulkUploader(config, args.concurrency) as uploader:
+            futures = []
+            for key, message, n in messages:
+                futures.append(uploader.submit(key, message))
+                count, subsets, size = count + 1, subsets + n, size + len(message)  # noqa
+            for future in futures:
+                future.result()
+
+    print(f'Encoded {subsets} observations as {count} messages '
+          f'({size} bytes, {subsets / max(count, 1):.1f} observations/message)')  # noqa
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+End-to-end benchmark of the AODN pipeline against local stand-ins
+
+Every sample NetCDF file is read, converted, encoded and uploaded to an
+in-process S3 stand-in once per buoy, through the `open_pruned` and
+`ingest_dataset` path of the runner, and each stored object is followed
+until its MinIO-style notification arrives on a local MQTT broker.  Sample
+BUFR files are uploaded as-is alongside.  Per-stage latency percentiles,
+throughput and peak RSS are reported and can be saved as JSON to compare
+runs across commits.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+from pathlib import Path
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import paho.mqtt.client as mqtt
+
+from aodn_pipeline import WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import load_template
+from aodn_pipeline.ingest import OUTPUT_FORMATS, ingest_dataset
+from aodn_pipeline.reader import open_pruned
+from aodn_pipeline.standins import MQTTStandIn, S3StandIn
+from aodn_pipeline.state import StateStore
+from aodn_pipeline.stations import NATIONAL_SITES, load_national_sites
+from aodn_pipeline.upload import BulkUploader
+
+LOGGER = logging.getLogger(__name__)
+
+REPOSITORY = Path(__file__).resolve().parents[2]
+SAMPLE_DATA = REPOSITORY / 'resources' / 'wis2-notebooks' / 'data'
+
+STAGES = ('read', 'convert', 'encode', 'upload', 'notify')
+PERCENTILES = (50, 90, 99)
+
+# metrics compared against a baseline, with whether higher is better
+COMPARED_METRICS = {
+    'throughput.observations_per_second': True,
+    'throughput.objects_per_second': True,
+    'throughput.mb_per_second': True,
+    'peak_rss_mb': False
+}
+
+
+def latency_stats(samples: list, percentiles: tuple = PERCENTILES) -> dict:
+    """
+    Summarise latency samples
+
+    :param samples: `list` of latencies in seconds
+    :param percentiles: `tuple` of percentiles to report
+
+    :returns: `dict` of count, mean, percentiles and max in milliseconds
+    """
+
+    if not samples:
+        return {'count': 0}
+
+    values = np.asarray(samples) * 1000
+    stats = {'count': len(values), 'mean_ms': float(values.mean())}
+    for percentile, value in zip(percentiles,
+                                 np.percentile(values, percentiles)):
+        stats[f'p{percentile}_ms'] = float(value)
+    stats['max_ms'] = float(values.max())
+
+    return stats
+
+
+def peak_rss() -> float:
+    """
+    Peak resident set size of this process
+
+    :returns: `float` of megabytes
+    """
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if sys.platform == 'darwin':
+        maxrss /= 1024
+
+    return maxrss / 1024
+
+
+def git_commit() -> str:
+    """
+    Commit of the working tree, so results can be compared across commits
+
+    :returns: `str` of abbreviated commit hash, or None outside git
+    """
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=REPOSITORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_files(data_dir: Path = SAMPLE_DATA) -> tuple:
+    """
+    Find the sample NetCDF and BUFR files used as benchmark input
+
+    :param data_dir: `Path` of sample data directory
+
+    :returns: `tuple` of (NetCDF files, BUFR files) lists of `Path`
+    """
+
+    nc_files = sorted(Path(data_dir).glob('*_WAVE-PARAMETERS_*.nc'))
+    bufr_files = sorted(Path(data_dir).glob('*.bufr4'))
+    if not nc_files:
+        raise FileNotFoundError(f'No wave parameters NetCDF in {data_dir}')
+
+    return nc_files, bufr_files
+
+
+class NotificationListener:
+    """MQTT subscriber timing the arrival of storage notifications"""
+
+    def __init__(self, host: str, port: int,
+                 topic: str = 'wis2box/storage'):
+        self.received = {}
+        self._expected = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+        subscribed = threading.Event()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id='aodn-pipeline-bench')
+        self.client.on_subscribe = lambda *args: subscribed.set()
+        self.client.on_message = self.on_message
+        self.client.connect(host, port)
+        self.client.subscribe(topic, qos=1)
+        self.client.loop_start()
+        if not subscribed.wait(10):
+            raise TimeoutError(f'No SUBACK from {host}:{port}')
+
+    def on_message(self, client, userdata, message) -> None:
+        received = time.perf_counter()
+        key = json.loads(message.payload)['Records'][0]['s3']['object']['key']  # noqa
+        with self._lock:
+            self.received[key] = received
+            if self._expected is not None and \
+                    len(self.received) >= self._expected:
+                self._done.set()
+
+    def wait(self, expected: int, timeout: float) -> bool:
+        """
+        Wait for a number of notifications
+
+        :param expected: `int` of notifications to wait for
+        :param timeout: `float` of seconds to wait
+
+        :returns: `bool` of whether all notifications arrived
+        """
+
+        with self._lock:
+            self._expected = expected
+            if len(self.received) >= expected:
+                self._done.set()
+
+        return self._done.wait(timeout)
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run_benchmark(nc_files: list, bufr_files: list, stations: list,
+                  template: dict, output_format: str = 'bufr4',
+                  concurrency: int = 8, prefix: str = WAVE_BUOY_TOPIC,
+                  timeout: float = 60) -> dict:
+    """
+    Drive the pipeline end to end against S3 and MQTT stand-ins
+
+    :param nc_files: `list` of `Path` of wave parameters NetCDF files
+    :param bufr_files: `list` of `Path` of BUFR files uploaded as-is
+    :param stations: `list` of station `dict` each file is ingested for
+    :param template: `dict` of csv2bufr mapping template
+    :param output_format: `str` of csv or bufr4
+    :param concurrency: `int` of concurrent uploads
+    :param prefix: `str` of incoming path objects are stored under
+    :param timeout: `float` of seconds to wait for notifications
+
+    :returns: `dict` of benchmark results
+    """
+
+    encoder = BufrEncoder(template) if output_format == 'bufr4' else None
+    samples = {stage: [] for stage in STAGES}
+    submitted = {}
+    observations = 0
+    rss_start = peak_rss()
+
+    def record_upload(key):
+        def callback(future):
+            if future.exception() is None:
+                samples['upload'].append(time.perf_counter() - submitted[key])  # noqa
+        return callback
+
+    # high-water marks of a throwaway store, left where they are
+    with tempfile.TemporaryDirectory() as tmp, StateStore(Path(tmp) / 'state.sqlite3') as state:  # noqa
+        with S3StandIn(['wis2box-incoming']) as storage, MQTTStandIn() as broker:  # noqa
+            storage.on_put.append(broker.notify_storage())
+            listener = NotificationListener(*broker.address)
+            config = {'source': storage.url, 'incoming': 'wis2box-incoming',
+                      'username': 'wis2box', 'password': 'wis2box'}
+
+            start = time.perf_counter()
+            with BulkUploader(config, concurrency) as uploader:
+                def upload(key, data):
+                    submitted[key] = time.perf_counter()
+                    uploader.submit(key, data).add_done_callback(
+                        record_upload(key))
+
+                for station in stations:
+                    wsi = station['wigos_station_identifier']
+                    for nc_file in nc_files:
+                        # the runner's read path, without marks to advance
+                        start_read = time.perf_counter()
+                        with open_pruned(nc_file, template) as ds:
+                            opened = time.perf_counter() - start_read
+                            summary = ingest_dataset(ds, station, template,
+                                                     state, upload, prefix,
+                                                     False, output_format,
+                                                     encoder)
+                        timings = summary['timings']
+
+                        samples['read'].append(opened + timings['read'])
+                        samples['convert'].append(timings['convert'])
+                        samples['encode'].append(timings['encode'])
+                        observations += summary['observations']
+
+                    for bufr_file in bufr_files:
+                        upload(f'{prefix}/{wsi}/{bufr_file.name}',
+                               bufr_file.read_bytes())
+
+            complete = listener.wait(len(submitted), timeout)
+            elapsed = time.perf_counter() - start
+            listener.close()
+
+            for key, received in listener.received.items():
+                if key in submitted:
+                    samples['notify'].append(received - submitted[key])
+
+            uploaded, uploaded_bytes = uploader.objects, uploader.bytes
+            upload_errors = uploader.errors
+
+    if not complete:
+        LOGGER.warning(f'{len(submitted) - len(listener.received)} '
+                       'notifications not received')
+
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),  # noqa
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'nc_files': [f.name for f in nc_files],
+            'bufr_files': [f.name for f in bufr_files],
+            'stations': len(stations),
+            'format': output_format,
+            'concurrency': concurrency
+        },
+        'observations': observations,
+        'objects': uploaded,
+        'bytes': uploaded_bytes,
+        'upload_errors': upload_errors,
+        'notifications': len(samples['notify']),
+        'elapsed': elapsed,
+        'throughput': {
+            'observations_per_second': observations / elapsed,
+            'objects_per_second': uploaded / elapsed,
+            'mb_per_second': uploaded_bytes / elapsed / 1024 / 1024
+        },
+        'stages': {stage: latency_stats(samples[stage]) for stage in STAGES},
+        'rss_start_mb': rss_start,
+        'peak_rss_mb': peak_rss()
+    }
+
+
+def metric(results: dict, path: str):
+    value = results
+    for part in path.split('.'):
+        value = value.get(part, {}) if isinstance(value, dict) else {}
+
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare_results(results: dict, baseline: dict) -> list:
+    """
+    Compare benchmark results with a baseline run
+
+    :param results: `dict` of current results
+    :param baseline: `dict` of baseline results
+
+    :returns: `list` of `dict` with metric, baseline, current, change
+              (relative, positive is better)
+    """
+
+    metrics = dict(COMPARED_METRICS)
+    for stage in STAGES:
+        for percentile in PERCENTILES:
+            metrics[f'stages.{stage}.p{percentile}_ms'] = False
+
+    comparison = []
+    for path, higher_is_better in metrics.items():
+        before, after = metric(baseline, path), metric(results, path)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        comparison.append({
+            'metric': path,
+            'baseline': before,
+            'current': after,
+            'change': change if higher_is_better else -change
+        })
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark the AODN pipeline end to end against local stand-ins')  # noqa
+    parser.add_argument('--data-dir', type=Path, default=SAMPLE_DATA,
+                        help='directory of sample NetCDF and BUFR files')
+    parser.add_argument('--stations', type=int, default=8,
+                        help='number of national network buoys each file is ingested for')  # noqa
+    parser.add_argument('--national-sites', type=Path, default=NATIONAL_SITES,
+                        help='IMOS national wave buoy site list')
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='bufr4',
+                        help='encoding of uploaded observations')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent PUT requests')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for notifications')
+    parser.add_argument('--output', type=Path,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=Path,
+                        help='JSON results of an earlier run to compare with')  # noqa
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    nc_files, bufr_files = seed_files(args.data_dir)
+    stations = load_national_sites(args.national_sites)[:args.stations]
+    template = load_template(args.template)
+
+    results = run_benchmark(nc_files, bufr_files, stations, template,
+                            args.format, args.concurrency,
+                            timeout=args.timeout)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        results['baseline'] = {
+            'commit': baseline.get('commit'),
+            'timestamp': baseline.get('timestamp'),
+            'comparison': compare_results(results, baseline)
+        }
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=4))
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    throughput = results['throughput']
+    print(f"{results['observations']} observations, {results['objects']} "
+          f"objects ({results['bytes'] / 1024 / 1024:.1f} MB) for "
+          f"{len(stations)} buoys in {results['elapsed']:.2f}s: "
+          f"{throughput['observations_per_second']:.0f} obs/s, "
+          f"{throughput['objects_per_second']:.0f} objects/s, "
+          f"{throughput['mb_per_second']:.2f} MB/s")
+    print(f"{results['notifications']} notifications, "
+          f"{results['upload_errors']} upload errors, "
+          f"peak RSS {results['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<10}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")  # noqa
+    for stage, stats in results['stages'].items():
+        if not stats['count']:
+            continue
+        print(f"{stage:<10}{stats['count']:>8}{stats['mean_ms']:>10.2f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+    if args.baseline:
+        print(f"compared with {results['baseline']['commit']} "
+              f"({results['baseline']['timestamp']}):")
+        for item in results['baseline']['comparison']:
+            print(f"  {item['metric']:<40}{item['baseline']:>12.2f}"
+                  f"{item['current']:>12.2f}{item['change']:>+9.1%}")
+
+
+if __name__ == '__main__':
+    main()
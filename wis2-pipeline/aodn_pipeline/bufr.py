@@ -0,0 +1,189 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+BUFR4 encoding of converted wave buoy observations with ecCodes
+
+The csv2bufr mapping template is interpreted the same way as by
+wis2box.data.csv2bufr: header entries are set once per message, data
+entries are scaled, offset and range checked, and values outside the
+valid range are encoded as missing.  Unlike csv2bufr, a message may hold
+many observations as compressed subsets, and single-observation messages
+are encoded straight from the converted arrays without a CSV round-trip.
+"""
+
+import base64
+import logging
+from pathlib import Path
+
+import eccodes
+import numpy as np
+import pandas as pd
+
+from aodn_pipeline.template import TEMPLATE_CACHE, load_plan
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BufrEncoder:
+    """Encoder of csv2bufr input columns into BUFR4 messages"""
+
+    def __init__(self, template: dict, cache_dir: Path = TEMPLATE_CACHE):
+        """
+        :param template: `dict` of csv2bufr mapping template
+        :param cache_dir: `Path` of the compiled plan cache, or None to
+                          compile the template without caching
+
+        Raises `template.TemplateError` for templates that cannot be
+        encoded with.
+        """
+
+        self.template = template
+        self.plan = load_plan(template, cache_dir)
+        self.header = [tuple(item) for item in self.plan['header']]
+        self.header.append(('unexpandedDescriptors', 'array',
+                            self.plan['descriptors']))
+        self.data = self.plan['data']
+        self._base = base64.b64decode(self.plan['base_message'])
+
+    def element_values(self, element: dict, frame: pd.DataFrame) -> np.ndarray:  # noqa
+        """
+        Compute the values of a data element for every observation
+
+        :param element: `dict` of parsed data mapping
+        :param frame: `pandas.DataFrame` of csv2bufr input columns
+
+        :returns: `numpy.ndarray` of float values, missing as NaN
+        """
+
+        if element['kind'] == 'const':
+            values = np.full(len(frame), float(element['argument']))
+        else:
+            values = pd.to_numeric(frame[element['argument']],
+                                   errors='coerce').to_numpy(np.float64)
+
+        values = values * 10.0 ** element['scale'] + element['offset']
+
+        out_of_range = np.zeros(len(values), dtype=bool)
+        if element['valid_min'] is not None:
+            out_of_range |= values < element['valid_min']
+        if element['valid_max'] is not None:
+            out_of_range |= values > element['valid_max']
+        if out_of_range.any():
+            LOGGER.warning(f"{element['key']}: {out_of_range.sum()} values "
+                           'out of valid range set to missing')
+            values[out_of_range] = np.nan
+
+        return values
+
+    def encode(self, frame: pd.DataFrame) -> bytes:
+        """
+        Encode observations as the subsets of one BUFR4 message
+
+        Messages with more than one subset use BUFR compression.  The
+        section 1 typical date is taken from the first observation.
+
+        :param frame: `pandas.DataFrame` of csv2bufr input columns
+
+        :returns: `bytes` of the BUFR4 message
+        """
+
+        subsets = len(frame)
+        if subsets == 0:
+            raise ValueError('Cannot encode a message without observations')
+
+        handle = eccodes.codes_bufr_new_from_samples('BUFR4')
+        try:
+            descriptors = None
+            for key, kind, argument in self.header:
+                if kind == 'data':
+                    argument = int(frame[argument].iloc[0])
+                if key == 'unexpandedDescriptors':
+                    descriptors = argument
+                    continue
+                eccodes.codes_set(handle, key, argument)
+
+            eccodes.codes_set(handle, 'numberOfSubsets', subsets)
+            eccodes.codes_set(handle, 'compressedData', int(subsets > 1))
+            eccodes.codes_set_array(handle, 'unexpandedDescriptors',
+                                    descriptors)
+
+            for element in self.data:
+                values = self.element_values(element, frame)
+                values[np.isnan(values)] = eccodes.CODES_MISSING_DOUBLE
+                if subsets == 1:
+                    eccodes.codes_set(handle, element['key'], float(values[0]))  # noqa
+                else:
+                    eccodes.codes_set_array(handle, element['key'], values)
+
+            eccodes.codes_set(handle, 'pack', True)
+            return eccodes.codes_get_message(handle)
+        finally:
+            eccodes.codes_release(handle)
+
+    def base_message(self) -> bytes:
+        """
+        Packed single-subset message holding the template constants and
+        expanded descriptors, prebuilt by the template compiler as the
+        starting point of every single-observation message
+
+        :returns: `bytes` of the BUFR4 message
+        """
+
+        return self._base
+
+    def encode_each(self, frame: pd.DataFrame):
+        """
+        Encode every observation as its own single-subset message, as
+        csv2bufr does, but directly from the converted columns
+
+        Scaling, range checks and missing values are applied to whole
+        columns up front; per message only the prepared base message is
+        copied and its values set.
+
+        :param frame: `pandas.DataFrame` of csv2bufr input columns
+
+        :returns: generator of `bytes` of BUFR4 messages, in row order
+        """
+
+        base = self.base_message()
+
+        header = [(key, frame[argument].to_numpy(np.int64).tolist())
+                  for key, kind, argument in self.header if kind == 'data']
+
+        elements = []
+        for element in self.data:
+            values = self.element_values(element, frame)
+            values[np.isnan(values)] = eccodes.CODES_MISSING_DOUBLE
+            elements.append((element['key'], values.tolist()))
+
+        for row in range(len(frame)):
+            handle = eccodes.codes_new_from_message(base)
+            try:
+                eccodes.codes_set(handle, 'unpack', True)
+                for key, values in header:
+                    eccodes.codes_set(handle, key, values[row])
+                for key, values in elements:
+                    eccodes.codes_set(handle, key, values[row])
+                eccodes.codes_set(handle, 'pack', True)
+                yield eccodes.codes_get_message(handle)
+            finally:
+                eccodes.codes_release(handle)
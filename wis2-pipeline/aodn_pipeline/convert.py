@@ -0,0 +1,324 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Convert IMOS coastal wave buoy NetCDF files into the CSV consumed by
+wis2box.data.csv2bufr.ObservationDataCSV2BUFR using wave_buoy_template.json
+
+Every column is computed as a whole-array NumPy operation over the TIME
+dimension, so a monthly file converts without any per-row Python work.
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from aodn_pipeline import STATION_LIST, WAVE_BUOY_TEMPLATE
+from aodn_pipeline.stations import NATIONAL_SITES, load_registry
+
+LOGGER = logging.getLogger(__name__)
+
+# template columns taken from NetCDF coordinates rather than variables
+COORDINATE_COLUMNS = {
+    'latitude': 'LATITUDE',
+    'longitude': 'LONGITUDE'
+}
+
+# template columns derived from the TIME coordinate
+TIME_COLUMNS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+# template columns derived from the station metadata
+STATION_COLUMNS = (
+    'wigos_station_identifier',
+    'regionNumber',
+    'wmoRegionSubArea',
+    'buoyOrPlatformIdentifier'
+)
+
+# IMOS QC flags (bad, missing) for which values are published as missing
+QC_REJECT_FLAGS = (4, 9)
+
+
+def load_template(path: Path = WAVE_BUOY_TEMPLATE) -> dict:
+    """
+    Load a csv2bufr mapping template
+
+    :param path: `Path` of the csv2bufr mapping template
+
+    :returns: `dict` of the template
+    """
+
+    with Path(path).open() as fh:
+        return json.load(fh)
+
+
+def template_columns(template: dict) -> list:
+    """
+    List the CSV columns referenced by `data:` values in a template
+
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `list` of column names, in order of first use
+    """
+
+    columns = []
+    values = [template.get('wigos_station_identifier', '')]
+    for section in ('header', 'data'):
+        values.extend(item.get('value', '') for item in template.get(section, []))  # noqa
+
+    for value in values:
+        if value.startswith('data:'):
+            column = value.split(':', 1)[1]
+            if column not in columns:
+                columns.append(column)
+
+    return columns
+
+
+def load_station(site_name: str = None, wigos_station_identifier: str = None,
+                 station_list: Path = STATION_LIST,
+                 national_sites: Path = NATIONAL_SITES) -> dict:
+    """
+    Look up a station by WIGOS identifier or site name in the station
+    registry, loaded once per process from the national site list and
+    station_list.csv
+
+    Site names are compared case-insensitively with spaces and dashes
+    treated alike, so the NetCDF `site_name` (APOLLO-BAY) matches the
+    station list entry (Apollo-bay).
+
+    :param site_name: `str` of the site name, e.g. from the NetCDF attributes
+    :param wigos_station_identifier: `str` of WIGOS station identifier
+    :param station_list: `Path` of the wis2box station list
+    :param national_sites: `Path` of IMOS_CWB_NationalSites.csv
+
+    :returns: `dict` of the station list row
+    """
+
+    registry = load_registry(Path(national_sites), Path(station_list))
+    return registry.lookup(site_name, wigos_station_identifier)
+
+
+def split_wmo_identifier(traditional_station_identifier: str) -> tuple:
+    """
+    Split a 7-digit WMO buoy identifier (A1 bw nbnbnb) into its
+    region, sub-area and platform number
+
+    :param traditional_station_identifier: `str` of WMO identifier
+
+    :returns: `tuple` of (regionNumber, wmoRegionSubArea,
+              buoyOrPlatformIdentifier)
+    """
+
+    identifier = traditional_station_identifier.strip()
+    if len(identifier) != 7 or not identifier.isdigit():
+        raise ValueError(f'Invalid WMO buoy identifier: {identifier}')
+
+    return int(identifier[0]), int(identifier[1]), int(identifier[2:])
+
+
+def time_columns(times: np.ndarray) -> dict:
+    """
+    Split datetime64 values into calendar components
+
+    :param times: `numpy.ndarray` of datetime64 values
+
+    :returns: `dict` of column name to `numpy.ndarray` of integers
+    """
+
+    years = times.astype('datetime64[Y]')
+    months = times.astype('datetime64[M]')
+    days = times.astype('datetime64[D]')
+    hours = times.astype('datetime64[h]')
+    minutes = times.astype('datetime64[m]')
+    seconds = times.astype('datetime64[s]')
+
+    return {
+        'year': years.astype(np.int64) + 1970,
+        'month': months.astype(np.int64) % 12 + 1,
+        'day': (days - months.astype('datetime64[D]')).astype(np.int64) + 1,
+        'hour': (hours - days).astype(np.int64),
+        'minute': (minutes - hours).astype(np.int64),
+        'second': (seconds - minutes).astype(np.int64)
+    }
+
+
+def convert_dataset(ds: xr.Dataset, station: dict,
+                    template: dict) -> pd.DataFrame:
+    """
+    Convert a wave buoy dataset into csv2bufr input columns
+
+    :param ds: `xarray.Dataset` of IMOS wave parameters indexed by TIME
+    :param station: `dict` of station_list.csv row for the buoy
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `pandas.DataFrame` with one row per valid TIME step
+    """
+
+    times = ds['TIME'].values
+    valid = ~np.isnat(times)
+    times = times[valid]
+
+    region, sub_area, platform = split_wmo_identifier(
+        station['traditional_station_identifier'])
+    station_values = {
+        'wigos_station_identifier': station['wigos_station_identifier'],
+        'regionNumber': region,
+        'wmoRegionSubArea': sub_area,
+        'buoyOrPlatformIdentifier': platform
+    }
+
+    calendar = time_columns(times)
+
+    columns = {}
+    for column in template_columns(template):
+        if column in STATION_COLUMNS:
+            columns[column] = np.full(times.shape, station_values[column],
+                                      dtype=object if column == 'wigos_station_identifier' else np.int64)  # noqa
+        elif column in TIME_COLUMNS:
+            columns[column] = calendar[column]
+        else:
+            variable = COORDINATE_COLUMNS.get(column, column)
+            if variable not in ds.variables:
+                raise KeyError(f'Template column {column} not found in dataset')  # noqa
+            values = ds[variable].values.astype(np.float64)[valid]
+
+            ancillary = ds[variable].attrs.get('ancillary_variables')
+            if ancillary in ds.variables:
+                flags = ds[ancillary].values[valid]
+                values[np.isin(flags, QC_REJECT_FLAGS)] = np.nan
+
+            columns[column] = values
+
+    return pd.DataFrame(columns)
+
+
+def to_csv(frame: pd.DataFrame, template: dict) -> str:
+    """
+    Serialise converted columns using the template CSV dialect
+
+    :param frame: `pandas.DataFrame` from `convert_dataset`
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `str` of CSV text, missing values left empty
+    """
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, sep=template.get('delimiter', ','),
+                 quoting=getattr(csv, template.get('quoting', 'QUOTE_NONE')),
+                 na_rep='', lineterminator='\n')
+
+    return buffer.getvalue()
+
+
+def observation_times(frame: pd.DataFrame) -> np.ndarray:
+    """
+    Rebuild observation times from the calendar columns
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+
+    :returns: `numpy.ndarray` of datetime64[s]
+    """
+
+    calendar = frame[['year', 'month', 'day', 'hour', 'minute']]
+    return pd.to_datetime(calendar).to_numpy().astype('datetime64[s]')
+
+
+def output_filename(frame: pd.DataFrame, extension: str = 'csv') -> str:
+    """
+    Name an output object after its station and last observation time,
+    following the WIGOS_<wsi>_<YYYYmmddTHHMMSS> convention
+
+    :param frame: `pandas.DataFrame` from `convert_dataset`
+    :param extension: `str` of file extension
+
+    :returns: `str` of filename
+    """
+
+    last = frame.iloc[-1]
+    timestamp = '{:04d}{:02d}{:02d}T{:02d}{:02d}{:02d}'.format(
+        *(int(last.get(c, 0)) for c in TIME_COLUMNS))
+
+    return f"WIGOS_{last['wigos_station_identifier']}_{timestamp}.{extension}"
+
+
+def convert_file(nc_file: Path, template: dict,
+                 wigos_station_identifier: str = None,
+                 station_list: Path = STATION_LIST) -> pd.DataFrame:
+    """
+    Convert an IMOS wave parameters NetCDF file
+
+    :param nc_file: `Path` of the NetCDF file
+    :param template: `dict` of csv2bufr mapping template
+    :param wigos_station_identifier: `str` of WIGOS identifier, looked up
+                                     from the `site_name` attribute if None
+    :param station_list: `Path` of the wis2box station list
+
+    :returns: `pandas.DataFrame` of csv2bufr input columns
+    """
+
+    with xr.open_dataset(nc_file, engine='h5netcdf') as ds:
+        station = load_station(ds.attrs.get('site_name'),
+                               wigos_station_identifier, station_list)
+        return convert_dataset(ds, station, template)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='convert IMOS wave buoy NetCDF to csv2bufr input CSV')
+    parser.add_argument('nc_file', type=Path, help='IMOS wave parameters NetCDF file')  # noqa
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='wis2box station list')
+    parser.add_argument('--wigos-id', dest='wigos_station_identifier',
+                        help='WIGOS station identifier (default: match site_name)')  # noqa
+    parser.add_argument('--output-dir', type=Path,
+                        help='directory to write the CSV to (default: stdout)')  # noqa
+
+    args = parser.parse_args()
+
+    template = load_template(args.template)
+    frame = convert_file(args.nc_file, template,
+                         args.wigos_station_identifier, args.station_list)
+
+    if frame.empty:
+        print(f'No observations found in {args.nc_file}')
+        return
+
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        output_file = args.output_dir / output_filename(frame)
+        output_file.write_text(to_csv(frame, template))
+        print(f'Wrote {len(frame)} observations to {output_file}')
+    else:
+        print(to_csv(frame, template), end='')
+
+
+if __name__ == '__main__':
+    main()
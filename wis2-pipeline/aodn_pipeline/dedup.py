@@ -0,0 +1,322 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Content-hash deduplication of converted observations
+
+IMOS reissues realtime files with overlapping TIME ranges, so the same
+observation can reach the pipeline again after a high-water mark reset,
+a backfill or a lost state database.  Every converted row is
+fingerprinted from its WIGOS identifier, time and canonicalised values;
+rows whose fingerprint was already published are dropped before they are
+encoded or uploaded.
+
+Fingerprints are looked up in a bounded in-memory LRU first and in a
+SQLite store for LRU misses, and are only stored once the rows were sent.
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aodn_pipeline import STATE_DIR
+from aodn_pipeline.state import connect
+
+LOGGER = logging.getLogger(__name__)
+
+DEDUP_DB = STATE_DIR / 'dedup.sqlite3'
+
+# fingerprints kept in memory per process
+LRU_CAPACITY = 200000
+
+# decimals float values are rounded to before hashing
+DECIMALS = 6
+
+# SQLite host parameters per IN (...) lookup
+LOOKUP_CHUNK = 500
+
+# outcomes of a fingerprint lookup
+LOOKUPS = ('lru_hits', 'store_hits', 'misses')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprint (
+    value INTEGER PRIMARY KEY,
+    wigos_station_identifier TEXT NOT NULL,
+    seen TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fingerprint_station
+    ON fingerprint (wigos_station_identifier);
+"""
+
+
+def fingerprints(frame: pd.DataFrame, decimals: int = DECIMALS) -> np.ndarray:  # noqa
+    """
+    Fingerprint observations independently of column order and float noise
+
+    Floats are rounded and -0.0 folded into 0.0; missing values hash
+    alike.  The 64-bit hash of the row is computed by pandas in one
+    vectorised pass.
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+    :param decimals: `int` of decimals floats are rounded to
+
+    :returns: `numpy.ndarray` of int64 fingerprints, one per row
+    """
+
+    canonical = frame[sorted(frame.columns)]
+    floats = canonical.select_dtypes('float').columns
+    canonical = canonical.assign(**{
+        column: canonical[column].round(decimals) + 0.0 for column in floats
+    })
+
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy().view(np.int64)  # noqa
+
+
+class FingerprintCache:
+    """Fingerprints of published observations"""
+
+    def __init__(self, path: Path = DEDUP_DB,
+                 capacity: int = LRU_CAPACITY):
+        """
+        :param path: `Path` of the fingerprint database
+        :param capacity: `int` of fingerprints kept in memory
+        """
+
+        self.path = Path(path)
+        self.capacity = capacity
+        self.conn = connect(self.path)
+        self.conn.executescript(SCHEMA)
+        self._lru = OrderedDict()
+        self.lru_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _remember(self, values) -> None:
+        for value in values:
+            self._lru[value] = None
+            self._lru.move_to_end(value)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def seen(self, values: np.ndarray) -> np.ndarray:
+        """
+        Check which fingerprints were already published
+
+        :param values: `numpy.ndarray` of int64 fingerprints
+
+        :returns: `numpy.ndarray` of `bool`, True for published rows
+        """
+
+        values = [int(value) for value in values]
+        found = np.zeros(len(values), dtype=bool)
+
+        unknown = []
+        for position, value in enumerate(values):
+            if value in self._lru:
+                self._lru.move_to_end(value)
+                found[position] = True
+            else:
+                unknown.append(position)
+        self.lru_hits += int(found.sum())
+
+        stored = set()
+        for start in range(0, len(unknown), LOOKUP_CHUNK):
+            chunk = [values[p] for p in unknown[start:start + LOOKUP_CHUNK]]
+            placeholders = ','.join('?' * len(chunk))
+            stored.update(row[0] for row in self.conn.execute(
+                f'SELECT value FROM fingerprint WHERE value IN ({placeholders})',  # noqa
+                chunk))
+
+        hits = 0
+        for position in unknown:
+            if values[position] in stored:
+                found[position] = True
+                hits += 1
+        self.store_hits += hits
+        self.misses += len(unknown) - hits
+        self._remember(stored)
+
+        return found
+
+    def filter(self, frame: pd.DataFrame) -> tuple:
+        """
+        Drop observations already published
+
+        :param frame: `pandas.DataFrame` of csv2bufr input columns
+
+        :returns: `tuple` of (`pandas.DataFrame` of new rows,
+                  `numpy.ndarray` of their fingerprints)
+        """
+
+        values = fingerprints(frame)
+        new = ~self.seen(values)
+        if new.all():
+            return frame, values
+
+        return frame[new].reset_index(drop=True), values[new]
+
+    def add(self, values: np.ndarray, wigos_station_identifier: str) -> None:
+        """
+        Record fingerprints of sent observations
+
+        :param values: `numpy.ndarray` of int64 fingerprints
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: None
+        """
+
+        values = [int(value) for value in values]
+        self.conn.execute('BEGIN')
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO fingerprint '
+            '(value, wigos_station_identifier) VALUES (?, ?)',
+            ((value, wigos_station_identifier) for value in values))
+        self.conn.execute('COMMIT')
+        self._remember(values)
+
+    def forget(self, wigos_station_identifier: str) -> int:
+        """
+        Forget the fingerprints of a station so it can be republished
+
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: `int` of forgotten fingerprints
+        """
+
+        self._lru.clear()
+        return self.conn.execute(
+            'DELETE FROM fingerprint WHERE wigos_station_identifier = ?',
+            (wigos_station_identifier,)).rowcount
+
+    def prune(self, days: float) -> int:
+        """
+        Forget fingerprints first seen more than a number of days ago
+
+        :param days: `float` of days to keep
+
+        :returns: `int` of forgotten fingerprints
+        """
+
+        self._lru.clear()
+        return self.conn.execute(
+            "DELETE FROM fingerprint WHERE seen < strftime('%Y-%m-%dT%H:%M:%SZ', 'now', ?)",  # noqa
+            (f'-{days} days',)).rowcount
+
+    def lookups(self) -> dict:
+        """
+        Count lookups since the cache was opened
+
+        :returns: `dict` of `LOOKUPS` counters
+        """
+
+        return {'lru_hits': self.lru_hits, 'store_hits': self.store_hits,
+                'misses': self.misses}
+
+    def stats(self) -> dict:
+        """
+        Count lookups since the cache was opened and stored fingerprints
+
+        :returns: `dict` of hit and miss counters
+        """
+
+        return {
+            **self.lookups(),
+            'hit_ratio': hit_ratio(self.lookups()),
+            'lru_size': len(self._lru),
+            'stored': self.conn.execute('SELECT COUNT(*) FROM fingerprint').fetchone()[0]  # noqa
+        }
+
+
+def hit_ratio(lookups: dict) -> float:
+    """
+    Share of lookups answered from the LRU or the store
+
+    :param lookups: `dict` of `LOOKUPS` counters
+
+    :returns: `float` of hit ratio, 0 without lookups
+    """
+
+    total = sum(lookups.get(name, 0) for name in LOOKUPS)
+    hits = lookups.get('lru_hits', 0) + lookups.get('store_hits', 0)
+    return hits / total if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='inspect the fingerprints of published observations')
+    parser.add_argument('--db', type=Path, default=DEDUP_DB,
+                        help='fingerprint database')
+    parser.add_argument('--forget',
+                        help='forget the fingerprints of this WIGOS identifier')  # noqa
+    parser.add_argument('--prune', type=float,
+                        help='forget fingerprints older than this many days')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the cache statistics instead of stations')  # noqa
+    parser.add_argument('--json', action='store_true',
+                        help='print the statistics as JSON')
+
+    args = parser.parse_args()
+
+    with FingerprintCache(args.db) as cache:
+        if args.stats:
+            stats = cache.stats()
+            if args.json:
+                print(json.dumps(stats, indent=4))
+            else:
+                print(f"{stats['stored']} fingerprints stored, "
+                      f"{stats['lru_size']} in memory")
+            return
+
+        if args.forget:
+            print(f'Forgot {cache.forget(args.forget)} fingerprints of {args.forget}')  # noqa
+        if args.prune is not None:
+            print(f'Pruned {cache.prune(args.prune)} fingerprints')
+
+        rows = cache.conn.execute(
+            'SELECT wigos_station_identifier, COUNT(*), MAX(seen) '
+            'FROM fingerprint GROUP BY wigos_station_identifier '
+            'ORDER BY wigos_station_identifier').fetchall()
+
+    if args.json:
+        print(json.dumps([dict(zip(('wigos_station_identifier', 'fingerprints', 'last_seen'), row))  # noqa
+                          for row in rows], indent=4))
+        return
+
+    for wsi, count, last_seen in rows:
+        print(f'{wsi}: {count} fingerprints, last seen {last_seen}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,553 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Bulk loading of GeoJSON observation documents into the wis2box API
+
+wis2box expands every published BUFR message into one GeoJSON document
+per observed element and indexes the documents one request at a time,
+which a backfill of years of data turns into millions of requests against
+the single-node, 512m-heap `elasticsearch` service.  `BulkIndexer` sends
+the same documents through the `_bulk` API instead: documents are batched
+by count and size, a bounded number of batches are in flight at a time,
+and batches or documents rejected with HTTP 429 are retried with backoff
+rather than lost.  `relaxed_refresh` turns index refreshes off while a
+load runs and restores the previous interval afterwards.
+
+Documents follow the features of wis2box `ObservationDataBUFR2GeoJSON`:
+elements of BUFR classes 01 to 09 (identification, location and time)
+describe the observation, every observed element becomes a feature.  Their
+ids are derived from station, time and element, so a repeated load
+overwrites documents instead of duplicating them.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import json
+import logging
+from pathlib import Path
+import re
+import threading
+import time
+from typing import Callable
+
+from dotenv import dotenv_values
+import eccodes
+import numpy as np
+import urllib3
+
+from aodn_pipeline import WIS2BOX_ENV
+from aodn_pipeline.upload import connection_pool
+
+LOGGER = logging.getLogger(__name__)
+
+# index of the urn:wmo:md:au-imos:wave-buoys collection of wave-buoys.yml
+API_INDEX = 'urn-wmo-md-au-imos-wave-buoys'
+
+# documents and bytes per _bulk request
+BULK_DOCUMENTS = 1000
+BULK_BYTES = 5 * 1024 * 1024
+
+# concurrent _bulk requests, sized for the single elasticsearch node
+BULK_WORKERS = 2
+
+# refresh interval while loading, -1 turns refreshes off
+RELAXED_REFRESH = '-1'
+
+# attempts of a batch rejected with HTTP 429 and the first backoff
+REJECT_RETRIES = 5
+REJECT_BACKOFF = 0.5
+
+# object names carrying the WIGOS station identifier
+WSI_PATTERN = re.compile(r'WIGOS_([0-9A-Za-z-]+)_\d{8}T\d{6}')
+
+# object names of batches across the stations of a time slot
+SLOT_BATCH_PATTERN = re.compile(r'WAVE-BUOYS_\d{8}T\d{6}(_\d+)?_batch\.bufr4$')
+
+# BUFR classes of elements describing the observation rather than observed:
+# identification, location and time (01 to 09) and replication (31)
+METADATA_CLASSES = (*range(1, 10), 31)
+
+TIME_KEYS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+
+def load_api_backend(env_file: Path = WIS2BOX_ENV, url: str = None) -> str:
+    """
+    Read the Elasticsearch URL of the wis2box API from wis2box.env
+
+    :param env_file: `Path` of wis2box.env
+    :param url: `str` of URL overriding WIS2BOX_API_BACKEND_URL, which
+                usually points at the in-compose hostname
+                http://elasticsearch:9200
+
+    :returns: `str` of Elasticsearch URL
+    """
+
+    env = dotenv_values(env_file)
+    return url or env.get('WIS2BOX_API_BACKEND_URL', 'http://localhost:9200')  # noqa
+
+
+def _values(handle, key: str, subsets: int, compressed: bool) -> np.ndarray:
+    """
+    Read the first occurrence of an element in every subset
+
+    Compressed messages hold one value per subset under the ranked key, or
+    a single value when it is constant across subsets.  Uncompressed
+    messages rank occurrences across the whole message, so the `#1#` key
+    is the first subset only and every subset is read on its own.
+    """
+
+    if compressed or subsets == 1:
+        values = np.asarray(eccodes.codes_get_array(handle, key))
+        if len(values) == 1:
+            values = np.repeat(values, subsets)
+        return values
+
+    name = key.split('#', 2)[-1]
+    values = []
+    for subset in range(1, subsets + 1):
+        try:
+            occurrences = eccodes.codes_get_array(
+                handle, f'/subsetNumber={subset}/{name}')
+        except eccodes.KeyValueNotFoundError:
+            occurrences = []
+        values.append(occurrences[0] if len(occurrences)
+                      else eccodes.CODES_MISSING_DOUBLE)
+    return np.asarray(values)
+
+
+def _missing(value) -> bool:
+    return value in (eccodes.CODES_MISSING_DOUBLE, eccodes.CODES_MISSING_LONG)
+
+
+def bufr_documents(message: bytes, wigos_station_identifier: str,
+                   result_time: str = None) -> list:
+    """
+    Expand a BUFR4 message into GeoJSON observation documents
+
+    :param message: `bytes` of BUFR4 message
+    :param wigos_station_identifier: `str` of WIGOS station identifier
+    :param result_time: `str` of ISO 8601 result time (default: now)
+
+    :returns: `list` of GeoJSON feature `dict`, one per subset and
+              observed element with a value
+    """
+
+    result_time = result_time or datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')  # noqa
+
+    handle = eccodes.codes_new_from_message(message)
+    try:
+        eccodes.codes_set(handle, 'unpack', 1)
+        subsets = eccodes.codes_get(handle, 'numberOfSubsets')
+        compressed = bool(eccodes.codes_get(handle, 'compressedData'))
+
+        names = []
+        iterator = eccodes.codes_bufr_keys_iterator_new(handle)
+        try:
+            while eccodes.codes_bufr_keys_iterator_next(iterator):
+                name = eccodes.codes_bufr_keys_iterator_get_name(iterator)
+                if name.startswith('#1#'):
+                    names.append(name)
+        finally:
+            eccodes.codes_bufr_keys_iterator_delete(iterator)
+
+        elements = []
+        for name in names:
+            code = eccodes.codes_get(handle, f'{name}->code')
+            elements.append((name[3:], int(code[1:3]), code,
+                             eccodes.codes_get(handle, f'{name}->units'),
+                             _values(handle, name, subsets, compressed)))
+    finally:
+        eccodes.codes_release(handle)
+
+    described = {name: values for name, xx, _, _, values in elements
+                 if xx in METADATA_CLASSES}
+    times = [described[key] if key in described else np.zeros(subsets)
+             for key in TIME_KEYS]
+
+    documents = []
+    for subset in range(subsets):
+        calendar = [int(values[subset]) for values in times]
+        phenomenon_time = '{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z'.format(*calendar)  # noqa
+        report_id = f"{wigos_station_identifier}-{phenomenon_time.replace('-', '').replace(':', '')}"  # noqa
+        geometry = None
+        if 'latitude' in described and 'longitude' in described:
+            latitude = described['latitude'][subset]
+            longitude = described['longitude'][subset]
+            if not _missing(latitude) and not _missing(longitude):
+                geometry = {'type': 'Point',
+                            'coordinates': [float(longitude), float(latitude)]}  # noqa
+
+        for name, xx, code, units, values in elements:
+            value = values[subset]
+            if xx in METADATA_CLASSES or _missing(value):
+                continue
+            documents.append({
+                'id': f'{report_id}-{name}',
+                'type': 'Feature',
+                'geometry': geometry,
+                'properties': {
+                    'wigos_station_identifier': wigos_station_identifier,
+                    'phenomenonTime': phenomenon_time,
+                    'resultTime': result_time,
+                    'reportId': report_id,
+                    'name': name,
+                    'value': value.item(),
+                    'units': units,
+                    'fxxyy': code
+                }
+            })
+
+    return documents
+
+
+class BulkIndexer:
+    """Batched, parallel indexing of documents through the _bulk API"""
+
+    def __init__(self, url: str, index: str = API_INDEX,
+                 batch_size: int = BULK_DOCUMENTS,
+                 max_bytes: int = BULK_BYTES, workers: int = BULK_WORKERS,
+                 pool: urllib3.PoolManager = None):
+        """
+        :param url: `str` of Elasticsearch URL
+        :param index: `str` of index the documents are written to
+        :param batch_size: `int` of documents per _bulk request
+        :param max_bytes: `int` of bytes per _bulk request
+        :param workers: `int` of concurrent _bulk requests
+        :param pool: `urllib3.PoolManager` (default: created for workers)
+        """
+
+        self.url = url.rstrip('/')
+        self.index = index
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.pool = pool or connection_pool(maxsize=workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='bulk')
+        # bound the batches waiting so producers cannot buffer unlimited data
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._lines = []
+        self._size = 0
+        self._pending = []
+        self._start = None
+        self.documents = 0
+        self.batches = 0
+        self.bytes = 0
+        self.errors = 0
+        self.rejections = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, document: dict) -> None:
+        """
+        Queue a document, sending a batch once it is full
+
+        :param document: `dict` of GeoJSON document with an `id`
+
+        :returns: None
+        """
+
+        action = {'index': {'_index': self.index, '_id': document['id']}}
+        line = f'{json.dumps(action)}\n{json.dumps(document)}\n'.encode()
+
+        with self._lock:
+            if self._start is None:
+                self._start = time.perf_counter()
+            self._lines.append(line)
+            self._size += len(line)
+            if len(self._lines) < self.batch_size and self._size < self.max_bytes:  # noqa
+                return
+            lines = self._take()
+
+        self._submit(lines)
+
+    def _take(self) -> list:
+        lines, self._lines, self._size = self._lines, [], 0
+        return lines
+
+    def _submit(self, lines: list) -> None:
+        self._slots.acquire()
+        future = self._executor.submit(self._send, lines)
+        future.add_done_callback(lambda _: self._slots.release())
+        with self._lock:
+            self._pending.append(future)
+
+    def _send(self, lines: list) -> int:
+        """
+        Send a batch, retrying rejected documents with backoff
+
+        :param lines: `list` of `bytes` of action and document line pairs
+
+        :returns: `int` of documents that failed to index
+        """
+
+        failed = 0
+        for attempt in range(REJECT_RETRIES + 1):
+            body = b''.join(lines)
+            try:
+                response = self.pool.request(
+                    'POST', f'{self.url}/_bulk', body=body,
+                    headers={'Content-Type': 'application/x-ndjson'})
+            except Exception as err:
+                LOGGER.error(f'Bulk request of {len(lines)} documents failed: {err}')  # noqa
+                failed += len(lines)
+                lines = []
+                break
+
+            rejected, errors = [], 0
+            if response.status == 429:
+                rejected = lines
+            elif response.status >= 400:
+                LOGGER.error(f'Bulk request of {len(lines)} documents failed '
+                             f'with HTTP {response.status}: {response.data[:200]!r}')  # noqa
+                errors = len(lines)
+            else:
+                for line, item in zip(lines, response.json()['items']):
+                    outcome = next(iter(item.values()))
+                    if outcome.get('status') == 429:
+                        rejected.append(line)
+                    elif outcome.get('status', 500) >= 300:
+                        LOGGER.warning(f"Failed to index {outcome.get('_id')}: {outcome.get('error')}")  # noqa
+                        errors += 1
+
+            with self._lock:
+                self.batches += 1
+                self.bytes += len(body)
+                self.documents += len(lines) - len(rejected) - errors
+                self.rejections += len(rejected)
+
+            failed += errors
+            lines = rejected
+            if not lines or attempt == REJECT_RETRIES:
+                break
+            time.sleep(REJECT_BACKOFF * 2 ** attempt)
+
+        failed += len(lines)
+        with self._lock:
+            self.errors += failed
+        return failed
+
+    def flush(self) -> int:
+        """
+        Send the queued documents and wait for all batches to finish
+
+        :returns: `int` of documents that failed to index since the last
+                  flush
+        """
+
+        with self._lock:
+            lines = self._take()
+        if lines:
+            self._submit(lines)
+
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return sum(future.result() for future in pending)
+
+    def close(self) -> None:
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        """
+        Summarise the documents indexed so far
+
+        :returns: `dict` of throughput statistics
+        """
+
+        elapsed = time.perf_counter() - self._start if self._start else 0.0
+        return {
+            'index': self.index,
+            'batch_size': self.batch_size,
+            'workers': self.workers,
+            'documents': self.documents,
+            'batches': self.batches,
+            'bytes': self.bytes,
+            'rejections': self.rejections,
+            'errors': self.errors,
+            'elapsed': elapsed,
+            'documents_per_second': self.documents / elapsed if elapsed else 0.0  # noqa
+        }
+
+
+@contextmanager
+def relaxed_refresh(url: str, index: str = API_INDEX,
+                    interval: str = RELAXED_REFRESH,
+                    pool: urllib3.PoolManager = None):
+    """
+    Relax the refresh interval of an index while loading into it
+
+    The previous interval is restored and the index refreshed once on
+    exit, so the loaded documents become searchable together.  An index
+    that does not exist yet is left to be created by wis2box.
+
+    :param url: `str` of Elasticsearch URL
+    :param index: `str` of index name
+    :param interval: `str` of refresh interval while loading
+    :param pool: `urllib3.PoolManager` (default: created)
+    """
+
+    pool = pool or connection_pool(maxsize=1)
+    url = url.rstrip('/')
+
+    response = pool.request('GET', f'{url}/{index}/_settings')
+    if response.status == 404:
+        LOGGER.warning(f'Index {index} does not exist, refresh interval left unchanged')  # noqa
+        yield
+        return
+    if response.status >= 400:
+        raise RuntimeError(f'Reading the settings of {index} failed with '
+                           f'HTTP {response.status}: {response.data[:200]!r}')  # noqa
+    previous = response.json()[index]['settings']['index'].get('refresh_interval')  # noqa
+
+    def update(value):
+        response = pool.request('PUT', f'{url}/{index}/_settings',
+                                json={'index': {'refresh_interval': value}})
+        if response.status >= 400:
+            raise RuntimeError(f'Setting the refresh interval of {index} '
+                               f'failed with HTTP {response.status}')
+
+    update(interval)
+    LOGGER.info(f'Refresh interval of {index} relaxed to {interval}')
+    try:
+        yield
+    finally:
+        # None resets the interval to the cluster default
+        update(previous)
+        pool.request('POST', f'{url}/{index}/_refresh')
+        LOGGER.info(f'Refresh interval of {index} restored to {previous}')
+
+
+def bulk_sink(indexer: BulkIndexer) -> Callable[[str, bytes], None]:
+    """
+    Create a sink expanding BUFR4 objects into documents of an indexer
+
+    The station is taken from the WIGOS_<wsi>_<YYYYmmddTHHMMSS> object
+    name.  Batches across the stations of a time slot
+    (WAVE-BUOYS_<YYYYmmddTHHMMSS>_batch.bufr4) carry no single station and
+    are skipped with a warning, leaving them to the wis2box pipeline.
+    Documents are sent in batches, so call `indexer.flush` before
+    recording objects as published.
+
+    :param indexer: `BulkIndexer` the documents are queued on
+
+    :returns: callable taking an object key and its content
+    """
+
+    def sink(key, data):
+        if SLOT_BATCH_PATTERN.search(key):
+            LOGGER.warning(f'Skipping {key}, slot batches hold several stations')  # noqa
+            return
+        match = WSI_PATTERN.search(key)
+        if not key.endswith('.bufr4') or not match:
+            raise ValueError(f'Cannot index {key}, expected a WIGOS_<wsi>_<time>.bufr4 message')  # noqa
+        for document in bufr_documents(data, match.group(1)):
+            indexer.add(document)
+
+    return sink
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='bulk load BUFR4 messages as GeoJSON documents into the wis2box API')  # noqa
+    parser.add_argument('paths', type=Path, nargs='+',
+                        help='BUFR4 files or directories holding them')
+    parser.add_argument('--index', default=API_INDEX,
+                        help='Elasticsearch index of the collection')
+    parser.add_argument('--batch-size', type=int, default=BULK_DOCUMENTS,
+                        help='documents per _bulk request')
+    parser.add_argument('--max-bytes', type=float,
+                        default=BULK_BYTES / 1024 / 1024,
+                        help='MiB per _bulk request')
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS,
+                        help='number of concurrent _bulk requests')
+    parser.add_argument('--refresh-interval', default=RELAXED_REFRESH,
+                        help='refresh interval while loading (-1 for none)')
+    parser.add_argument('--keep-refresh', action='store_true',
+                        help='leave the refresh interval unchanged')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with API settings')
+    parser.add_argument('--api-backend-url',
+                        help='Elasticsearch URL (default: WIS2BOX_API_BACKEND_URL)')  # noqa
+    parser.add_argument('--standin', action='store_true',
+                        help='load into an in-process Elasticsearch stand-in')  # noqa
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(path.rglob('*.bufr4')) if path.is_dir() else [path])  # noqa
+
+    standin = None
+    if args.standin:
+        from aodn_pipeline.standins import ElasticsearchStandIn
+        standin = ElasticsearchStandIn([args.index]).start()
+        url = standin.url
+    else:
+        url = load_api_backend(args.env_file, args.api_backend_url)
+
+    try:
+        indexer = BulkIndexer(url, args.index, args.batch_size,
+                              int(args.max_bytes * 1024 * 1024), args.workers)
+        with indexer:
+            if args.keep_refresh:
+                refresh = nullcontext()
+            else:
+                refresh = relaxed_refresh(url, args.index,
+                                          args.refresh_interval)
+            with refresh:
+                sink = bulk_sink(indexer)
+                for bufr_file in files:
+                    sink(bufr_file.name, bufr_file.read_bytes())
+                indexer.flush()
+        results = indexer.stats()
+        results['files'] = len(files)
+    finally:
+        if standin:
+            standin.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(f"{results['documents']} documents from {results['files']} "
+              f"files in {results['batches']} batches with "
+              f"{results['workers']} workers in {results['elapsed']:.2f}s: "
+              f"{results['documents_per_second']:.0f} documents/s, "
+              f"{results['rejections']} rejections retried, "
+              f"{results['errors']} errors")
+
+    if results['errors']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
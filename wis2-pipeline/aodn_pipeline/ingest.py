@@ -0,0 +1,457 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Incremental ingestion of IMOS wave buoy NetCDF files
+
+Only TIME steps newer than the station high-water mark are converted and
+sent, so re-reading the growing monthly file each run costs O(new records)
+and never re-publishes observations already in wis2box-incoming.  Rows
+that pass the high-water mark but were published before, e.g. after a
+reset or from a reissued file, are dropped by their content fingerprint
+(see `aodn_pipeline.dedup`).
+"""
+
+import argparse
+import logging
+from pathlib import Path
+import time
+from typing import Callable, Union
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from aodn_pipeline import (STATION_LIST, WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC,
+                           WIS2BOX_ENV)
+from aodn_pipeline.backpressure import create_throttle, load_broker_config
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import (convert_dataset, load_station,
+                                   load_template, observation_times,
+                                   output_filename, to_csv)
+from aodn_pipeline.dedup import DEDUP_DB, LOOKUPS, FingerprintCache
+from aodn_pipeline.reader import (MEMORY_BUDGET, chunk_rows, iter_chunks,
+                                  open_pruned)
+from aodn_pipeline.state import STATE_DB, StateStore
+from aodn_pipeline.upload import BulkUploader, load_storage_config
+
+LOGGER = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ('csv', 'bufr4')
+
+# stages timed by ingest_dataset, in pipeline order
+STAGES = ('read', 'convert', 'dedup', 'encode', 'upload')
+
+
+def slice_new(ds: xr.Dataset, since: Union[np.datetime64, None]) -> xr.Dataset:  # noqa
+    """
+    Select the TIME steps after a high-water mark
+
+    Only the TIME index is read; data variables stay lazy so that just the
+    new tail of the file is loaded by the conversion.
+
+    :param ds: `xarray.Dataset` indexed by TIME
+    :param since: `numpy.datetime64` of last published observation
+
+    :returns: `xarray.Dataset` of newer TIME steps
+    """
+
+    if since is None:
+        return ds
+
+    times = ds['TIME'].values
+    if np.all(times[1:] >= times[:-1]):
+        start = np.searchsorted(times, since, side='right')
+        return ds.isel(TIME=slice(start, None))
+
+    return ds.isel(TIME=np.flatnonzero(times > since))
+
+
+def bufr_objects(frame: pd.DataFrame, encoder: BufrEncoder,
+                 prefix: str = WAVE_BUOY_TOPIC):
+    """
+    Encode observations as single-subset BUFR4 objects named
+    WIGOS_<wsi>_<YYYYmmddTHHMMSS>.bufr4
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+    :param encoder: `BufrEncoder` of the mapping template
+    :param prefix: `str` of incoming path objects are stored under
+
+    :returns: generator of (key, message bytes) tuples
+    """
+
+    timestamps = np.datetime_as_string(observation_times(frame), unit='s')
+    timestamps = np.char.replace(np.char.replace(timestamps, '-', ''), ':', '')
+    wsis = frame['wigos_station_identifier'].to_numpy()
+
+    messages = encoder.encode_each(frame)
+    for wsi, timestamp, message in zip(wsis, timestamps, messages):
+        yield f'{prefix}/WIGOS_{wsi}_{timestamp}.bufr4', message
+
+
+def send_frame(frame: pd.DataFrame, template: dict,
+               sink: Callable[[str, bytes], None],
+               prefix: str = WAVE_BUOY_TOPIC, output_format: str = 'csv',
+               encoder: BufrEncoder = None, timings: dict = None) -> list:
+    """
+    Encode converted observations and hand them to a sink
+
+    :param frame: `pandas.DataFrame` of csv2bufr input columns
+    :param template: `dict` of csv2bufr mapping template
+    :param sink: callable taking an object key and its content
+    :param prefix: `str` of incoming path the objects are stored under
+    :param output_format: `str` of output format, "csv" or "bufr4"
+    :param encoder: `BufrEncoder` of the template, reused between calls
+    :param timings: `dict` the encode and upload seconds are added to
+
+    :returns: `list` of (key, size) of the sent objects
+    """
+
+    timings = timings if timings is not None else dict.fromkeys(STAGES, 0.0)
+    sent = []
+
+    start = time.perf_counter()
+    if output_format == 'bufr4':
+        objects = bufr_objects(frame, encoder or BufrEncoder(template), prefix)
+    else:
+        objects = [(f'{prefix}/{output_filename(frame)}',
+                    to_csv(frame, template).encode('utf-8'))]
+
+    # bufr4 objects are encoded lazily, so split the loop between stages
+    objects = iter(objects)
+    while True:
+        item = next(objects, None)
+        encoded = time.perf_counter()
+        timings['encode'] += encoded - start
+        if item is None:
+            break
+        key, data = item
+        sink(key, data)
+        start = time.perf_counter()
+        timings['upload'] += start - encoded
+        sent.append((key, len(data)))
+
+    return sent
+
+
+def ingest_dataset(ds: xr.Dataset, station: dict, template: dict,
+                   state: StateStore, sink: Callable[[str, bytes], None],
+                   prefix: str = WAVE_BUOY_TOPIC, advance: bool = True,
+                   output_format: str = 'csv',
+                   encoder: BufrEncoder = None,
+                   dedup: FingerprintCache = None,
+                   memory_budget: int = MEMORY_BUDGET) -> dict:
+    """
+    Convert and send the observations of a station not yet published
+
+    With the csv output format the observations are sent as one CSV object
+    per chunk for csv2bufr; with bufr4 each observation is encoded
+    in-process as its own BUFR4 object, skipping the CSV text and the
+    container-side conversion.
+
+    New TIME steps are read, converted and sent in chunks that fit in
+    `memory_budget` (see `aodn_pipeline.reader`); a monthly file is a
+    single chunk.
+
+    The high-water mark is advanced only after the sink accepted every
+    object of a chunk, so a failed or killed run resends rather than drops
+    data.  Likewise the fingerprints of the sent rows are recorded in the
+    dedup cache only once every object was accepted.
+
+    The summary carries the seconds spent in each of `STAGES`, the upload
+    retries and the fingerprint lookups by outcome, so that callers in
+    other processes can report them (see `aodn_pipeline.metrics`).
+
+    :param ds: `xarray.Dataset` of IMOS wave parameters indexed by TIME
+    :param station: `dict` of station_list.csv row for the buoy
+    :param template: `dict` of csv2bufr mapping template
+    :param state: `StateStore` of station high-water marks
+    :param sink: callable taking an object key and its content
+    :param prefix: `str` of incoming path the object is stored under
+    :param advance: `bool` whether to advance the high-water mark
+    :param output_format: `str` of output format, "csv" or "bufr4"
+    :param encoder: `BufrEncoder` of the template, reused between calls
+    :param dedup: `FingerprintCache` of published observations, or None
+    :param memory_budget: `int` of bytes a chunk may take while converted
+
+    :returns: `dict` summary of the ingestion
+    """
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Invalid output format {output_format}')
+
+    wsi = station['wigos_station_identifier']
+    timings = dict.fromkeys(STAGES, 0.0)
+    retries = sink_retries(sink)
+    lookups = dedup.lookups() if dedup is not None else None
+
+    start = time.perf_counter()
+    since = state.get(wsi)
+    new = slice_new(ds, since)
+    timings['read'] = time.perf_counter() - start
+
+    summary = {
+        'wigos_station_identifier': wsi,
+        'since': since,
+        'observations': 0,
+        'duplicates': 0,
+        'objects': 0,
+        'bytes': 0,
+        'key': None,
+        'retries': 0,
+        'dedup': dict.fromkeys(LOOKUPS, 0),
+        'timings': timings
+    }
+
+    # marks may only move chunk by chunk when later chunks hold later times
+    times = new['TIME'].values
+    ordered = bool(np.all(times[1:] >= times[:-1]))
+    last_observation = None
+
+    for chunk in iter_chunks(new, chunk_rows(new, memory_budget)):
+        start = time.perf_counter()
+        chunk = chunk.load()
+        timings['read'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        frame = convert_dataset(chunk, station, template)
+        timings['convert'] += time.perf_counter() - start
+        if frame.empty:
+            continue
+
+        chunk_times = chunk['TIME'].values
+        chunk_last = chunk_times[~np.isnat(chunk_times)].max()
+        if last_observation is None or chunk_last > last_observation:
+            last_observation = chunk_last
+
+        values = None
+        if dedup is not None:
+            start = time.perf_counter()
+            observations = len(frame)
+            frame, values = dedup.filter(frame)
+            timings['dedup'] += time.perf_counter() - start
+            summary['duplicates'] += observations - len(frame)
+
+        if not frame.empty:
+            sent = send_frame(frame, template, sink, prefix, output_format,
+                              encoder, timings)
+            summary['observations'] += len(frame)
+            summary['objects'] += len(sent)
+            summary['bytes'] += sum(size for _, size in sent)
+            summary['key'] = sent[-1][0]
+            if values is not None:
+                dedup.add(values, wsi)
+
+        if advance and ordered:
+            state.advance(wsi, last_observation)
+
+    summary['retries'] = sink_retries(sink) - retries
+    if dedup is not None:
+        summary['dedup'] = {name: count - lookups[name]
+                            for name, count in dedup.lookups().items()}
+
+    if last_observation is None:
+        LOGGER.info(f'{wsi}: no observations after {since}')
+        return summary
+
+    if advance:
+        state.advance(wsi, last_observation)
+
+    LOGGER.info(f"{wsi}: sent {summary['observations']} observations as {summary['objects']} {output_format} objects, skipped {summary['duplicates']} duplicates")  # noqa
+    return summary
+
+
+def sink_retries(sink: Callable[[str, bytes], None]) -> int:
+    """
+    Count the request retries of a sink so far
+
+    :param sink: callable taking an object key and its content
+
+    :returns: `int` of retries, 0 for sinks that do not retry
+    """
+
+    while hasattr(sink, '__wrapped__'):
+        sink = sink.__wrapped__
+
+    return getattr(getattr(sink, '__self__', None), 'retries', 0)
+
+
+def ingest_file(nc_file: Path, template: dict, state: StateStore,
+                sink: Callable[[str, bytes], None],
+                wigos_station_identifier: str = None,
+                station_list: Path = STATION_LIST,
+                prefix: str = WAVE_BUOY_TOPIC,
+                advance: bool = True, output_format: str = 'csv',
+                dedup: FingerprintCache = None,
+                memory_budget: int = MEMORY_BUDGET) -> dict:
+    """
+    Convert and send the observations of a file not yet published
+
+    Only the variables the template needs are opened.
+
+    :param nc_file: `Path` of IMOS wave parameters NetCDF file
+    :param template: `dict` of csv2bufr mapping template
+    :param state: `StateStore` of station high-water marks
+    :param sink: callable taking an object key and its content
+    :param wigos_station_identifier: `str` of WIGOS identifier, looked up
+                                     from the `site_name` attribute if None
+    :param station_list: `Path` of the wis2box station list
+    :param prefix: `str` of incoming path the object is stored under
+    :param advance: `bool` whether to advance the high-water mark
+    :param output_format: `str` of output format, "csv" or "bufr4"
+    :param dedup: `FingerprintCache` of published observations, or None
+    :param memory_budget: `int` of bytes a chunk may take while converted
+
+    :returns: `dict` summary of the ingestion
+    """
+
+    with open_pruned(nc_file, template) as ds:
+        station = load_station(ds.attrs.get('site_name'),
+                               wigos_station_identifier, station_list)
+        return ingest_dataset(ds, station, template, state, sink, prefix,
+                              advance, output_format, dedup=dedup,
+                              memory_budget=memory_budget)
+
+
+def directory_sink(output_dir: Path) -> Callable[[str, bytes], None]:
+    """
+    Create a sink writing objects below a local directory
+
+    :param output_dir: `Path` of the output directory
+
+    :returns: callable taking an object key and its content
+    """
+
+    def sink(key, data):
+        path = Path(output_dir) / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    return sink
+
+
+def storage_sink(config: dict,
+                 throttle=None) -> Callable[[str, bytes], None]:
+    """
+    Create a sink uploading objects into the wis2box-incoming bucket over
+    a keep-alive connection
+
+    The sink returns once the object is stored, so callers can safely
+    record it as published.
+
+    :param config: `dict` from `load_storage_config`
+    :param throttle: `backpressure.AIMDThrottle` pacing the uploads, or None
+
+    :returns: callable taking an object key and its content
+    """
+
+    return BulkUploader(config, concurrency=1, throttle=throttle).upload
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='incrementally ingest IMOS wave buoy NetCDF into wis2box')
+    parser.add_argument('nc_files', type=Path, nargs='+',
+                        help='IMOS wave parameters NetCDF files')
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='wis2box station list')
+    parser.add_argument('--wigos-id', dest='wigos_station_identifier',
+                        help='WIGOS station identifier (default: match site_name)')  # noqa
+    parser.add_argument('--state', type=Path, default=STATE_DB,
+                        help='high-water mark database')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--prefix', default=WAVE_BUOY_TOPIC,
+                        help='incoming path objects are stored under')
+    parser.add_argument('--format', dest='output_format',
+                        choices=OUTPUT_FORMATS, default='csv',
+                        help='send CSV for csv2bufr or encode BUFR4 in-process')  # noqa
+    parser.add_argument('--output-dir', type=Path,
+                        help='write objects to this directory instead of uploading')  # noqa
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do not advance the high-water marks')
+    parser.add_argument('--reset', action='store_true',
+                        help='forget the high-water mark and fingerprints and resend everything')  # noqa
+    parser.add_argument('--dedup-db', type=Path, default=DEDUP_DB,
+                        help='fingerprint database of published observations')  # noqa
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='do not skip observations published before')
+    parser.add_argument('--backpressure', action='store_true',
+                        help='pace uploads to the wis2box notification queue')  # noqa
+    parser.add_argument('--broker',
+                        help='broker URL (default: WIS2BOX_BROKER_HOST and WIS2BOX_BROKER_PORT)')  # noqa
+    parser.add_argument('--memory-budget', type=float,
+                        default=MEMORY_BUDGET / 1024 / 1024,
+                        help='MiB a chunk of TIME steps may take while converted')  # noqa
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    throttle = None
+    if args.output_dir:
+        sink = directory_sink(args.output_dir)
+    else:
+        if args.backpressure:
+            throttle = create_throttle(load_broker_config(args.env_file,
+                                                          args.broker))
+        sink = storage_sink(load_storage_config(args.env_file,
+                                                args.storage_source),
+                            throttle)
+
+    template = load_template(args.template)
+    dedup = None if args.no_dedup else FingerprintCache(args.dedup_db)
+    with StateStore(args.state) as state:
+        for nc_file in args.nc_files:
+            if args.reset:
+                with xr.open_dataset(nc_file, engine='h5netcdf') as ds:
+                    station = load_station(ds.attrs.get('site_name'),
+                                           args.wigos_station_identifier,
+                                           args.station_list)
+                state.reset(station['wigos_station_identifier'])
+                if dedup:
+                    dedup.forget(station['wigos_station_identifier'])
+
+            summary = ingest_file(nc_file, template, state, sink,
+                                  args.wigos_station_identifier,
+                                  args.station_list, args.prefix,
+                                  not args.dry_run, args.output_format, dedup,
+                                  int(args.memory_budget * 1024 * 1024))
+            print(f"{nc_file.name}: {summary['observations']} new observations"  # noqa
+                  f" for {summary['wigos_station_identifier']}"
+                  f" (since {summary['since']}),"
+                  f" {summary['duplicates']} duplicates skipped")
+
+    if dedup:
+        stats = dedup.stats()
+        print(f"Fingerprint lookups: {stats['lru_hits']} LRU hits, "
+              f"{stats['store_hits']} store hits, {stats['misses']} misses "
+              f"({stats['hit_ratio']:.1%} hit ratio)")
+        dedup.close()
+    if throttle:
+        throttle.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Prometheus metrics of the AODN ingest pipeline
+
+`PipelineMetrics` turns the summaries of `ingest.ingest_dataset` and the
+station results of `runner.run` into per-stage duration histograms and
+per-station observation, byte, retry and failure counters, served on
+`/metrics` for the `aodn-pipeline` scrape job of wis2box/prometheus.
+"""
+
+import logging
+import os
+import time
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               start_http_server)
+
+from aodn_pipeline.ingest import STAGES
+
+LOGGER = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get('AODN_PIPELINE_METRICS_PORT', 9464))
+
+# stage durations range from milliseconds (conversion) to minutes (backfills)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# runner statuses counted as failures
+FAILED_STATUSES = ('failed', 'timeout')
+
+
+class PipelineMetrics:
+    """Prometheus metrics of ingested stations"""
+
+    def __init__(self, registry: CollectorRegistry = None):
+        """
+        :param registry: `prometheus_client.CollectorRegistry`
+                         (default: a new registry)
+        """
+
+        self.registry = registry or CollectorRegistry()
+        station = ['wigos_station_identifier']
+
+        self.stage_seconds = Histogram(
+            'aodn_pipeline_stage_seconds',
+            'Seconds spent per station in each pipeline stage',
+            ['stage'], buckets=STAGE_BUCKETS, registry=self.registry)
+        self.observations = Counter(
+            'aodn_pipeline_observations',
+            'Observations (rows) converted and sent', station,
+            registry=self.registry)
+        self.duplicates = Counter(
+            'aodn_pipeline_duplicates',
+            'Observations skipped as already published', station,
+            registry=self.registry)
+        self.objects = Counter(
+            'aodn_pipeline_objects_uploaded',
+            'Objects uploaded into wis2box-incoming', station,
+            registry=self.registry)
+        self.bytes = Counter(
+            'aodn_pipeline_uploaded_bytes',
+            'Bytes uploaded into wis2box-incoming', station,
+            registry=self.registry)
+        self.dedup_lookups = Counter(
+            'aodn_pipeline_dedup_lookups',
+            'Fingerprint lookups by outcome (lru_hits, store_hits, misses)',
+            station + ['result'], registry=self.registry)
+        self.retries = Counter(
+            'aodn_pipeline_retries',
+            'Retried requests while ingesting a station', station,
+            registry=self.registry)
+        self.failures = Counter(
+            'aodn_pipeline_failures',
+            'Failed or timed out station ingestions', station + ['status'],
+            registry=self.registry)
+        self.last_success = Gauge(
+            'aodn_pipeline_last_success_timestamp_seconds',
+            'Unix time of the last successful ingestion', station,
+            registry=self.registry)
+        self.run_seconds = Gauge(
+            'aodn_pipeline_last_run_seconds',
+            'Wall-clock seconds of the last run', registry=self.registry)
+        self.queue_items = Gauge(
+            'aodn_pipeline_retry_queue_items',
+            'Objects waiting in the retry queue or given up on', ['state'],
+            registry=self.registry)
+
+        for stage in STAGES:
+            self.stage_seconds.labels(stage)
+
+    def record(self, result: dict) -> None:
+        """
+        Record an ingestion summary or runner station result
+
+        :param result: `dict` with `wigos_station_identifier` and
+                       optionally `status`, `observations`, `duplicates`,
+                       `objects`,
+                       `bytes`, `retries`, `dedup` and `timings`
+
+        :returns: None
+        """
+
+        wsi = result['wigos_station_identifier']
+        status = result.get('status', 'ok')
+
+        for stage, seconds in (result.get('timings') or {}).items():
+            self.stage_seconds.labels(stage).observe(seconds)
+
+        self.observations.labels(wsi).inc(result.get('observations', 0))
+        self.duplicates.labels(wsi).inc(result.get('duplicates', 0))
+        self.objects.labels(wsi).inc(result.get('objects', 0))
+        self.bytes.labels(wsi).inc(result.get('bytes', 0))
+        self.retries.labels(wsi).inc(result.get('retries', 0))
+        for outcome, lookups in (result.get('dedup') or {}).items():
+            self.dedup_lookups.labels(wsi, outcome).inc(lookups)
+
+        if status in FAILED_STATUSES:
+            self.failures.labels(wsi, status).inc()
+        elif status == 'ok':
+            self.last_success.labels(wsi).set(time.time())
+
+    def record_run(self, results: list, elapsed: float) -> None:
+        """
+        Record the station results of a run
+
+        :param results: `list` of station result `dict`
+        :param elapsed: `float` of wall-clock seconds of the run
+
+        :returns: None
+        """
+
+        for result in results:
+            self.record(result)
+        self.run_seconds.set(elapsed)
+
+    def record_queue(self, counts: dict) -> None:
+        """
+        Record the size of the retry queue
+
+        :param counts: `dict` from `retry.RetryQueue.counts`
+
+        :returns: None
+        """
+
+        for state, items in counts.items():
+            self.queue_items.labels(state).set(items)
+
+    def serve(self, port: int = METRICS_PORT, addr: str = '0.0.0.0') -> None:
+        """
+        Serve the metrics on http://addr:port/metrics in a daemon thread
+
+        :param port: `int` of the port to listen on
+        :param addr: `str` of the address to bind
+
+        :returns: None
+        """
+
+        start_http_server(port, addr, registry=self.registry)
+        LOGGER.info(f'Serving metrics on {addr}:{port}')
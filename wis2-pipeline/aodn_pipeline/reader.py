@@ -0,0 +1,249 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Template-driven, memory-bounded reads of IMOS wave buoy NetCDF files
+
+Only the variables the csv2bufr mapping template refers to through its
+`data:` values are opened, together with the QC flags named in their
+`ancillary_variables` (which the conversion needs to reject bad values)
+and the TIME coordinate.  Everything else in the file, e.g. spectra or
+the flags of unused parameters in aggregate files, is never decoded.
+
+The opened variables stay lazy and are read in TIME chunks sized so that
+a chunk and its conversion fit in a memory budget, so multi-year
+aggregate files stream through a small worker.
+"""
+
+import argparse
+import json
+import logging
+import math
+from pathlib import Path
+import time
+
+import h5netcdf
+import xarray as xr
+
+from aodn_pipeline import WAVE_BUOY_TEMPLATE
+from aodn_pipeline.convert import (COORDINATE_COLUMNS, STATION_COLUMNS,
+                                   TIME_COLUMNS, convert_dataset,
+                                   load_station, load_template,
+                                   template_columns)
+
+LOGGER = logging.getLogger(__name__)
+
+# bytes of a chunk and its conversion allowed in memory
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+# float64 copies made of every value by convert_dataset: the cast array
+# and the DataFrame column
+CONVERSION_COPIES = 2
+
+
+def template_variables(template: dict) -> list:
+    """
+    List the NetCDF variables a template refers to
+
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `list` of variable names including TIME
+    """
+
+    variables = ['TIME']
+    for column in template_columns(template):
+        if column in STATION_COLUMNS or column in TIME_COLUMNS:
+            continue
+        variable = COORDINATE_COLUMNS.get(column, column)
+        if variable not in variables:
+            variables.append(variable)
+
+    return variables
+
+
+def select_variables(nc_file: Path, template: dict) -> tuple:
+    """
+    Split the variables of a file into those a template needs and the rest
+
+    Only the HDF5 metadata of the file is read.
+
+    :param nc_file: `Path` of the NetCDF file
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `tuple` of (`list` of needed, `list` of unused variables)
+    """
+
+    with h5netcdf.File(nc_file, 'r') as nc:
+        available = nc.variables
+        needed = [v for v in template_variables(template) if v in available]
+
+        for variable in list(needed):
+            ancillary = available[variable].attrs.get('ancillary_variables', '')  # noqa
+            if isinstance(ancillary, bytes):
+                ancillary = ancillary.decode()
+            for flag in str(ancillary).split():
+                if flag in available and flag not in needed:
+                    needed.append(flag)
+
+        unused = [v for v in available if v not in needed]
+
+    return needed, unused
+
+
+def open_pruned(nc_file: Path, template: dict) -> xr.Dataset:
+    """
+    Open the variables of a file a template needs, lazily
+
+    :param nc_file: `Path` of the NetCDF file
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `xarray.Dataset` of lazily loaded needed variables
+    """
+
+    needed, unused = select_variables(nc_file, template)
+    LOGGER.debug(f'{Path(nc_file).name}: reading {needed}, skipping {unused}')  # noqa
+
+    return xr.open_dataset(nc_file, engine='h5netcdf', drop_variables=unused)
+
+
+def row_bytes(ds: xr.Dataset) -> int:
+    """
+    Estimate the memory one TIME step takes while it is converted
+
+    :param ds: `xarray.Dataset` indexed by TIME
+
+    :returns: `int` of bytes per TIME step
+    """
+
+    total = 0
+    for variable in ds.variables.values():
+        if 'TIME' not in variable.dims:
+            continue
+        values = math.prod(size for dim, size in variable.sizes.items()
+                           if dim != 'TIME')
+        total += values * (variable.dtype.itemsize + CONVERSION_COPIES * 8)
+
+    return max(total, 1)
+
+
+def storage_chunk(ds: xr.Dataset) -> int:
+    """
+    Largest HDF5 chunk length along TIME of the variables of a dataset
+
+    :param ds: `xarray.Dataset` opened with the h5netcdf engine
+
+    :returns: `int` of TIME steps per storage chunk, 1 if contiguous
+    """
+
+    lengths = [1]
+    for variable in ds.variables.values():
+        chunks = variable.encoding.get('chunksizes')
+        if chunks and 'TIME' in variable.dims:
+            lengths.append(chunks[variable.dims.index('TIME')])
+
+    return max(lengths)
+
+
+def chunk_rows(ds: xr.Dataset, memory_budget: int = MEMORY_BUDGET) -> int:
+    """
+    Choose how many TIME steps to read at once
+
+    Chunks are whole multiples of the HDF5 storage chunk where the budget
+    allows, so that no storage chunk is decompressed twice.
+
+    :param ds: `xarray.Dataset` indexed by TIME
+    :param memory_budget: `int` of bytes a chunk may take
+
+    :returns: `int` of TIME steps per chunk
+    """
+
+    rows = max(memory_budget // row_bytes(ds), 1)
+    aligned = rows - rows % storage_chunk(ds)
+
+    return aligned or rows
+
+
+def iter_chunks(ds: xr.Dataset, rows: int):
+    """
+    Split a dataset into consecutive TIME chunks, without loading them
+
+    :param ds: `xarray.Dataset` indexed by TIME
+    :param rows: `int` of TIME steps per chunk
+
+    :returns: generator of lazy `xarray.Dataset`
+    """
+
+    for start in range(0, ds.sizes.get('TIME', 0), rows):
+        yield ds.isel(TIME=slice(start, start + rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='stream an IMOS wave buoy NetCDF file through the converter in memory-bounded chunks')  # noqa
+    parser.add_argument('nc_file', type=Path, help='IMOS wave parameters NetCDF file')  # noqa
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--memory-budget', type=float,
+                        default=MEMORY_BUDGET / 1024 / 1024,
+                        help='MiB a chunk and its conversion may take')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    from aodn_pipeline.bench import peak_rss
+
+    template = load_template(args.template)
+    needed, unused = select_variables(args.nc_file, template)
+
+    start = time.perf_counter()
+    observations = chunks = 0
+    with open_pruned(args.nc_file, template) as ds:
+        station = load_station(ds.attrs.get('site_name'))
+        rows = chunk_rows(ds, int(args.memory_budget * 1024 * 1024))
+        for chunk in iter_chunks(ds, rows):
+            observations += len(convert_dataset(chunk.load(), station,
+                                                template))
+            chunks += 1
+
+    results = {
+        'variables': needed,
+        'skipped_variables': unused,
+        'rows_per_chunk': rows,
+        'chunks': chunks,
+        'observations': observations,
+        'elapsed': time.perf_counter() - start,
+        'peak_rss_mb': peak_rss()
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    print(f"Read {', '.join(needed)}; skipped {', '.join(unused) or 'nothing'}")  # noqa
+    print(f"Converted {observations} observations in {chunks} chunks of "
+          f"{rows} TIME steps in {results['elapsed']:.2f}s, "
+          f"peak RSS {results['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Retention sweeper deleting expired objects from the wis2box storage and
+expired documents from the wis2box API
+
+wis2box publishes into WIS2BOX_STORAGE_PUBLIC under one prefix per day
+(`2024-05-01/wis/...`), so whole days are expired from the prefix name
+alone: expired days are listed in parallel and days still retained are
+never listed.  Objects outside a date prefix, such as those left in
+WIS2BOX_STORAGE_INCOMING, are expired by their last modification time.
+Keys are deleted with S3 multi-object deletes of up to 1000 keys, and at
+most `concurrency` list and delete requests run at the same time so the
+sweep does not starve the ingest of the MinIO volume.
+
+Documents of the wis2box API older than WIS2BOX_STORAGE_API_RETENTION_DAYS
+are removed from Elasticsearch with one `_delete_by_query` per index.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+from pathlib import Path
+import re
+import threading
+import time
+from urllib.parse import quote
+
+from dotenv import dotenv_values
+from minio import Minio
+from minio.deleteobjects import DeleteObject
+
+from aodn_pipeline import WIS2BOX_ENV
+from aodn_pipeline.upload import (connection_pool, load_storage_config,
+                                  storage_client)
+
+LOGGER = logging.getLogger(__name__)
+
+# keys per S3 multi-object delete request, the S3 maximum
+DELETE_BATCH = 1000
+
+# concurrent list and delete requests
+CONCURRENCY = 4
+
+# daily prefixes of WIS2BOX_STORAGE_PUBLIC
+DATE_PREFIX = re.compile(r'(\d{4}-\d{2}-\d{2})/')
+
+# Elasticsearch indices and time fields of the wis2box API collections
+API_INDEX = '*'
+API_TIME_FIELDS = ('properties.resultTime', 'properties.pubTime')
+
+
+def load_retention_config(env_file: Path = WIS2BOX_ENV,
+                          storage_source: str = None,
+                          api_backend_url: str = None) -> dict:
+    """
+    Read the wis2box storage and retention settings from wis2box.env
+
+    :param env_file: `Path` of wis2box.env
+    :param storage_source: `str` of storage URL overriding
+                           WIS2BOX_STORAGE_SOURCE
+    :param api_backend_url: `str` of Elasticsearch URL overriding
+                            WIS2BOX_API_BACKEND_URL, which usually points
+                            at the in-compose hostname
+                            http://elasticsearch:9200
+
+    :returns: `dict` of storage and retention settings
+    """
+
+    env = dotenv_values(env_file)
+    config = load_storage_config(env_file, storage_source)
+    config.update({
+        'public': env.get('WIS2BOX_STORAGE_PUBLIC', 'wis2box-public'),
+        'data_retention_days': int(env.get('WIS2BOX_STORAGE_DATA_RETENTION_DAYS') or 30),  # noqa
+        'api_retention_days': int(env.get('WIS2BOX_STORAGE_API_RETENTION_DAYS') or 100),  # noqa
+        'api_backend_url': api_backend_url or env.get('WIS2BOX_API_BACKEND_URL', 'http://localhost:9200')  # noqa
+    })
+
+    return config
+
+
+def cutoff(days: int, now: datetime = None) -> datetime:
+    """
+    Compute the time before which data is expired
+
+    :param days: `int` of retention days
+    :param now: `datetime` of the sweep (default: now)
+
+    :returns: timezone-aware `datetime`
+    """
+
+    return (now or datetime.now(timezone.utc)) - timedelta(days=days)
+
+
+def prefix_date(prefix: str):
+    """
+    Parse the day of a daily prefix
+
+    :param prefix: `str` of object prefix, e.g. `2024-05-01/`
+
+    :returns: `datetime.date`, or None if the prefix is not a day
+    """
+
+    match = DATE_PREFIX.fullmatch(prefix)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+class RetentionSweeper:
+    """Batched, bounded-concurrency deletion of expired storage objects"""
+
+    def __init__(self, config: dict, concurrency: int = CONCURRENCY,
+                 batch_size: int = DELETE_BATCH, dry_run: bool = False,
+                 client: Minio = None):
+        """
+        :param config: `dict` from `load_retention_config`
+        :param concurrency: `int` of list and delete requests running at
+                            the same time, shared by both
+        :param batch_size: `int` of keys per multi-object delete
+        :param dry_run: `bool` of whether to count without deleting
+        :param client: `minio.Minio` client (default: created from config)
+        """
+
+        self.concurrency = concurrency
+        self.batch_size = min(batch_size, DELETE_BATCH)
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        # one limit shared by the list and delete requests
+        self._requests = threading.BoundedSemaphore(concurrency)
+        self.client = client or storage_client(
+            config, http_client=connection_pool(maxsize=concurrency))
+
+    def _listed(self, objects):
+        """Iterate a listing, holding a request slot while pages load"""
+
+        iterator = iter(objects)
+        while True:
+            with self._requests:
+                obj = next(iterator, None)
+            if obj is None:
+                return
+            yield obj
+
+    def delete_batch(self, bucket: str, keys: list, stats: dict) -> None:
+        """
+        Delete up to `batch_size` keys with one multi-object delete
+
+        :param bucket: `str` of bucket name
+        :param keys: `list` of (key, size) tuples
+        :param stats: `dict` of sweep statistics to update
+
+        :returns: None
+        """
+
+        failed = set()
+        if not self.dry_run:
+            try:
+                with self._requests:
+                    errors = list(self.client.remove_objects(
+                        bucket, [DeleteObject(key) for key, _ in keys]))
+                for error in errors:
+                    LOGGER.warning(f'Failed to delete {bucket}/{error.name}: '
+                                   f'{error.code} {error.message}')
+                    failed.add(error.name)
+            except Exception as err:
+                LOGGER.error(f'Failed to delete {len(keys)} objects from '
+                             f'{bucket}: {err}')
+                failed = {key for key, _ in keys}
+
+        with self._lock:
+            stats['batches'] += 1
+            stats['errors'] += len(failed)
+            for key, size in keys:
+                if key not in failed:
+                    stats['objects'] += 1
+                    stats['bytes'] += size
+
+    def sweep(self, bucket: str, before: datetime) -> dict:
+        """
+        Delete the objects of a bucket expired before a time
+
+        :param bucket: `str` of bucket name
+        :param before: timezone-aware `datetime` before which objects are
+                       expired
+
+        :returns: `dict` of sweep statistics
+        """
+
+        stats = {
+            'bucket': bucket,
+            'before': before.isoformat(),
+            'dry_run': self.dry_run,
+            'prefixes_expired': 0,
+            'prefixes_kept': 0,
+            'objects': 0,
+            'bytes': 0,
+            'batches': 0,
+            'errors': 0
+        }
+        start = time.perf_counter()
+
+        deleter = ThreadPoolExecutor(max_workers=self.concurrency,
+                                     thread_name_prefix='delete')
+        # bound the batches waiting so listing cannot run far ahead
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        futures = []
+
+        def submit(keys):
+            slots.acquire()
+            future = deleter.submit(self.delete_batch, bucket, keys, stats)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+
+        def collect(objects, expired):
+            batch = []
+            for obj in objects:
+                if obj.is_dir or not expired(obj):
+                    continue
+                batch.append((obj.object_name, obj.size or 0))
+                if len(batch) == self.batch_size:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+
+        def older(obj):
+            return obj.last_modified is not None and obj.last_modified < before
+
+        try:
+            prefixes = []
+            top = list(self._listed(self.client.list_objects(bucket)))
+            for obj in top:
+                if not obj.is_dir:
+                    continue
+                day = prefix_date(obj.object_name)
+                if day is None:
+                    prefixes.append((obj.object_name, older))
+                elif day < before.date():
+                    prefixes.append((obj.object_name, lambda _: True))
+                    stats['prefixes_expired'] += 1
+                else:
+                    stats['prefixes_kept'] += 1
+
+            collect(top, older)
+            with ThreadPoolExecutor(max_workers=self.concurrency,
+                                    thread_name_prefix='list') as lister:
+                listed = [lister.submit(collect, self._listed(
+                              self.client.list_objects(
+                                  bucket, prefix=prefix, recursive=True)),
+                              expired)
+                          for prefix, expired in prefixes]
+                for future in listed:
+                    future.result()
+        finally:
+            deleter.shutdown(wait=True)
+        for future in futures:
+            future.result()
+
+        stats['elapsed'] = time.perf_counter() - start
+        stats['objects_per_second'] = stats['objects'] / stats['elapsed'] if stats['elapsed'] else 0  # noqa
+
+        return stats
+
+
+def sweep_api(url: str, before: datetime, index: str = API_INDEX,
+              time_fields: tuple = API_TIME_FIELDS,
+              concurrency: int = CONCURRENCY,
+              batch_size: int = DELETE_BATCH,
+              dry_run: bool = False) -> dict:
+    """
+    Delete wis2box API documents older than a time from Elasticsearch
+
+    Each index matching `index` gets one `_delete_by_query`, which deletes
+    in scroll batches of `batch_size` documents and skips version
+    conflicts with documents updated meanwhile.  A dry run counts the
+    expired documents instead.
+
+    :param url: `str` of Elasticsearch URL
+    :param before: timezone-aware `datetime` before which documents are
+                   expired
+    :param index: `str` of index pattern
+    :param time_fields: `tuple` of document time fields, a document is
+                        expired when any of them is before `before`
+    :param concurrency: `int` of indices swept at the same time
+    :param batch_size: `int` of documents per scroll batch
+    :param dry_run: `bool` of whether to count without deleting
+
+    :returns: `dict` of sweep statistics
+    """
+
+    pool = connection_pool(maxsize=concurrency)
+    url = url.rstrip('/')
+    query = {'query': {'bool': {
+        'should': [{'range': {field: {'lte': before.isoformat()}}}
+                   for field in time_fields],
+        'minimum_should_match': 1
+    }}}
+
+    def request(method, path, **kwargs):
+        response = pool.request(method, f'{url}/{path}', **kwargs)
+        if response.status >= 400:
+            raise RuntimeError(f'{method} {path} failed with HTTP '
+                               f'{response.status}: {response.data[:200]!r}')
+        return response.json()
+
+    def sweep_index(name):
+        if dry_run:
+            return request('POST', f'{quote(name)}/_count',
+                           json=query)['count']
+        result = request('POST', f'{quote(name)}/_delete_by_query'
+                         f'?conflicts=proceed&scroll_size={batch_size}'
+                         '&wait_for_completion=true', json=query)
+        for failure in result.get('failures', []):
+            LOGGER.warning(f'Failed to delete from {name}: {failure}')
+        return result.get('deleted', 0)
+
+    stats = {
+        'index': index,
+        'before': before.isoformat(),
+        'dry_run': dry_run,
+        'indices': 0,
+        'documents': 0,
+        'errors': 0
+    }
+    start = time.perf_counter()
+
+    indices = [row['index'] for row in request(
+        'GET', f'_cat/indices/{quote(index, safe="*,")}?format=json&h=index')]
+    stats['indices'] = len(indices)
+
+    with ThreadPoolExecutor(max_workers=concurrency,
+                            thread_name_prefix='api') as executor:
+        futures = {name: executor.submit(sweep_index, name)
+                   for name in indices}
+        for name, future in futures.items():
+            try:
+                stats['documents'] += future.result()
+            except Exception as err:
+                LOGGER.error(f'Failed to sweep index {name}: {err}')
+                stats['errors'] += 1
+
+    stats['elapsed'] = time.perf_counter() - start
+    stats['documents_per_second'] = stats['documents'] / stats['elapsed'] if stats['elapsed'] else 0  # noqa
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='delete expired objects from the wis2box storage and API')  # noqa
+    parser.add_argument('--bucket', action='append', default=[],
+                        help='bucket to sweep (default: WIS2BOX_STORAGE_PUBLIC and WIS2BOX_STORAGE_INCOMING)')  # noqa
+    parser.add_argument('--days', type=int,
+                        help='storage retention in days (default: WIS2BOX_STORAGE_DATA_RETENTION_DAYS)')  # noqa
+    parser.add_argument('--api', action='store_true',
+                        help='also sweep the wis2box API documents')
+    parser.add_argument('--api-days', type=int,
+                        help='API retention in days (default: WIS2BOX_STORAGE_API_RETENTION_DAYS)')  # noqa
+    parser.add_argument('--api-index', default=API_INDEX,
+                        help='Elasticsearch index pattern of the API collections')  # noqa
+    parser.add_argument('--api-backend-url',
+                        help='Elasticsearch URL (default: WIS2BOX_API_BACKEND_URL)')  # noqa
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help='number of concurrent list and delete requests')
+    parser.add_argument('--batch-size', type=int, default=DELETE_BATCH,
+                        help='keys per multi-object delete (at most 1000)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='count the expired objects without deleting')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    config = load_retention_config(args.env_file, args.storage_source,
+                                   args.api_backend_url)
+    buckets = args.bucket or [config['public'], config['incoming']]
+    before = cutoff(config['data_retention_days'] if args.days is None
+                    else args.days)
+
+    sweeper = RetentionSweeper(config, args.concurrency, args.batch_size,
+                               args.dry_run)
+    results = [sweeper.sweep(bucket, before) for bucket in buckets]
+
+    api = None
+    if args.api:
+        api = sweep_api(config['api_backend_url'],
+                        cutoff(config['api_retention_days'] if args.api_days is None else args.api_days),  # noqa
+                        args.api_index, concurrency=args.concurrency,
+                        batch_size=args.batch_size, dry_run=args.dry_run)
+
+    if args.json:
+        print(json.dumps({'storage': results, 'api': api}, indent=4))
+    else:
+        verb = 'would delete' if args.dry_run else 'deleted'
+        for stats in results:
+            print(f"{stats['bucket']}: {verb} {stats['objects']} objects "
+                  f"({stats['bytes'] / 1024 / 1024:.1f} MB) before "
+                  f"{stats['before']} in {stats['batches']} batches, "
+                  f"{stats['prefixes_expired']} days expired, "
+                  f"{stats['prefixes_kept']} kept, {stats['errors']} errors, "
+                  f"{stats['elapsed']:.2f}s ({stats['objects_per_second']:.0f} objects/s)")  # noqa
+        if api:
+            print(f"{api['index']}: {verb} {api['documents']} documents "
+                  f"before {api['before']} from {api['indices']} indices, "
+                  f"{api['errors']} errors, {api['elapsed']:.2f}s "
+                  f"({api['documents_per_second']:.0f} documents/s)")
+
+    if any(stats['errors'] for stats in results) or (api and api['errors']):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
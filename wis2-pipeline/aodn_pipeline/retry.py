@@ -0,0 +1,434 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Persistent retry queue and dead-letter store for failed uploads
+
+`queued_sink` wraps an upload sink: an object the sink fails to store is
+written to a SQLite queue instead of failing the station, so the
+high-water mark still advances and fresh observations keep flowing while
+MinIO or the broker is down.  `RetryQueue.drain` replays due objects with
+exponential backoff and full jitter; objects failing `max_attempts` times
+move to the dead-letter store, from where they can be inspected and
+requeued.
+
+Items are keyed by object key, so queueing an object again replaces it
+and a replayed PUT simply overwrites the same object: replay is
+idempotent.
+"""
+
+import argparse
+import json
+import logging
+from pathlib import Path
+import random
+import sys
+import time
+from typing import Callable
+
+from aodn_pipeline import STATE_DIR, WIS2BOX_ENV
+from aodn_pipeline.state import connect
+
+LOGGER = logging.getLogger(__name__)
+
+RETRY_DB = STATE_DIR / 'retry.sqlite3'
+
+# backoff of the nth attempt is drawn from [0, min(MAX_DELAY, BASE_DELAY * 2**n)]  # noqa
+BASE_DELAY = 30
+MAX_DELAY = 3600
+MAX_ATTEMPTS = 12
+
+# seconds a failing sink is bypassed before fresh objects try it again
+OPEN_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retry_queue (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    wigos_station_identifier TEXT,
+    data BLOB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+    updated TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+);
+CREATE INDEX IF NOT EXISTS retry_queue_due ON retry_queue (dead, next_attempt);
+"""
+
+COLUMNS = ('id', 'key', 'wigos_station_identifier', 'attempts',
+           'next_attempt', 'last_error', 'dead', 'created', 'updated')
+
+
+def backoff(attempts: int, base: float = BASE_DELAY,
+            cap: float = MAX_DELAY) -> float:
+    """
+    Draw the delay before the next attempt with full jitter
+
+    :param attempts: `int` of attempts made so far
+    :param base: `float` of seconds of the first backoff
+    :param cap: `float` of largest backoff in seconds
+
+    :returns: `float` of seconds
+    """
+
+    return random.uniform(0, min(cap, base * 2 ** attempts))
+
+
+def station_of(key: str) -> str:
+    """
+    Extract the WIGOS identifier of a WIGOS_<wsi>_<timestamp> object key
+
+    :param key: `str` of object key
+
+    :returns: `str` of WIGOS station identifier or None
+    """
+
+    name = key.rsplit('/', 1)[-1]
+    if name.startswith('WIGOS_'):
+        return name.split('_')[1]
+    return None
+
+
+class RetryQueue:
+    """Objects waiting to be uploaded again, and those given up on"""
+
+    def __init__(self, path: Path = RETRY_DB,
+                 max_attempts: int = MAX_ATTEMPTS):
+        """
+        :param path: `Path` of the queue database
+        :param max_attempts: `int` of attempts before an object is moved
+                             to the dead-letter store
+        """
+
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.conn = connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def put(self, key: str, data: bytes, error: str = None,
+            attempts: int = 1) -> None:
+        """
+        Queue an object for a later attempt, replacing a queued object
+        of the same key
+
+        :param key: `str` of object key
+        :param data: `bytes` of object content
+        :param error: `str` of the error of the failed attempt
+        :param attempts: `int` of attempts already made
+
+        :returns: None
+        """
+
+        self.conn.execute(
+            'INSERT INTO retry_queue '
+            '(key, wigos_station_identifier, data, attempts, next_attempt, '
+            'last_error) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET data = excluded.data, '
+            'attempts = excluded.attempts, '
+            'next_attempt = excluded.next_attempt, '
+            'last_error = excluded.last_error, dead = 0, '
+            "updated = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')",
+            (key, station_of(key), data, attempts,
+             time.time() + backoff(attempts), error))
+        LOGGER.debug(f'Queued {key} for retry: {error}')
+
+    def due(self, limit: int = 100) -> list:
+        """
+        List queued objects whose next attempt is due, oldest first
+
+        :param limit: `int` of objects to return
+
+        :returns: `list` of (id, key, data, attempts) tuples
+        """
+
+        return self.conn.execute(
+            'SELECT id, key, data, attempts FROM retry_queue '
+            'WHERE dead = 0 AND next_attempt <= ? '
+            'ORDER BY next_attempt LIMIT ?', (time.time(), limit)).fetchall()
+
+    def done(self, item_id: int) -> None:
+        self.conn.execute('DELETE FROM retry_queue WHERE id = ?', (item_id,))
+
+    def failed(self, item_id: int, attempts: int, error: str) -> bool:
+        """
+        Record a failed attempt, moving the object to the dead-letter
+        store once it used up its attempts
+
+        :param item_id: `int` of queue item
+        :param attempts: `int` of attempts made including this one
+        :param error: `str` of the error of the attempt
+
+        :returns: `bool` of whether the object is now dead
+        """
+
+        dead = attempts >= self.max_attempts
+        self.conn.execute(
+            'UPDATE retry_queue SET attempts = ?, next_attempt = ?, '
+            'last_error = ?, dead = ?, '
+            "updated = strftime('%Y-%m-%dT%H:%M:%SZ', 'now') WHERE id = ?",
+            (attempts, time.time() + backoff(attempts), error, int(dead),
+             item_id))
+        if dead:
+            LOGGER.warning(f'Gave up on item {item_id} after {attempts} attempts: {error}')  # noqa
+        return dead
+
+    def drain(self, sink: Callable[[str, bytes], None],
+              budget: float = 60, limit: int = None,
+              on_attempt: Callable[[str, bool], None] = None) -> dict:
+        """
+        Replay due objects until none are due or the time budget is spent
+
+        :param sink: callable taking an object key and its content
+        :param budget: `float` of seconds to spend replaying
+        :param limit: `int` of objects to replay at most
+        :param on_attempt: callable taking the key and whether the attempt
+                           succeeded, e.g. to count retries
+
+        :returns: `dict` of replayed, failed and dead object counts
+        """
+
+        counts = {'replayed': 0, 'failed': 0, 'dead': 0}
+        deadline = time.monotonic() + budget
+        remaining = limit
+
+        while time.monotonic() < deadline and remaining != 0:
+            batch = self.due(min(remaining or 100, 100))
+            if not batch:
+                break
+
+            for item_id, key, data, attempts in batch:
+                try:
+                    sink(key, data)
+                except Exception as err:
+                    counts['failed'] += 1
+                    if self.failed(item_id, attempts + 1,
+                                   f'{type(err).__name__}: {err}'):
+                        counts['dead'] += 1
+                    if on_attempt:
+                        on_attempt(key, False)
+                    # the sink is down, leave the rest for the next drain
+                    return counts
+
+                self.done(item_id)
+                counts['replayed'] += 1
+                if on_attempt:
+                    on_attempt(key, True)
+                if remaining:
+                    remaining -= 1
+                if time.monotonic() >= deadline or remaining == 0:
+                    break
+
+        return counts
+
+    def requeue(self, item_ids: list = None) -> int:
+        """
+        Move dead objects back into the queue with fresh attempts
+
+        :param item_ids: `list` of `int` item ids, all dead objects if None
+
+        :returns: `int` of requeued objects
+        """
+
+        query = ('UPDATE retry_queue SET dead = 0, attempts = 0, '
+                 "next_attempt = 0, updated = strftime('%Y-%m-%dT%H:%M:%SZ', 'now') "  # noqa
+                 'WHERE dead = 1')
+        if item_ids is None:
+            return self.conn.execute(query).rowcount
+
+        placeholders = ','.join('?' * len(item_ids))
+        return self.conn.execute(f'{query} AND id IN ({placeholders})',
+                                 list(item_ids)).rowcount
+
+    def delete(self, item_ids: list) -> int:
+        placeholders = ','.join('?' * len(item_ids))
+        return self.conn.execute(
+            f'DELETE FROM retry_queue WHERE id IN ({placeholders})',
+            list(item_ids)).rowcount
+
+    def items(self, dead: bool = None) -> list:
+        """
+        List queued objects without their content
+
+        :param dead: `bool` to list only dead (True) or pending (False)
+                     objects, all if None
+
+        :returns: `list` of `dict` of queue items
+        """
+
+        query = f"SELECT {', '.join(COLUMNS)} FROM retry_queue"
+        params = ()
+        if dead is not None:
+            query += ' WHERE dead = ?'
+            params = (int(dead),)
+
+        return [dict(zip(COLUMNS, row))
+                for row in self.conn.execute(query + ' ORDER BY id', params)]
+
+    def get(self, item_id: int) -> tuple:
+        """
+        Get a queued object
+
+        :param item_id: `int` of queue item
+
+        :returns: `tuple` of (key, data) or None
+        """
+
+        return self.conn.execute(
+            'SELECT key, data FROM retry_queue WHERE id = ?',
+            (item_id,)).fetchone()
+
+    def counts(self) -> dict:
+        """
+        Count pending and dead objects
+
+        :returns: `dict` of pending and dead counts
+        """
+
+        rows = dict(self.conn.execute(
+            'SELECT dead, COUNT(*) FROM retry_queue GROUP BY dead'))
+        return {'pending': rows.get(0, 0), 'dead': rows.get(1, 0)}
+
+
+def queued_sink(sink: Callable[[str, bytes], None], queue: RetryQueue,
+                open_seconds: float = OPEN_SECONDS) -> Callable[[str, bytes], None]:  # noqa
+    """
+    Wrap a sink so that objects it fails to store are queued for retry
+
+    After a failure the sink is bypassed for `open_seconds` and objects
+    go straight to the queue, so an outage costs one timeout rather than
+    one per object.  The wrapper returns once the object is either stored
+    or durably queued, so callers can safely advance high-water marks.
+
+    :param sink: callable taking an object key and its content
+    :param queue: `RetryQueue` failed objects are written to
+    :param open_seconds: `float` of seconds to bypass a failing sink
+
+    :returns: callable taking an object key and its content
+    """
+
+    bypass_until = 0
+
+    def wrapper(key, data):
+        nonlocal bypass_until
+
+        if time.monotonic() < bypass_until:
+            queue.put(key, data, 'sink bypassed after a failure', attempts=0)
+            return
+
+        try:
+            sink(key, data)
+        except Exception as err:
+            bypass_until = time.monotonic() + open_seconds
+            LOGGER.warning(f'Upload of {key} failed, queued for retry: {err}')  # noqa
+            queue.put(key, data, f'{type(err).__name__}: {err}')
+
+    wrapper.__wrapped__ = sink
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='inspect and replay the queue of failed uploads')
+    parser.add_argument('--queue', type=Path, default=RETRY_DB,
+                        help='retry queue database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='list queued objects')
+    list_parser.add_argument('--dead', action='store_true',
+                             help='only list the dead-letter store')
+    list_parser.add_argument('--json', action='store_true',
+                             help='print the items as JSON')
+
+    show_parser = subparsers.add_parser('show', help='print a queued object')
+    show_parser.add_argument('id', type=int, help='queue item id')
+
+    requeue_parser = subparsers.add_parser(
+        'requeue', help='move dead objects back into the queue')
+    requeue_parser.add_argument('ids', type=int, nargs='*',
+                                help='queue item ids (default: all dead objects)')  # noqa
+
+    delete_parser = subparsers.add_parser('delete',
+                                          help='delete queued objects')
+    delete_parser.add_argument('ids', type=int, nargs='+',
+                               help='queue item ids')
+
+    drain_parser = subparsers.add_parser('drain',
+                                         help='upload due objects')
+    drain_parser.add_argument('--budget', type=float, default=300,
+                              help='seconds to spend replaying')
+    drain_parser.add_argument('--limit', type=int,
+                              help='objects to replay at most')
+    drain_parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                              help='wis2box.env with storage settings')
+    drain_parser.add_argument('--storage-source',
+                              help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')  # noqa
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with RetryQueue(args.queue) as queue:
+        if args.command == 'list':
+            items = queue.items(dead=True if args.dead else None)
+            if args.json:
+                print(json.dumps(items, indent=4))
+                return
+            for item in items:
+                state = 'DEAD' if item['dead'] else 'pending'
+                due = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                    time.gmtime(item['next_attempt']))
+                print(f"{item['id']:6d} {state:7s} {item['attempts']:2d} attempts, "  # noqa
+                      f"next {due}: {item['key']}\n"
+                      f"       {item['last_error']}")
+            counts = queue.counts()
+            print(f"{counts['pending']} pending, {counts['dead']} dead")
+        elif args.command == 'show':
+            item = queue.get(args.id)
+            if item is None:
+                parser.error(f'no queue item {args.id}')
+            sys.stdout.buffer.write(item[1])
+        elif args.command == 'requeue':
+            requeued = queue.requeue(args.ids or None)
+            print(f'Requeued {requeued} objects')
+        elif args.command == 'delete':
+            print(f'Deleted {queue.delete(args.ids)} objects')
+        elif args.command == 'drain':
+            from aodn_pipeline.ingest import storage_sink
+            from aodn_pipeline.upload import load_storage_config
+            sink = storage_sink(load_storage_config(args.env_file,
+                                                    args.storage_source))
+            counts = queue.drain(sink, args.budget, args.limit)
+            print(f"Replayed {counts['replayed']} objects, "
+                  f"{counts['failed']} failed ({counts['dead']} dead)")
+
+
+if __name__ == '__main__':
+    main()
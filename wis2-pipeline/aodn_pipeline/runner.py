@@ -0,0 +1,494 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Ingestion of every buoy of the IMOS national wave buoy network in a
+bounded process pool
+
+Each worker reads, converts and uploads one station at a time, so the
+wall-clock time of a run grows with the station count divided by the
+worker count rather than with the station count.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import sys
+import time
+
+from aodn_pipeline import WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC, WIS2BOX_ENV
+from aodn_pipeline.backpressure import create_throttle, load_broker_config
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import load_template
+from aodn_pipeline.dedup import DEDUP_DB, LOOKUPS, FingerprintCache, hit_ratio
+from aodn_pipeline.ingest import (OUTPUT_FORMATS, directory_sink,
+                                  ingest_dataset, storage_sink)
+from aodn_pipeline.metrics import METRICS_PORT, PipelineMetrics
+from aodn_pipeline.reader import MEMORY_BUDGET, open_pruned
+from aodn_pipeline.retry import RETRY_DB, RetryQueue, queued_sink, station_of
+from aodn_pipeline.state import STATE_DB, StateStore
+from aodn_pipeline.stations import NATIONAL_SITES, load_national_sites
+from aodn_pipeline.upload import load_storage_config
+
+LOGGER = logging.getLogger(__name__)
+
+SOURCE_PATTERN = 'IMOS_COASTAL-WAVE-BUOYS_*_{site}_RT_WAVE-PARAMETERS_monthly.nc'  # noqa
+
+# per-process context set up once by init_worker
+_WORKER = {}
+
+
+class StationTimeout(BaseException):
+    """
+    Processing of a station exceeded its time limit
+
+    Derived from `BaseException` like `KeyboardInterrupt`, so the
+    `except Exception` of a sink, e.g. `retry.queued_sink`, cannot mistake
+    the alarm for a failed upload and carry on without a time limit.
+    """
+
+
+@contextmanager
+def time_limit(seconds: float):
+    """
+    Raise `StationTimeout` in the current process after a number of seconds
+
+    Has no effect where SIGALRM is unavailable (Windows).
+
+    :param seconds: `float` of seconds, no limit if 0 or None
+    """
+
+    if not seconds or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise StationTimeout(f'timed out after {seconds}s')
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def init_worker(template_path: Path, state_path: Path, storage_config: dict,
+                output_dir: Path, prefix: str, advance: bool,
+                timeout: float, output_format: str = 'csv',
+                broker_config: dict = None, workers: int = 1,
+                retry_path: Path = None, dedup_path: Path = None,
+                memory_budget: int = MEMORY_BUDGET) -> None:
+    """
+    Set up the template, state store and storage connection of a worker
+    process once, rather than once per station
+
+    With `broker_config` every worker paces its uploads with its own
+    share of the wis2box notification queue; with `retry_path` objects
+    failing to upload are queued for retry instead of failing the station;
+    with `dedup_path` observations published before are skipped.
+
+    :returns: None
+    """
+
+    if output_dir:
+        sink = directory_sink(output_dir)
+    else:
+        throttle = None
+        if broker_config:
+            throttle = create_throttle(broker_config, workers)
+        sink = storage_sink(storage_config, throttle)
+        if retry_path:
+            sink = queued_sink(sink, RetryQueue(retry_path))
+
+    template = load_template(template_path)
+    _WORKER.update({
+        'template': template,
+        'encoder': BufrEncoder(template),
+        'output_format': output_format,
+        'state': StateStore(state_path),
+        'dedup': FingerprintCache(dedup_path) if dedup_path else None,
+        'sink': sink,
+        'prefix': prefix,
+        'advance': advance,
+        'timeout': timeout,
+        'memory_budget': memory_budget
+    })
+
+
+def find_source(source_dir: Path, site_name: str,
+                pattern: str = SOURCE_PATTERN) -> Path:
+    """
+    Find the latest NetCDF file of a site
+
+    :param source_dir: `Path` of directory holding IMOS NetCDF files
+    :param site_name: `str` of IMOS site name, e.g. APOLLO-BAY
+    :param pattern: `str` of glob pattern with a `{site}` placeholder
+
+    :returns: `Path` of the latest matching file or `None`
+    """
+
+    matches = sorted(Path(source_dir).glob(pattern.format(site=site_name)))
+    return matches[-1] if matches else None
+
+
+def process_station(station: dict, source_dir: Path,
+                    pattern: str = SOURCE_PATTERN) -> dict:
+    """
+    Ingest the latest file of a station inside a worker process
+
+    :param station: `dict` of station metadata with `site_name`
+    :param source_dir: `Path` of directory holding IMOS NetCDF files
+    :param pattern: `str` of glob pattern with a `{site}` placeholder
+
+    :returns: `dict` of the station result
+    """
+
+    start = time.perf_counter()
+    result = {
+        'wigos_station_identifier': station['wigos_station_identifier'],
+        'station_name': station['station_name'],
+        'status': 'ok',
+        'observations': 0,
+        'duplicates': 0,
+        'objects': 0,
+        'bytes': 0,
+        'retries': 0,
+        'dedup': dict.fromkeys(LOOKUPS, 0),
+        'timings': {},
+        'error': None
+    }
+
+    try:
+        with time_limit(_WORKER['timeout']):
+            nc_file = find_source(source_dir, station['site_name'], pattern)
+            if nc_file is None:
+                result['status'] = 'missing'
+            else:
+                with open_pruned(nc_file, _WORKER['template']) as ds:
+                    summary = ingest_dataset(ds, station, _WORKER['template'],
+                                             _WORKER['state'], _WORKER['sink'],
+                                             _WORKER['prefix'],
+                                             _WORKER['advance'],
+                                             _WORKER['output_format'],
+                                             _WORKER['encoder'],
+                                             _WORKER['dedup'],
+                                             _WORKER['memory_budget'])
+                for name in ('observations', 'duplicates', 'objects', 'bytes',
+                             'retries', 'dedup', 'timings'):
+                    result[name] = summary[name]
+    except StationTimeout as err:
+        result['status'] = 'timeout'
+        result['error'] = str(err)
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = f'{type(err).__name__}: {err}'
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run(stations: list, source_dir: Path, workers: int = None,
+        timeout: float = 300, template_path: Path = WAVE_BUOY_TEMPLATE,
+        state_path: Path = STATE_DB, storage_config: dict = None,
+        output_dir: Path = None, prefix: str = WAVE_BUOY_TOPIC,
+        advance: bool = True, pattern: str = SOURCE_PATTERN,
+        output_format: str = 'csv', broker_config: dict = None,
+        retry_path: Path = None, dedup_path: Path = None,
+        memory_budget: int = MEMORY_BUDGET) -> list:
+    """
+    Ingest a set of stations in a bounded process pool
+
+    :param stations: `list` of station `dict` with `site_name`
+    :param source_dir: `Path` of directory holding IMOS NetCDF files
+    :param workers: `int` of worker processes (default: CPU count)
+    :param timeout: `float` of seconds allowed per station
+    :param template_path: `Path` of csv2bufr mapping template
+    :param state_path: `Path` of high-water mark database
+    :param storage_config: `dict` from `load_storage_config`
+    :param output_dir: `Path` to write objects to instead of uploading
+    :param prefix: `str` of incoming path objects are stored under
+    :param advance: `bool` whether to advance the high-water marks
+    :param pattern: `str` of glob pattern with a `{site}` placeholder
+    :param output_format: `str` of output format, "csv" or "bufr4"
+    :param broker_config: `dict` from `load_broker_config` to pace uploads
+                          to the wis2box notification queue, or None
+    :param retry_path: `Path` of the retry queue failed uploads are
+                       written to, or None to fail the station instead
+    :param dedup_path: `Path` of the fingerprint database of published
+                       observations, or None to send every new row
+    :param memory_budget: `int` of bytes a chunk of TIME steps may take
+                          while a worker converts it
+
+    :returns: `list` of station result `dict`
+    """
+
+    results = []
+    workers = workers or os.cpu_count()
+    initargs = (template_path, state_path, storage_config, output_dir,
+                prefix, advance, timeout, output_format, broker_config,
+                workers, retry_path, dedup_path, memory_budget)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=initargs) as executor:
+        futures = {
+            executor.submit(process_station, station, source_dir, pattern): station  # noqa
+            for station in stations
+        }
+        for future in as_completed(futures):
+            station = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as err:
+                result = {
+                    'wigos_station_identifier': station['wigos_station_identifier'],  # noqa
+                    'station_name': station['station_name'],
+                    'status': 'failed',
+                    'observations': 0,
+                    'duplicates': 0,
+                    'objects': 0,
+                    'bytes': 0,
+                    'retries': 0,
+                    'dedup': dict.fromkeys(LOOKUPS, 0),
+                    'timings': {},
+                    'error': f'worker died: {err}',
+                    'seconds': 0
+                }
+            LOGGER.info(f"{result['wigos_station_identifier']}: {result['status']}")  # noqa
+            results.append(result)
+
+    return results
+
+
+def summarise(results: list, elapsed: float, workers: int) -> dict:
+    """
+    Summarise the throughput and failures of a run
+
+    :param results: `list` of station result `dict`
+    :param elapsed: `float` of wall-clock seconds of the run
+    :param workers: `int` of worker processes
+
+    :returns: `dict` of run statistics
+    """
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    observations = sum(r['observations'] for r in results)
+    lookups = {name: sum(r['dedup'][name] for r in results)
+               for name in LOOKUPS}
+
+    return {
+        'stations': len(results),
+        'workers': workers,
+        'elapsed': elapsed,
+        'status': counts,
+        'observations': observations,
+        'duplicates': sum(r['duplicates'] for r in results),
+        'dedup': {**lookups, 'hit_ratio': hit_ratio(lookups)},
+        'bytes': sum(r['bytes'] for r in results),
+        'stations_per_second': len(results) / elapsed if elapsed else 0,
+        'observations_per_second': observations / elapsed if elapsed else 0,
+        'failures': [r for r in results if r['status'] in ('failed', 'timeout')]  # noqa
+    }
+
+
+def replay(retry_path: Path, storage_config: dict, budget: float,
+           metrics: PipelineMetrics = None) -> dict:
+    """
+    Replay the due objects of the retry queue within a time budget
+
+    :param retry_path: `Path` of the retry queue
+    :param storage_config: `dict` from `load_storage_config`
+    :param budget: `float` of seconds to spend replaying
+    :param metrics: `PipelineMetrics` counting the retries, or None
+
+    :returns: `dict` of replayed, failed, dead, pending and dead-letter
+              counts
+    """
+
+    def count(key, ok):
+        if metrics:
+            metrics.retries.labels(station_of(key) or '').inc()
+
+    with RetryQueue(retry_path) as queue:
+        counts = {'replayed': 0, 'failed': 0, 'dead': 0}
+        if budget:
+            counts = queue.drain(storage_sink(storage_config), budget,
+                                 on_attempt=count)
+        queued = queue.counts()
+
+    if metrics:
+        metrics.record_queue(queued)
+
+    counts.update({'pending': queued['pending'],
+                   'dead_letters': queued['dead']})
+    return counts
+
+
+def report(summary: dict, as_json: bool = False) -> None:
+    """
+    Print the summary of a run
+
+    :param summary: `dict` from `summarise`
+    :param as_json: `bool` whether to print JSON
+
+    :returns: None
+    """
+
+    if as_json:
+        print(json.dumps(summary, indent=4), flush=True)
+        return
+
+    print(f"Processed {summary['stations']} stations in {summary['elapsed']:.2f}s "  # noqa
+          f"with {summary['workers']} workers "
+          f"({summary['stations_per_second']:.1f} stations/s, "
+          f"{summary['observations_per_second']:.0f} observations/s)")
+    print('  ' + ', '.join(f'{k}: {v}' for k, v in sorted(summary['status'].items())))  # noqa
+    if summary['duplicates']:
+        print(f"  skipped {summary['duplicates']} observations already published")  # noqa
+    dedup = summary['dedup']
+    if any(dedup[name] for name in LOOKUPS):
+        print(f"  fingerprint lookups: {dedup['lru_hits']} LRU hits, "
+              f"{dedup['store_hits']} store hits, {dedup['misses']} misses "
+              f"({dedup['hit_ratio']:.1%} hit ratio)")
+    for failure in summary['failures']:
+        print(f"  {failure['status'].upper()} {failure['wigos_station_identifier']} "  # noqa
+              f"({failure['station_name']}): {failure['error']}")
+    if 'retry' in summary:
+        retry = summary['retry']
+        print(f"  retry queue: {retry['replayed']} replayed, "
+              f"{retry['failed']} failed, {retry['pending']} pending, "
+              f"{retry['dead_letters']} dead")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='ingest every buoy of the IMOS national wave buoy network')
+    parser.add_argument('source_dir', type=Path,
+                        help='directory holding IMOS wave parameters NetCDF files')  # noqa
+    parser.add_argument('--sites', type=Path, default=NATIONAL_SITES,
+                        help='IMOS national site list')
+    parser.add_argument('--station', action='append', default=[],
+                        help='only process this WIGOS identifier or site name (repeatable)')  # noqa
+    parser.add_argument('--pattern', default=SOURCE_PATTERN,
+                        help='file name glob pattern with a {site} placeholder')  # noqa
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds allowed per station (0 for no limit)')
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--state', type=Path, default=STATE_DB,
+                        help='high-water mark database')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--prefix', default=WAVE_BUOY_TOPIC,
+                        help='incoming path objects are stored under')
+    parser.add_argument('--format', dest='output_format',
+                        choices=OUTPUT_FORMATS, default='csv',
+                        help='send CSV for csv2bufr or encode BUFR4 in-process')  # noqa
+    parser.add_argument('--output-dir', type=Path,
+                        help='write objects to this directory instead of uploading')  # noqa
+    parser.add_argument('--dry-run', action='store_true',
+                        help='do not advance the high-water marks')
+    parser.add_argument('--backpressure', action='store_true',
+                        help='pace uploads to the wis2box notification queue')  # noqa
+    parser.add_argument('--broker',
+                        help='broker URL (default: WIS2BOX_BROKER_HOST and WIS2BOX_BROKER_PORT)')  # noqa
+    parser.add_argument('--retry-queue', type=Path, default=RETRY_DB,
+                        help='queue of failed uploads')
+    parser.add_argument('--retry-budget', type=float, default=60,
+                        help='seconds spent replaying failed uploads after each run (0 to skip)')  # noqa
+    parser.add_argument('--dedup-db', type=Path, default=DEDUP_DB,
+                        help='fingerprint database of published observations')  # noqa
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='do not skip observations published before')
+    parser.add_argument('--memory-budget', type=float,
+                        default=MEMORY_BUDGET / 1024 / 1024,
+                        help='MiB a chunk of TIME steps may take in a worker')  # noqa
+    parser.add_argument('--json', action='store_true',
+                        help='print the summary as JSON')
+    parser.add_argument('--metrics-port', type=int, nargs='?',
+                        const=METRICS_PORT,
+                        help='serve Prometheus metrics on this port (default: AODN_PIPELINE_METRICS_PORT or 9464)')  # noqa
+    parser.add_argument('--interval', type=float, default=0,
+                        help='repeat the run every this many seconds (0 to run once)')  # noqa
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    stations = load_national_sites(args.sites)
+    if args.station:
+        selected = set(args.station)
+        stations = [s for s in stations
+                    if {s['wigos_station_identifier'], s['site_name']} & selected]  # noqa
+
+    storage_config = broker_config = None
+    if not args.output_dir:
+        storage_config = load_storage_config(args.env_file,
+                                             args.storage_source)
+        if args.backpressure:
+            broker_config = load_broker_config(args.env_file, args.broker)
+
+    metrics = None
+    if args.metrics_port:
+        metrics = PipelineMetrics()
+        metrics.serve(args.metrics_port)
+
+    while True:
+        start = time.perf_counter()
+        results = run(stations, args.source_dir, args.workers, args.timeout,
+                      args.template, args.state, storage_config,
+                      args.output_dir, args.prefix, not args.dry_run,
+                      args.pattern, args.output_format, broker_config,
+                      None if args.output_dir else args.retry_queue,
+                      None if args.no_dedup else args.dedup_db,
+                      int(args.memory_budget * 1024 * 1024))
+        elapsed = time.perf_counter() - start
+        summary = summarise(results, elapsed, args.workers)
+        if metrics:
+            metrics.record_run(results, elapsed)
+
+        # replay earlier failures only once fresh observations are sent
+        if storage_config:
+            summary['retry'] = replay(args.retry_queue, storage_config,
+                                      args.retry_budget, metrics)
+
+        report(summary, args.json)
+        if not args.interval:
+            break
+        time.sleep(max(args.interval - elapsed, 0))
+
+
+if __name__ == '__main__':
+    main()
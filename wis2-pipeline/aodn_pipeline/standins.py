@@ -0,0 +1,952 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+In-process stand-ins for the services of the wis2box compose stack
+
+They implement just enough of each protocol for the pipeline tooling to be
+exercised and benchmarked without docker.
+"""
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+import uuid
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+LOGGER = logging.getLogger(__name__)
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class StandInServer:
+    """Base class running a stand-in server in a background thread"""
+
+    server_class = ThreadingHTTPServer
+    handler = BaseHTTPRequestHandler
+    scheme = 'http'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = self.server_class((host, port), self.handler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.thread = None
+
+    @property
+    def address(self) -> tuple:
+        return self.server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f'{self.scheme}://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        LOGGER.debug(f'{type(self).__name__} listening on {self.url}')
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Keep-alive request handler with quiet logging"""
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, do not hold the body back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        # minio signs streamed payloads with aws-chunked encoding
+        if 'aws-chunked' in (self.headers.get('Content-Encoding') or '') or \
+                self.headers.get('x-amz-content-sha256', '').startswith('STREAMING-'):  # noqa
+            body = decode_aws_chunked(body)
+
+        return body
+
+    def respond(self, status: int, body: bytes = b'',
+                content_type: str = 'application/xml',
+                headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+def decode_aws_chunked(body: bytes) -> bytes:
+    """
+    Strip the chunk signatures of an aws-chunked payload
+
+    :param body: `bytes` of aws-chunked request body
+
+    :returns: `bytes` of object content
+    """
+
+    data = bytearray()
+    position = 0
+    while position < len(body):
+        line_end = body.index(b'\r\n', position)
+        size = int(body[position:line_end].split(b';')[0], 16)
+        position = line_end + 2
+        if size == 0:
+            break
+        data += body[position:position + size]
+        position += size + 2
+
+    return bytes(data)
+
+
+class S3Handler(StandInHandler):
+    """Subset of the S3 REST API used by the minio client"""
+
+    def parse(self) -> tuple:
+        url = urlparse(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}  # noqa
+        return bucket, key, query
+
+    def error(self, status: int, code: str) -> None:
+        body = f'<Error><Code>{code}</Code></Error>'.encode()
+        self.respond(status, body)
+
+    def do_HEAD(self):
+        bucket, key, query = self.parse()
+        store = self.standin
+        if bucket not in store.buckets:
+            return self.respond(404)
+        if not key:
+            return self.respond(200)
+        with store.lock:
+            data = store.buckets[bucket].get(key)
+        if data is None:
+            return self.respond(404)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', f'"{hashlib.md5(data).hexdigest()}"')
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        store = self.standin
+        if bucket not in store.buckets:
+            return self.error(404, 'NoSuchBucket')
+
+        if not key and 'location' in query:
+            body = f'<LocationConstraint xmlns="{S3_NAMESPACE}"/>'.encode()
+            return self.respond(200, body)
+
+        if not key:
+            return self.respond(200, store.list_xml(bucket, query))
+
+        with store.lock:
+            data = store.buckets[bucket].get(key)
+        if data is None:
+            return self.error(404, 'NoSuchKey')
+        self.respond(200, data, 'application/octet-stream')
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        store = self.standin
+
+        if not key:
+            store.create_bucket(bucket)
+            return self.respond(200)
+        if bucket not in store.buckets:
+            return self.error(404, 'NoSuchBucket')
+
+        if 'uploadId' in query:
+            upload = store.uploads.get(query['uploadId'])
+            if upload is None:
+                return self.error(404, 'NoSuchUpload')
+            upload[int(query['partNumber'])] = body
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            return self.respond(200, headers={'ETag': etag})
+
+        etag = store.put(bucket, key, body)
+        self.respond(200, headers={'ETag': etag})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        store = self.standin
+        if bucket not in store.buckets:
+            return self.error(404, 'NoSuchBucket')
+
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            store.uploads[upload_id] = {}
+            response = (f'<InitiateMultipartUploadResult xmlns="{S3_NAMESPACE}">'  # noqa
+                        f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'  # noqa
+                        f'<UploadId>{upload_id}</UploadId>'
+                        '</InitiateMultipartUploadResult>')
+            return self.respond(200, response.encode())
+
+        if 'uploadId' in query:
+            parts = store.uploads.pop(query['uploadId'], None)
+            if parts is None:
+                return self.error(404, 'NoSuchUpload')
+            etag = store.put(bucket, key, b''.join(parts[n] for n in sorted(parts)))  # noqa
+            response = (f'<CompleteMultipartUploadResult xmlns="{S3_NAMESPACE}">'  # noqa
+                        f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'  # noqa
+                        f'<ETag>{escape(etag)}</ETag>'
+                        '</CompleteMultipartUploadResult>')
+            return self.respond(200, response.encode())
+
+        if 'delete' in query:
+            # multi-object delete as sent by Minio.remove_objects
+            request = ElementTree.fromstring(body)
+            keys = [element.text for element in request.iter()
+                    if element.tag.endswith('Key')]
+            quiet = any(element.tag.endswith('Quiet') and element.text == 'true'  # noqa
+                        for element in request.iter())
+            store.delete(bucket, keys)
+            response = [f'<DeleteResult xmlns="{S3_NAMESPACE}">']
+            if not quiet:
+                response.extend(f'<Deleted><Key>{escape(key)}</Key></Deleted>'
+                                for key in keys)
+            response.append('</DeleteResult>')
+            return self.respond(200, ''.join(response).encode())
+
+        self.error(400, 'NotImplemented')
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        store = self.standin
+        if 'uploadId' in query:
+            store.uploads.pop(query['uploadId'], None)
+        elif bucket in store.buckets:
+            store.delete(bucket, [key])
+        self.respond(204)
+
+
+class S3StandIn(StandInServer):
+    """
+    In-memory S3 endpoint standing in for the wis2box MinIO service
+
+    Callables in `on_put` are invoked with (bucket, key, size) after each
+    object is stored, mirroring MinIO bucket notifications.  `delete_requests`
+    counts DELETE and multi-object delete requests.
+    """
+
+    handler = S3Handler
+
+    def __init__(self, buckets: list = None, host: str = '127.0.0.1',
+                 port: int = 0):
+        super().__init__(host, port)
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.uploads = {}
+        self.modified = {}
+        self.delete_requests = 0
+        self.on_put = []
+        for bucket in buckets or []:
+            self.create_bucket(bucket)
+
+    def create_bucket(self, bucket: str) -> None:
+        with self.lock:
+            self.buckets.setdefault(bucket, {})
+
+    def put(self, bucket: str, key: str, data: bytes,
+            modified: float = None) -> str:
+        with self.lock:
+            self.buckets[bucket][key] = data
+            self.modified[bucket, key] = modified or time.time()
+        for callback in self.on_put:
+            callback(bucket, key, len(data))
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def delete(self, bucket: str, keys: list) -> None:
+        with self.lock:
+            self.delete_requests += 1
+            for key in keys:
+                self.buckets[bucket].pop(key, None)
+                self.modified.pop((bucket, key), None)
+
+    def list_xml(self, bucket: str, query: dict) -> bytes:
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter', '')
+        start_after = query.get('continuation-token') or query.get('start-after', '')  # noqa
+        max_keys = int(query.get('max-keys', 1000))
+
+        with self.lock:
+            keys = sorted(k for k in self.buckets[bucket]
+                          if k.startswith(prefix) and k > start_after)
+
+        contents, prefixes = [], []
+        truncated = False
+        for key in keys:
+            if len(contents) + len(prefixes) >= max_keys:
+                truncated = True
+                break
+            if delimiter and delimiter in key[len(prefix):]:
+                common = key[:key.index(delimiter, len(prefix)) + len(delimiter)]  # noqa
+                if common not in prefixes:
+                    prefixes.append(common)
+                continue
+            contents.append(key)
+
+        last = (contents + prefixes)[-1] if truncated else ''
+        body = [f'<ListBucketResult xmlns="{S3_NAMESPACE}">',
+                f'<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>',  # noqa
+                f'<KeyCount>{len(contents) + len(prefixes)}</KeyCount>',
+                f'<MaxKeys>{max_keys}</MaxKeys>',
+                f'<IsTruncated>{str(truncated).lower()}</IsTruncated>']
+        if truncated:
+            body.append(f'<NextContinuationToken>{escape(last)}</NextContinuationToken>')  # noqa
+        for key in contents:
+            size = len(self.buckets[bucket].get(key, b''))
+            modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(
+                self.modified.get((bucket, key), 0)))
+            body.append(f'<Contents><Key>{escape(key)}</Key><Size>{size}</Size>'  # noqa
+                        f'<LastModified>{modified}</LastModified>'
+                        '<ETag>""</ETag><StorageClass>STANDARD</StorageClass>'
+                        '</Contents>')
+        for common in prefixes:
+            body.append(f'<CommonPrefixes><Prefix>{escape(common)}</Prefix></CommonPrefixes>')  # noqa
+        body.append('</ListBucketResult>')
+
+        return ''.join(body).encode()
+
+
+class GitHubReleasesHandler(StandInHandler):
+    """GitHub releases listing with ETag revalidation and Link pagination"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.fullmatch(r'/repos/([^/]+/[^/]+)/releases', url.path)
+        if not match:
+            self.respond(404, b'{"message": "Not Found"}', 'application/json')
+            return
+
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+
+        releases = self.standin.releases.get(match.group(1), [])
+        body = json.dumps(releases[(page - 1) * per_page:page * per_page]).encode()  # noqa
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+
+        headers = {'ETag': etag}
+        if page * per_page < len(releases):
+            headers['Link'] = (f'<{self.standin.url}{url.path}?per_page={per_page}'  # noqa
+                               f'&page={page + 1}>; rel="next"')
+
+        with self.standin.lock:
+            self.standin.requests += 1
+            if self.headers.get('If-None-Match') == etag:
+                self.standin.not_modified += 1
+                self.respond(304, headers=headers)
+                return
+        self.respond(200, body, 'application/json', headers)
+
+
+class GitHubReleasesStandIn(StandInServer):
+    """
+    GitHub API endpoint serving release listings, standing in for
+    api.github.com when resolving wis2box releases
+
+    `requests` and `not_modified` count the listing requests served and
+    those answered with 304 Not Modified.
+    """
+
+    handler = GitHubReleasesHandler
+
+    def __init__(self, releases: dict = None, host: str = '127.0.0.1',
+                 port: int = 0):
+        """
+        :param releases: `dict` of owner/repository to `list` of release
+                         objects, newest first
+        """
+
+        super().__init__(host, port)
+        self.lock = threading.Lock()
+        self.releases = dict(releases or {})
+        self.requests = 0
+        self.not_modified = 0
+
+
+class ElasticsearchHandler(StandInHandler):
+    """Subset of the Elasticsearch REST API used by the wis2box API"""
+
+    def reply(self, status: int, document) -> None:
+        self.respond(status, json.dumps(document).encode(), 'application/json')
+
+    def parse(self) -> tuple:
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        return parts, url.query
+
+    def do_GET(self):
+        parts, _ = self.parse()
+        store = self.standin
+        if len(parts) == 2 and parts[1] in ('_settings', '_count'):
+            with store.lock:
+                if parts[0] not in store.indices:
+                    return self.reply(404, {'error': 'index_not_found_exception', 'status': 404})  # noqa
+                if parts[1] == '_count':
+                    return self.reply(200, {'count': len(store.indices[parts[0]])})  # noqa
+                settings = dict(store.settings[parts[0]])
+            return self.reply(200, {parts[0]: {'settings': {'index': settings}}})  # noqa
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        parts, _ = self.parse()
+        body = self.read_body()
+        store = self.standin
+
+        if len(parts) == 1:
+            store.create_index(parts[0])
+            return self.reply(200, {'acknowledged': True, 'index': parts[0]})
+        if len(parts) == 2 and parts[1] == '_settings':
+            settings = json.loads(body).get('index', {})
+            with store.lock:
+                if parts[0] not in store.indices:
+                    return self.reply(404, {'error': 'index_not_found_exception', 'status': 404})  # noqa
+                for name, value in settings.items():
+                    if value is None:
+                        store.settings[parts[0]].pop(name, None)
+                    else:
+                        store.settings[parts[0]][name] = value
+                store.settings_updates.append((parts[0], settings))
+            return self.reply(200, {'acknowledged': True})
+        if len(parts) == 3 and parts[1] == '_doc':
+            return self.index_one(parts[0], parts[2], json.loads(body))
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def do_POST(self):
+        parts, _ = self.parse()
+        body = self.read_body()
+        store = self.standin
+
+        if parts[-1] == '_bulk':
+            return self.bulk(parts[0] if len(parts) == 2 else None, body)
+        if len(parts) == 2 and parts[1] == '_refresh':
+            with store.lock:
+                store.refreshes += 1
+            return self.reply(200, {'_shards': {'failed': 0}})
+        if len(parts) == 2 and parts[1] == '_count':
+            return self.do_GET()
+        if len(parts) >= 2 and parts[1] == '_doc':
+            return self.index_one(parts[0], parts[2] if len(parts) == 3 else uuid.uuid4().hex,  # noqa
+                                  json.loads(body))
+        self.reply(404, {'error': 'not found', 'status': 404})
+
+    def index_one(self, index: str, doc_id: str, document: dict) -> None:
+        store = self.standin
+        with store.lock:
+            store.requests += 1
+        time.sleep(store.request_cost + store.document_cost)
+        created = store.store(index, [(doc_id, document)])[0]
+        self.reply(201 if created else 200,
+                   {'_index': index, '_id': doc_id,
+                    'result': 'created' if created else 'updated'})
+
+    def bulk(self, default_index: str, body: bytes) -> None:
+        store = self.standin
+        with store.lock:
+            store.requests += 1
+
+        try:
+            actions = parse_bulk(body, default_index)
+        except ValueError as err:
+            return self.reply(400, {'error': {'type': 'illegal_argument_exception', 'reason': str(err)}, 'status': 400})  # noqa
+
+        with store.lock:
+            if store.capacity and store.in_flight >= store.capacity:
+                store.rejected += 1
+                rejected = True
+            else:
+                store.in_flight += 1
+                rejected = False
+        if rejected:
+            return self.reply(429, {'error': {'type': 'es_rejected_execution_exception'}, 'status': 429})  # noqa
+
+        try:
+            time.sleep(store.request_cost + store.document_cost * len(actions))  # noqa
+
+            items = []
+            for index, doc_id, document in actions:
+                created = store.store(index, [(doc_id, document)])[0]
+                items.append({'index': {'_index': index, '_id': doc_id,
+                                        'status': 201 if created else 200,
+                                        'result': 'created' if created else 'updated'}})  # noqa
+            with store.lock:
+                store.bulk_requests += 1
+        finally:
+            with store.lock:
+                store.in_flight -= 1
+
+        self.reply(200, {'took': 0, 'errors': False, 'items': items})
+
+
+def parse_bulk(body: bytes, default_index: str = None) -> list:
+    """
+    Parse an NDJSON _bulk body of index or create actions
+
+    :param body: `bytes` of request body
+    :param default_index: `str` of index of actions without `_index`
+
+    :returns: `list` of (index, id, document) tuples
+    """
+
+    try:
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]  # noqa
+    except ValueError as err:
+        raise ValueError(f'Malformed bulk request: {err}')
+    if len(lines) % 2:
+        raise ValueError('Malformed bulk request: action without a document')
+
+    actions = []
+    for action, document in zip(lines[::2], lines[1::2]):
+        if not isinstance(action, dict) or not isinstance(document, dict):
+            raise ValueError('Malformed bulk request: expected JSON objects')
+        meta = action.get('index', action.get('create'))
+        if not isinstance(meta, dict):
+            raise ValueError(f'Unsupported bulk action {list(action)}')
+        index = meta.get('_index', default_index)
+        if not index:
+            raise ValueError('Bulk action without an index')
+        actions.append((index, meta.get('_id') or uuid.uuid4().hex, document))
+
+    return actions
+
+
+class ElasticsearchStandIn(StandInServer):
+    """
+    Single-node Elasticsearch endpoint standing in for the wis2box API
+    backend
+
+    Documents are kept in memory per index.  At most `capacity` _bulk
+    requests are processed at a time, further ones are rejected with HTTP
+    429 like a full write thread pool.  `request_cost` and `document_cost`
+    are seconds of simulated indexing work per request and per document.
+    """
+
+    handler = ElasticsearchHandler
+
+    def __init__(self, indices: list = None, capacity: int = None,
+                 request_cost: float = 0.0, document_cost: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        :param indices: `list` of index names to create
+        :param capacity: `int` of concurrent _bulk requests, None for no
+                         limit
+        :param request_cost: `float` of seconds spent per request
+        :param document_cost: `float` of seconds spent per document
+        """
+
+        super().__init__(host, port)
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.settings = {}
+        self.settings_updates = []
+        self.capacity = capacity
+        self.request_cost = request_cost
+        self.document_cost = document_cost
+        self.in_flight = 0
+        self.requests = 0
+        self.bulk_requests = 0
+        self.rejected = 0
+        self.refreshes = 0
+        for index in indices or []:
+            self.create_index(index)
+
+    def create_index(self, index: str) -> None:
+        with self.lock:
+            self.indices.setdefault(index, {})
+            self.settings.setdefault(index, {})
+
+    def store(self, index: str, documents: list) -> list:
+        """
+        Store documents, creating the index as Elasticsearch does
+
+        :param index: `str` of index name
+        :param documents: `list` of (id, document) tuples
+
+        :returns: `list` of `bool` of whether each document was new
+        """
+
+        self.create_index(index)
+        with self.lock:
+            created = [doc_id not in self.indices[index]
+                       for doc_id, _ in documents]
+            self.indices[index].update(documents)
+        return created
+
+
+def minio_event(bucket: str, key: str, size: int) -> bytes:
+    """
+    Build the MinIO bucket notification wis2box subscribes to
+
+    :param bucket: `str` of bucket name
+    :param key: `str` of object key
+    :param size: `int` of object size in bytes
+
+    :returns: `bytes` of JSON event
+    """
+
+    return json.dumps({
+        'EventName': 's3:ObjectCreated:Put',
+        'Key': f'{bucket}/{key}',
+        'Records': [{
+            'eventName': 's3:ObjectCreated:Put',
+            'eventTime': utcnow(),
+            's3': {
+                'bucket': {'name': bucket},
+                'object': {'key': key, 'size': size}
+            }
+        }]
+    }).encode()
+
+
+def utcnow() -> str:
+    """
+    Current time the way MinIO and wis2box write it
+
+    :returns: `str` of ISO 8601 UTC time with milliseconds
+    """
+
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')  # noqa
+
+
+def wis2_notification(event: bytes,
+                      base_url: str = 'http://localhost/data') -> bytes:
+    """
+    Build the WIS2 notification wis2box-management publishes for an
+    object of a MinIO bucket notification
+
+    The `data_id` and canonical link keep the object file name, as
+    wis2box does for BUFR objects named after their observation.
+
+    :param event: `bytes` of JSON event from `minio_event`
+    :param base_url: `str` of public data URL
+
+    :returns: `bytes` of JSON notification
+    """
+
+    key = json.loads(event)['Records'][0]['s3']['object']['key']
+    topic, name = os.path.split(key)
+    data_id = f'{topic}/{os.path.splitext(name)[0]}'
+
+    return json.dumps({
+        'id': str(uuid.uuid4()),
+        'type': 'Feature',
+        'geometry': None,
+        'properties': {
+            'data_id': data_id,
+            'pubtime': utcnow()
+        },
+        'links': [{
+            'rel': 'canonical',
+            'type': 'application/x-bufr',
+            'href': f'{base_url}/{data_id}.bufr4'
+        }]
+    }).encode()
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    Match an MQTT topic against a subscription filter with + and #
+    wildcards
+
+    :param topic_filter: `str` of subscription topic filter
+    :param topic: `str` of published topic
+
+    :returns: `bool` of whether the topic matches
+    """
+
+    levels = topic.split('/')
+    for position, level in enumerate(topic_filter.split('/')):
+        if level == '#':
+            return True
+        if position >= len(levels) or level not in ('+', levels[position]):
+            return False
+
+    return len(topic_filter.split('/')) == len(levels)
+
+
+class MQTTHandler(StreamRequestHandler):
+    """MQTT 3.1.1 session: CONNECT, SUBSCRIBE, PUBLISH QoS 0/1 and PING"""
+
+    CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+    SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+    PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscriptions = {}
+        self.packet_id = 0
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def read_packet(self) -> tuple:
+        first = self.rfile.read(1)
+        if not first:
+            return None, None, None
+
+        length, multiplier = 0, 1
+        while True:
+            byte = self.rfile.read(1)[0]
+            length += (byte & 0x7f) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+
+        return first[0] >> 4, first[0] & 0x0f, self.rfile.read(length)
+
+    def send_packet(self, packet_type: int, flags: int,
+                    body: bytes = b'') -> None:
+        length, encoded = len(body), bytearray()
+        while True:
+            length, byte = divmod(length, 128)
+            encoded.append(byte | (0x80 if length else 0))
+            if not length:
+                break
+
+        with self.write_lock:
+            self.wfile.write(bytes([packet_type << 4 | flags]) + encoded + body)  # noqa
+
+    def deliver(self, topic: str, payload: bytes, qos: int) -> None:
+        granted = [q for f, q in self.subscriptions.items()
+                   if topic_matches(f, topic)]
+        if not granted:
+            return
+
+        qos = min(qos, max(granted))
+        body = struct.pack('!H', len(topic.encode())) + topic.encode()
+        if qos:
+            self.packet_id = self.packet_id % 0xffff + 1
+            body += struct.pack('!H', self.packet_id)
+        try:
+            self.send_packet(self.PUBLISH, qos << 1, body + payload)
+        except OSError:
+            LOGGER.debug('dropping message for closed MQTT session')
+
+    def handle(self):
+        packet_type, _, body = self.read_packet()
+        if packet_type != self.CONNECT:
+            return
+        self.send_packet(self.CONNACK, 0, b'\x00\x00')
+        self.standin.add_session(self)
+
+        try:
+            while True:
+                packet_type, flags, body = self.read_packet()
+                if packet_type in (None, self.DISCONNECT):
+                    break
+                elif packet_type == self.PUBLISH:
+                    self.handle_publish(flags, body)
+                elif packet_type == self.SUBSCRIBE:
+                    self.handle_subscribe(body)
+                elif packet_type == self.UNSUBSCRIBE:
+                    self.handle_unsubscribe(body)
+                elif packet_type == self.PINGREQ:
+                    self.send_packet(self.PINGRESP, 0)
+        except (OSError, IndexError):
+            pass
+        finally:
+            self.standin.remove_session(self)
+
+    def handle_publish(self, flags: int, body: bytes) -> None:
+        qos = flags >> 1 & 0x03
+        length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + length].decode()
+        position = 2 + length
+        if qos:
+            self.send_packet(self.PUBACK, 0, body[position:position + 2])
+            position += 2
+
+        self.standin.publish(topic, body[position:], qos)
+
+    def handle_subscribe(self, body: bytes) -> None:
+        packet_id, position, granted = body[:2], 2, bytearray()
+        while position < len(body):
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            topic_filter = body[position + 2:position + 2 + length].decode()
+            qos = min(body[position + 2 + length], 1)
+            self.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            position += 3 + length
+
+        self.send_packet(self.SUBACK, 0, packet_id + bytes(granted))
+
+    def handle_unsubscribe(self, body: bytes) -> None:
+        position = 2
+        while position < len(body):
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            self.subscriptions.pop(
+                body[position + 2:position + 2 + length].decode(), None)
+            position += 2 + length
+
+        self.send_packet(self.UNSUBACK, 0, body[:2])
+
+
+class MQTTStandIn(StandInServer):
+    """
+    MQTT 3.1.1 broker standing in for the wis2box mosquitto service
+
+    Only what the pipeline needs is implemented: clean sessions, QoS 0 and
+    1, wildcard subscriptions and keep-alive pings.  There are no retained
+    messages and credentials are accepted as given.
+    """
+
+    server_class = ThreadingTCPServer
+    handler = MQTTHandler
+    scheme = 'mqtt'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__(host, port)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.messages = 0
+        self.consumers = []
+        self.processed = 0
+        self.dropped = 0
+
+    def add_session(self, session: MQTTHandler) -> None:
+        with self.lock:
+            self.sessions.add(session)
+
+    def remove_session(self, session: MQTTHandler) -> None:
+        with self.lock:
+            self.sessions.discard(session)
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0) -> None:
+        with self.lock:
+            self.messages += 1
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.deliver(topic, payload, qos)
+        for topic_filter, backlog in self.consumers:
+            if topic_matches(topic_filter, topic):
+                try:
+                    backlog.put_nowait(payload)
+                except queue.Full:
+                    with self.lock:
+                        self.dropped += 1
+
+    def process(self, rate: float, queue_max: int = 1000,
+                topic: str = 'wis2box/storage',
+                done_topic: str = 'origin/a/wis2/au-imos/data',
+                sys_interval: float = None, transform=None) -> None:
+        """
+        Consume notifications at a fixed rate, as wis2box-management does
+        with the storage notifications queued for it by mosquitto
+
+        Messages arriving while `queue_max` are already waiting are
+        dropped and counted in `dropped`.  Each processed message is
+        published again on `done_topic`, like the WIS2 notification of a
+        published observation, after passing it through `transform` if
+        given (e.g. `wis2_notification`).
+
+        :param rate: `float` of messages processed per second
+        :param queue_max: `int` of queued messages, WIS2BOX_BROKER_QUEUE_MAX
+        :param topic: `str` of topic filter to consume
+        :param done_topic: `str` of topic processed messages go to
+        :param sys_interval: `float` of seconds between publications of
+                             the queue depth on
+                             $SYS/broker/store/messages/count, or None
+        :param transform: callable turning a consumed payload into the
+                          published one, or None to publish it unchanged
+
+        :returns: None
+        """
+
+        backlog = queue.Queue(queue_max)
+        self.consumers.append((topic, backlog))
+
+        def consume():
+            interval = 1 / rate
+            deadline = time.perf_counter()
+            while True:
+                payload = backlog.get()
+                deadline = max(deadline + interval, time.perf_counter())
+                time.sleep(max(deadline - time.perf_counter(), 0))
+                with self.lock:
+                    self.processed += 1
+                self.publish(done_topic,
+                             transform(payload) if transform else payload, 1)
+
+        def report():
+            while True:
+                time.sleep(sys_interval)
+                self.publish('$SYS/broker/store/messages/count',
+                             str(backlog.qsize()).encode())
+
+        threading.Thread(target=consume, daemon=True).start()
+        if sys_interval:
+            threading.Thread(target=report, daemon=True).start()
+
+    def notify_storage(self, topic: str = 'wis2box/storage'):
+        """
+        Build an `S3StandIn.on_put` callback publishing MinIO-style
+        bucket notifications, as the minio service does into mosquitto
+
+        :param topic: `str` of notification topic
+
+        :returns: callable of (bucket, key, size)
+        """
+
+        def callback(bucket, key, size):
+            self.publish(topic, minio_event(bucket, key, size), 1)
+
+        return callback
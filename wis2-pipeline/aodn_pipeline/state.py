@@ -0,0 +1,153 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Persistent per-station high-water marks of published observations
+
+The store is a SQLite database in WAL mode with synchronous writes, so a
+high-water mark is either fully committed or not at all when a run is
+killed.  Marks only ever move forward.
+"""
+
+import logging
+from pathlib import Path
+import sqlite3
+from typing import Union
+
+import numpy as np
+
+from aodn_pipeline import STATE_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+STATE_DB = STATE_DIR / 'state.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS high_water_mark (
+    wigos_station_identifier TEXT PRIMARY KEY,
+    last_observation TEXT NOT NULL,
+    updated TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+)
+"""
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """
+    Open a SQLite database for crash-safe pipeline state
+
+    :param path: `Path` of the database file
+
+    :returns: `sqlite3.Connection` in autocommit mode
+    """
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=FULL')
+
+    return conn
+
+
+class StateStore:
+    """High-water marks keyed by WIGOS station identifier"""
+
+    def __init__(self, path: Path = STATE_DB):
+        self.path = Path(path)
+        self.conn = connect(self.path)
+        self.conn.execute(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, wigos_station_identifier: str) -> Union[np.datetime64, None]:  # noqa
+        """
+        Get the last published observation time of a station
+
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: `numpy.datetime64` or `None` if nothing was published
+        """
+
+        row = self.conn.execute(
+            'SELECT last_observation FROM high_water_mark '
+            'WHERE wigos_station_identifier = ?',
+            (wigos_station_identifier,)).fetchone()
+
+        return np.datetime64(row[0], 'ns') if row else None
+
+    def advance(self, wigos_station_identifier: str,
+                last_observation: np.datetime64) -> None:
+        """
+        Move the high-water mark of a station forward
+
+        A mark older than the stored one is ignored, so replaying an
+        earlier file never causes later observations to be re-sent.
+
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+        :param last_observation: `numpy.datetime64` of last published time
+
+        :returns: None
+        """
+
+        value = str(np.datetime64(last_observation, 'ns'))
+        self.conn.execute(
+            'INSERT INTO high_water_mark '
+            '(wigos_station_identifier, last_observation) VALUES (?, ?) '
+            'ON CONFLICT (wigos_station_identifier) DO UPDATE SET '
+            'last_observation = excluded.last_observation, '
+            'updated = excluded.updated '
+            'WHERE excluded.last_observation > last_observation',
+            (wigos_station_identifier, value))
+        LOGGER.debug(f'{wigos_station_identifier} high-water mark: {value}')
+
+    def reset(self, wigos_station_identifier: str) -> None:
+        """
+        Forget the high-water mark of a station so it is fully republished
+
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: None
+        """
+
+        self.conn.execute(
+            'DELETE FROM high_water_mark WHERE wigos_station_identifier = ?',
+            (wigos_station_identifier,))
+
+    def items(self) -> list:
+        """
+        List all high-water marks
+
+        :returns: `list` of (wigos_station_identifier, last_observation,
+                  updated) tuples
+        """
+
+        return self.conn.execute(
+            'SELECT wigos_station_identifier, last_observation, updated '
+            'FROM high_water_mark ORDER BY wigos_station_identifier'
+        ).fetchall()
@@ -0,0 +1,542 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Station metadata of the IMOS coastal wave buoy network
+
+`StationRegistry` loads IMOS_CWB_NationalSites.csv and station_list.csv
+once into column arrays with dictionary indexes by WIGOS identifier, WMO
+identifier and site name, and a grid index on latitude and longitude, so
+per-observation lookups never rescan the CSV files.
+"""
+
+import argparse
+import csv
+from functools import lru_cache
+import io
+import logging
+from pathlib import Path
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+from aodn_pipeline import STATION_LIST, WIS2BOX_DATA
+
+LOGGER = logging.getLogger(__name__)
+
+NATIONAL_SITES = WIS2BOX_DATA / 'metadata' / 'station' / 'IMOS_CWB_NationalSites.csv'  # noqa
+
+# station_list.csv columns, in wis2box order
+STATION_LIST_FIELDS = (
+    'station_name',
+    'wigos_station_identifier',
+    'traditional_station_identifier',
+    'facility_type',
+    'latitude',
+    'longitude',
+    'elevation',
+    'barometer_height',
+    'territory_name',
+    'wmo_region'
+)
+
+# IMOS_CWB_NationalSites.csv columns mapped to station_list.csv columns
+NATIONAL_SITES_FIELDS = {
+    'National Coastal Wave Buoy Network': 'station_name',
+    'WIGOs ID': 'wigos_station_identifier',
+    'WMO ID': 'traditional_station_identifier',
+    'Latitude': 'latitude',
+    'Longitude': 'longitude'
+}
+
+# station_list.csv values shared by every wave buoy
+STATION_DEFAULTS = {
+    'facility_type': 'seaFixed',
+    'elevation': '1',
+    'barometer_height': '1',
+    'territory_name': 'AUS',
+    'wmo_region': 'southWestPacific'
+}
+
+WIGOS_PATTERN = r'^0-\d{1,5}-\d{1,5}-[0-9A-Za-z]{1,16}$'
+
+# size of the latitude/longitude grid cells of the spatial index, degrees
+GRID_DEGREES = 1.0
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def imos_site_name(name: str) -> str:
+    """
+    Derive the IMOS file naming site name from a network site name,
+    e.g. "Apollo Bay" -> "APOLLO-BAY",
+    "Central (Port Phillip Bay)" -> "CENTRAL"
+
+    :param name: `str` of site name in the national site list
+
+    :returns: `str` of site name as used in IMOS file names
+    """
+
+    name = name.split('(')[0].strip().upper()
+    return re.sub(r'[^A-Z0-9]+', '-', name).strip('-')
+
+
+def read_national_sites(path: Path = NATIONAL_SITES) -> pd.DataFrame:
+    """
+    Read IMOS_CWB_NationalSites.csv into station_list.csv columns,
+    dropping the region header and separator rows
+
+    :param path: `Path` of the national site list
+
+    :returns: `pandas.DataFrame` of site rows, including sites without a
+              WIGOS identifier
+    """
+
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False,
+                        encoding='utf-8-sig')
+    frame = frame[list(NATIONAL_SITES_FIELDS)].rename(
+        columns=NATIONAL_SITES_FIELDS).apply(lambda column: column.str.strip())
+
+    # region headers only carry a name, sites always have a position
+    frame = frame[(frame['latitude'] != '') & (frame['longitude'] != '')]
+    for field, value in STATION_DEFAULTS.items():
+        frame[field] = value
+
+    return frame[list(STATION_LIST_FIELDS)].reset_index(drop=True)
+
+
+def read_station_list(path: Path = STATION_LIST) -> pd.DataFrame:
+    """
+    Read a wis2box station_list.csv
+
+    :param path: `Path` of the station list
+
+    :returns: `pandas.DataFrame` of station rows
+    """
+
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    for field in STATION_LIST_FIELDS:
+        if field not in frame:
+            frame[field] = ''
+
+    return frame.apply(lambda column: column.str.strip())
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great circle distance between points
+
+    :param lat1: latitude(s) of the first points in degrees
+    :param lon1: longitude(s) of the first points in degrees
+    :param lat2: latitude(s) of the second points in degrees
+    :param lon2: longitude(s) of the second points in degrees
+
+    :returns: `numpy.ndarray` of distances in kilometres
+    """
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class StationRegistry:
+    """Wave buoy stations indexed by identifier, name and position"""
+
+    def __init__(self, frame: pd.DataFrame, conflicts: list = ()):
+        """
+        :param frame: `pandas.DataFrame` of station_list.csv columns, one
+                      row per station
+        :param conflicts: `list` of `dict` of national sites replaced by a
+                          station_list.csv entry with another identifier,
+                          from `from_files`
+        """
+
+        self.frame = frame.reset_index(drop=True)
+        self.conflicts = list(conflicts)
+        self.frame['site_name'] = self.frame['station_name'].map(imos_site_name)  # noqa
+        self.latitude = pd.to_numeric(self.frame['latitude'], errors='coerce').to_numpy()  # noqa
+        self.longitude = pd.to_numeric(self.frame['longitude'], errors='coerce').to_numpy()  # noqa
+
+        # rows are returned as shared dicts, built once
+        self.stations = self.frame.to_dict('records')
+
+        # later rows win, so station_list.csv entries take precedence
+        self._by_wigos = {}
+        self._by_wmo = {}
+        self._by_name = {}
+        for index, station in enumerate(self.stations):
+            self._by_wigos[station['wigos_station_identifier']] = index
+            if station['traditional_station_identifier']:
+                self._by_wmo[station['traditional_station_identifier']] = index  # noqa
+            for name in {station['site_name'],
+                         self.normalise(station['station_name'])}:
+                self._by_name[name] = index
+
+        self._grid = {}
+        cells = np.floor(np.column_stack([self.latitude, self.longitude]) /
+                         GRID_DEGREES)
+        for index, cell in enumerate(cells):
+            if not np.isnan(cell).any():
+                self._grid.setdefault(tuple(cell.astype(int)), []).append(index)  # noqa
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def __iter__(self):
+        return iter(self.stations)
+
+    def __contains__(self, wigos_station_identifier: str) -> bool:
+        return wigos_station_identifier in self._by_wigos
+
+    @staticmethod
+    def normalise(name: str) -> str:
+        """
+        Normalise a site name for lookups, so that the NetCDF `site_name`
+        (APOLLO-BAY) matches the station names "Apollo-bay" and "Apollo Bay"
+
+        :param name: `str` of site or station name
+
+        :returns: `str` of normalised name
+        """
+
+        return re.sub(r'[\s_-]+', '-', name.strip().upper())
+
+    @classmethod
+    def from_files(cls, national_sites: Path = NATIONAL_SITES,
+                   station_list: Path = STATION_LIST):
+        """
+        Build a registry from the national site list and a station list
+
+        Stations are keyed by WIGOS identifier and sites of the national
+        list without one are skipped.  station_list.csv is what wis2box
+        publishes under, so its entries take precedence: a national site
+        with the same WIGOS identifier, WMO identifier or station name as a
+        station_list.csv entry is replaced by it.  Replacements under a
+        different WIGOS identifier are recorded in `conflicts`.
+
+        :param national_sites: `Path` of IMOS_CWB_NationalSites.csv, or None
+        :param station_list: `Path` of station_list.csv, or None
+
+        :returns: `StationRegistry`
+        """
+
+        empty = pd.DataFrame(columns=STATION_LIST_FIELDS)
+        national = read_national_sites(national_sites) if national_sites else empty  # noqa
+        listed = read_station_list(station_list) \
+            if station_list and Path(station_list).exists() else empty
+
+        national = national[national['wigos_station_identifier'] != '']
+        listed = listed[listed['wigos_station_identifier'] != '']
+
+        keys = {}
+        for _, station in listed.iterrows():
+            keys[('WIGOS identifier', station['wigos_station_identifier'])] = station  # noqa
+            if station['traditional_station_identifier']:
+                keys[('WMO identifier', station['traditional_station_identifier'])] = station  # noqa
+            keys[('station name', cls.normalise(station['station_name']))] = station  # noqa
+
+        replaced, conflicts = [], []
+        for _, site in national.iterrows():
+            for key in (('WIGOS identifier', site['wigos_station_identifier']),  # noqa
+                        ('WMO identifier', site['traditional_station_identifier']),  # noqa
+                        ('station name', cls.normalise(site['station_name']))):  # noqa
+                station = keys.get(key)
+                if station is None or not key[1]:
+                    continue
+                replaced.append(site.name)
+                if station['wigos_station_identifier'] != site['wigos_station_identifier']:  # noqa
+                    conflicts.append({
+                        'wigos_station_identifier': station['wigos_station_identifier'],  # noqa
+                        'station_name': station['station_name'],
+                        'national_wigos_station_identifier': site['wigos_station_identifier'],  # noqa
+                        'national_station_name': site['station_name'],
+                        'matched': key[0]
+                    })
+                break
+
+        frame = pd.concat([national.drop(index=replaced), listed],
+                          ignore_index=True)
+        # a later row replaces an earlier one with the same identifier
+        frame = frame.drop_duplicates('wigos_station_identifier', keep='last')
+
+        return cls(frame[list(STATION_LIST_FIELDS)], conflicts)
+
+    def get(self, wigos_station_identifier: str) -> dict:
+        """
+        Look up a station by WIGOS identifier
+
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: `dict` of station, or None
+        """
+
+        index = self._by_wigos.get(wigos_station_identifier)
+        return None if index is None else self.stations[index]
+
+    def by_wmo(self, traditional_station_identifier: str) -> dict:
+        """
+        Look up a station by WMO identifier
+
+        :param traditional_station_identifier: `str` of WMO identifier
+
+        :returns: `dict` of station, or None
+        """
+
+        index = self._by_wmo.get(str(traditional_station_identifier).strip())
+        return None if index is None else self.stations[index]
+
+    def by_name(self, name: str) -> dict:
+        """
+        Look up a station by station name or IMOS site name
+
+        :param name: `str` of name, compared after `normalise`
+
+        :returns: `dict` of station, or None
+        """
+
+        index = self._by_name.get(self.normalise(name))
+        return None if index is None else self.stations[index]
+
+    def lookup(self, site_name: str = None,
+               wigos_station_identifier: str = None) -> dict:
+        """
+        Look up a station by WIGOS identifier or, failing that, site name
+
+        :param site_name: `str` of the site name, e.g. from the NetCDF
+                          attributes
+        :param wigos_station_identifier: `str` of WIGOS station identifier
+
+        :returns: `dict` of station
+        """
+
+        if wigos_station_identifier:
+            station = self.get(wigos_station_identifier)
+        else:
+            station = self.by_name(site_name) if site_name else None
+
+        if station is None:
+            raise KeyError('Station not found: '
+                           f'{wigos_station_identifier or site_name}')
+
+        return station
+
+    def nearest(self, latitude: float, longitude: float,
+                max_distance: float = 50) -> dict:
+        """
+        Find the station nearest to a position, searching only the grid
+        cells within range
+
+        :param latitude: `float` of latitude in degrees
+        :param longitude: `float` of longitude in degrees
+        :param max_distance: `float` of search radius in kilometres
+
+        :returns: `dict` of station, or None if none is within range
+        """
+
+        km_per_degree = np.pi * EARTH_RADIUS_KM / 180
+        lat_cells = int(np.ceil(max_distance / km_per_degree / GRID_DEGREES))
+        lon_scale = max(np.cos(np.radians(latitude)), 1e-3)
+        lon_cells = int(np.ceil(max_distance / km_per_degree / lon_scale /
+                                GRID_DEGREES))
+        row = int(np.floor(latitude / GRID_DEGREES))
+        col = int(np.floor(longitude / GRID_DEGREES))
+
+        candidates = [index
+                      for r in range(row - lat_cells, row + lat_cells + 1)
+                      for c in range(col - lon_cells, col + lon_cells + 1)
+                      for index in self._grid.get((r, c), ())]
+        if not candidates:
+            return None
+
+        distances = haversine(latitude, longitude,
+                              self.latitude[candidates],
+                              self.longitude[candidates])
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance:
+            return None
+
+        return self.stations[candidates[best]]
+
+    def validate(self) -> list:
+        """
+        Check every station in one vectorised pass over the columns
+
+        :returns: `list` of `dict` with wigos_station_identifier,
+                  station_name, severity (error or warning) and problem
+        """
+
+        frame = self.frame
+        wsi = frame['wigos_station_identifier']
+        wmo = frame['traditional_station_identifier']
+        names = frame['station_name'].map(self.normalise)
+
+        checks = [
+            ('error', 'invalid WIGOS station identifier',
+             ~wsi.str.match(WIGOS_PATTERN)),
+            ('error', 'WMO identifier is not 7 digits',
+             ~wmo.str.fullmatch(r'\d{7}')),
+            ('error', 'latitude missing or outside -90..90',
+             ~(np.abs(self.latitude) <= 90)),
+            ('error', 'longitude missing or outside -180..180',
+             ~(np.abs(self.longitude) <= 180)),
+            ('error', 'duplicate WMO identifier',
+             wmo.duplicated(keep=False) & (wmo != '')),
+            ('warning', 'WIGOS local identifier differs from WMO identifier',
+             wsi.str.rsplit('-', n=1).str[-1] != wmo),
+            # A1 = 7 is all bits set in the 3-bit BUFR regionNumber (001003)
+            ('warning', 'WMO region digit 7 encodes as missing in BUFR',
+             wmo.str.match(r'^7\d{6}$')),
+            ('warning', 'station name shared with another station',
+             names.duplicated(keep=False))
+        ]
+        for field in STATION_LIST_FIELDS:
+            checks.append(('error', f'{field} is empty', frame[field] == ''))
+
+        # resolved in favour of station_list.csv by from_files
+        problems = [{
+            'wigos_station_identifier': conflict['wigos_station_identifier'],
+            'station_name': conflict['station_name'],
+            'severity': 'warning',
+            'problem': f"station_list.csv entry has the {conflict['matched']} of "  # noqa
+                       f"national site {conflict['national_wigos_station_identifier']} "  # noqa
+                       f"({conflict['national_station_name']}) under another WIGOS identifier, "  # noqa
+                       'using the station_list.csv entry'
+        } for conflict in self.conflicts]
+        for severity, problem, mask in checks:
+            for index in np.flatnonzero(np.asarray(mask, dtype=bool)):
+                problems.append({
+                    'wigos_station_identifier': wsi.iat[index],
+                    'station_name': frame['station_name'].iat[index],
+                    'severity': severity,
+                    'problem': problem
+                })
+
+        return problems
+
+    def to_station_list(self) -> str:
+        """
+        Generate a wis2box station_list.csv of all stations
+
+        :returns: `str` of CSV text
+        """
+
+        buffer = io.StringIO()
+        self.frame[list(STATION_LIST_FIELDS)].to_csv(
+            buffer, index=False, quoting=csv.QUOTE_MINIMAL,
+            lineterminator='\n')
+
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def load_registry(national_sites: Path = NATIONAL_SITES,
+                  station_list: Path = STATION_LIST) -> StationRegistry:
+    """
+    Load the station registry, once per process for a given pair of files
+
+    :param national_sites: `Path` of IMOS_CWB_NationalSites.csv, or None
+    :param station_list: `Path` of station_list.csv, or None
+
+    :returns: `StationRegistry`
+    """
+
+    return StationRegistry.from_files(national_sites, station_list)
+
+
+def load_national_sites(path: Path = NATIONAL_SITES,
+                        station_list: Path = STATION_LIST) -> list:
+    """
+    Load the buoys of IMOS_CWB_NationalSites.csv that have a WIGOS
+    identifier, merged with station_list.csv
+
+    Stations registered in station_list.csv keep the identifiers they are
+    registered under, so every tool publishes a buoy under the same WIGOS
+    identifier as `aodn_pipeline.ingest` and wis2box.
+
+    :param path: `Path` of the national site list
+    :param station_list: `Path` of station_list.csv, or None
+
+    :returns: `list` of `dict` with the station_list.csv fields and
+              `site_name`
+    """
+
+    registry = load_registry(Path(path), Path(station_list) if station_list else None)  # noqa
+    for conflict in registry.conflicts:
+        LOGGER.warning(f"{conflict['station_name']}: using station_list.csv "
+                       f"identifier {conflict['wigos_station_identifier']}, "
+                       f"not {conflict['national_wigos_station_identifier']} "
+                       'of the national site list')
+
+    return list(registry)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='validate the wave buoy stations and generate station_list.csv')  # noqa
+    parser.add_argument('--national-sites', type=Path, default=NATIONAL_SITES,
+                        help='IMOS national wave buoy site list')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='existing wis2box station list to merge')
+    parser.add_argument('--output', type=Path,
+                        help='write the generated station_list.csv here ("-" for stdout)')  # noqa
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    unregistered = read_national_sites(args.national_sites)
+    unregistered = unregistered[unregistered['wigos_station_identifier'] == '']  # noqa
+
+    registry = StationRegistry.from_files(args.national_sites,
+                                          args.station_list)
+    problems = registry.validate()
+    errors = [p for p in problems if p['severity'] == 'error']
+
+    # keep stdout for the CSV when writing it there
+    stdout = args.output is not None and str(args.output) == '-'
+    report = sys.stderr if stdout else sys.stdout
+
+    print(f'{len(registry)} stations, {len(unregistered)} national sites '
+          'without a WIGOS identifier skipped', file=report)
+    for problem in problems:
+        print(f"  {problem['severity'].upper()} "
+              f"{problem['wigos_station_identifier']} "
+              f"({problem['station_name']}): {problem['problem']}",
+              file=report)
+
+    if args.output and not errors:
+        if stdout:
+            print(registry.to_station_list(), end='')
+        else:
+            args.output.write_text(registry.to_station_list())
+            print(f'Wrote {len(registry)} stations to {args.output}')
+
+    if errors:
+        if args.output:
+            print('station_list.csv not written', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Compilation of csv2bufr mapping templates into cached encoding plans
+
+wis2box only finds out that a template is broken when it first tries to
+encode with it.  `compile_template` checks a template up front: every
+value is parsed, the descriptor sequence is expanded against the BUFR
+tables of its masterTablesVersionNumber, every eccodes_key is looked up in
+the expanded message and every valid range is compared with what the
+element can encode.  The result is an encoding plan with constants
+resolved, the input columns listed and the packed base message of
+single-observation messages prebuilt, which `BufrEncoder` uses instead of
+interpreting the template JSON again.
+
+Plans are cached as JSON under STATE_DIR/templates, named after the
+template `metadata.id` and a hash of its content and the ecCodes version,
+so a changed template or ecCodes upgrade compiles afresh.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+
+import eccodes
+
+from aodn_pipeline import STATE_DIR, WAVE_BUOY_TEMPLATE
+
+LOGGER = logging.getLogger(__name__)
+
+TEMPLATE_CACHE = STATE_DIR / 'templates'
+
+# bumped when the layout of compiled plans changes
+PLAN_VERSION = 1
+
+# header keys set from the number of observations in the message
+SUBSET_KEYS = ('numberOfSubsets', 'compressedData')
+
+VALUE_KINDS = ('const', 'data', 'array')
+
+# data mapping fields holding constants
+ELEMENT_FIELDS = ('scale', 'offset', 'valid_min', 'valid_max')
+
+
+class TemplateError(ValueError):
+    """A csv2bufr mapping template that cannot be encoded with"""
+
+    def __init__(self, problems: list):
+        self.problems = problems
+        super().__init__('; '.join(problems))
+
+
+def parse_value(value: str):
+    """
+    Split a csv2bufr template value into its kind and argument
+
+    :param value: `str` of template value, e.g. "const:4" or "data:year"
+
+    :returns: `tuple` of (kind, argument), kind `None` for empty values
+    """
+
+    if not value:
+        return None, None
+
+    kind, _, argument = value.partition(':')
+    if kind == 'const':
+        try:
+            argument = int(argument)
+        except ValueError:
+            argument = float(argument)
+    elif kind == 'array':
+        argument = [int(v) for v in argument.split(',')]
+
+    return kind, argument
+
+
+def template_hash(template: dict) -> str:
+    """
+    Hash the content of a template together with the ecCodes version
+
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `str` of hex SHA-256 digest
+    """
+
+    content = json.dumps(template, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(content.encode())
+    digest.update(f'{eccodes.codes_get_api_version()}/{PLAN_VERSION}'.encode())  # noqa
+
+    return digest.hexdigest()
+
+
+def _parse(value, where: str, problems: list, kinds=VALUE_KINDS):
+    try:
+        kind, argument = parse_value(value)
+    except (AttributeError, TypeError, ValueError):
+        problems.append(f'{where}: cannot parse {value!r}')
+        return None, None
+
+    if kind is not None and kind not in kinds:
+        problems.append(f'{where}: {kind!r} values are not supported here')
+        return None, None
+    if kind == 'data' and not argument:
+        problems.append(f'{where}: data value without column name')
+        return None, None
+
+    return kind, argument
+
+
+def _expanded_keys(handle) -> set:
+    iterator = eccodes.codes_bufr_keys_iterator_new(handle)
+    keys = set()
+    try:
+        while eccodes.codes_bufr_keys_iterator_next(iterator):
+            keys.add(eccodes.codes_bufr_keys_iterator_get_name(iterator))
+    finally:
+        eccodes.codes_bufr_keys_iterator_delete(iterator)
+
+    return keys
+
+
+def encodable_range(handle, key: str) -> tuple:
+    """
+    Range of values a data element can hold
+
+    The maximum is the all-ones value, which BUFR reserves for missing
+    values; csv2bufr templates use it as valid_max.
+
+    :param handle: ecCodes BUFR handle with expanded descriptors
+    :param key: `str` of data key, e.g. "#1#significantWaveHeight"
+
+    :returns: `tuple` of (minimum, maximum, resolution) `float`, or None
+              for elements without numeric encoding
+    """
+
+    try:
+        scale = eccodes.codes_get(handle, f'{key}->scale')
+        reference = eccodes.codes_get(handle, f'{key}->reference')
+        width = eccodes.codes_get(handle, f'{key}->width')
+    except eccodes.CodesInternalError:
+        return None
+
+    factor = 10.0 ** -scale
+    return reference * factor, (reference + 2 ** width - 1) * factor, factor
+
+
+def compile_template(template: dict) -> dict:
+    """
+    Validate a template and compile it into an encoding plan
+
+    :param template: `dict` of csv2bufr mapping template
+
+    :returns: `dict` of JSON-serialisable encoding plan
+    """
+
+    problems, warnings = [], []
+
+    if not isinstance(template.get('header'), list) or \
+            not isinstance(template.get('data'), list):
+        raise TemplateError(['header and data must be lists of mappings'])
+
+    template_id = (template.get('metadata') or {}).get('id')
+    if not template_id:
+        problems.append('metadata.id is missing')
+
+    columns = []
+
+    def use(column):
+        if column not in columns:
+            columns.append(column)
+
+    kind, argument = _parse(template.get('wigos_station_identifier', ''),
+                            'wigos_station_identifier', problems, ('data',))
+    if kind == 'data':
+        use(argument)
+
+    header, descriptors, tables = [], None, None
+    for position, item in enumerate(template['header']):
+        key = item.get('eccodes_key')
+        where = f'header[{position}] {key}'
+        if not key:
+            problems.append(f'header[{position}]: eccodes_key is missing')
+            continue
+        kind, argument = _parse(item.get('value', ''), where, problems)
+        if kind is None or key in SUBSET_KEYS:
+            continue
+        if key == 'unexpandedDescriptors':
+            if kind != 'array':
+                problems.append(f'{where}: must be an array: value')
+            descriptors = argument if kind == 'array' else [argument]
+            continue
+        if key == 'masterTablesVersionNumber' and kind == 'const':
+            tables = argument
+        if kind == 'data':
+            use(argument)
+        header.append((key, kind, argument))
+
+    data = []
+    for position, item in enumerate(template['data']):
+        key = item.get('eccodes_key')
+        where = f'data[{position}] {key}'
+        if not key:
+            problems.append(f'data[{position}]: eccodes_key is missing')
+            continue
+        kind, argument = _parse(item.get('value', ''), where, problems,
+                                ('const', 'data'))
+        if kind is None:
+            continue
+        element = {'key': key, 'kind': kind, 'argument': argument}
+        for field in ELEMENT_FIELDS:
+            _, element[field] = _parse(item.get(field, ''),
+                                       f'{where} {field}', problems,
+                                       ('const',))
+        element['scale'] = element['scale'] or 0
+        element['offset'] = element['offset'] or 0
+        if None not in (element['valid_min'], element['valid_max']) and \
+                element['valid_min'] > element['valid_max']:
+            problems.append(f'{where}: valid_min exceeds valid_max')
+        if kind == 'data':
+            use(argument)
+        data.append(element)
+
+    if descriptors is None:
+        raise TemplateError(problems + ['header: unexpandedDescriptors is missing'])  # noqa
+
+    handle = eccodes.codes_bufr_new_from_samples('BUFR4')
+    try:
+        for key, kind, argument in header:
+            if not eccodes.codes_is_defined(handle, key):
+                problems.append(f'header {key}: unknown ecCodes key')
+            elif kind == 'const':
+                try:
+                    eccodes.codes_set(handle, key, argument)
+                except eccodes.CodesInternalError as err:
+                    problems.append(f'header {key}: cannot set {argument}: {err}')  # noqa
+
+        eccodes.codes_set(handle, 'numberOfSubsets', 1)
+        eccodes.codes_set(handle, 'compressedData', 0)
+        try:
+            eccodes.codes_set_array(handle, 'unexpandedDescriptors',
+                                    descriptors)
+        except eccodes.CodesInternalError as err:
+            raise TemplateError(problems + [f'unexpandedDescriptors {descriptors} not in BUFR tables version {tables}: {err}'])  # noqa
+
+        expanded = _expanded_keys(handle)
+        seen = set()
+        for element in data:
+            key = element['key']
+            if key in seen:
+                problems.append(f'data {key}: mapped more than once')
+            seen.add(key)
+            if key not in expanded:
+                problems.append(f'data {key}: not in the expansion of {descriptors}')  # noqa
+                continue
+            limits = encodable_range(handle, key)
+            if limits is None:
+                continue
+            low, high, resolution = limits
+            if element['valid_max'] is not None and \
+                    element['valid_max'] > high + resolution / 2:
+                warnings.append(f"data {key}: valid_max {element['valid_max']} above the encodable {high:g}")  # noqa
+            if element['valid_min'] is not None and \
+                    element['valid_min'] < low - resolution / 2:
+                warnings.append(f"data {key}: valid_min {element['valid_min']} below the encodable {low:g}")  # noqa
+        if problems:
+            raise TemplateError(problems)
+
+        eccodes.codes_set(handle, 'pack', True)
+        base = eccodes.codes_get_message(handle)
+    finally:
+        eccodes.codes_release(handle)
+
+    for warning in warnings:
+        LOGGER.warning(f'{template_id}: {warning}')
+
+    return {
+        'id': template_id,
+        'hash': template_hash(template),
+        'columns': columns,
+        'header': header,
+        'descriptors': descriptors,
+        'data': data,
+        'base_message': base64.b64encode(base).decode(),
+        'warnings': warnings
+    }
+
+
+def cache_path(template: dict, cache_dir: Path = TEMPLATE_CACHE) -> Path:
+    """
+    Locate the cached plan of a template
+
+    :param template: `dict` of csv2bufr mapping template
+    :param cache_dir: `Path` of the plan cache
+
+    :returns: `Path` of the plan file
+    """
+
+    template_id = (template.get('metadata') or {}).get('id') or 'template'
+    return Path(cache_dir) / f'{template_id}-{template_hash(template)[:16]}.json'  # noqa
+
+
+def load_plan(template: dict, cache_dir: Path = TEMPLATE_CACHE) -> dict:
+    """
+    Get the encoding plan of a template, compiling it on a cache miss
+
+    :param template: `dict` of csv2bufr mapping template
+    :param cache_dir: `Path` of the plan cache, or None not to cache
+
+    :returns: `dict` of encoding plan
+    """
+
+    if cache_dir is None:
+        return compile_template(template)
+
+    path = cache_path(template, cache_dir)
+    try:
+        with path.open() as fh:
+            plan = json.load(fh)
+        if plan.get('hash') == template_hash(template):
+            return plan
+    except (OSError, ValueError):
+        pass
+
+    plan = compile_template(template)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix(f'.{os.getpid()}.tmp')
+        partial.write_text(json.dumps(plan))
+        os.replace(partial, path)
+    except OSError as err:
+        LOGGER.warning(f'Cannot cache the plan of {plan["id"]}: {err}')
+
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='validate and compile csv2bufr mapping templates')
+    parser.add_argument('templates', type=Path, nargs='*',
+                        default=[WAVE_BUOY_TEMPLATE],
+                        help='csv2bufr mapping templates')
+    parser.add_argument('--cache-dir', type=Path, default=TEMPLATE_CACHE,
+                        help='directory compiled plans are cached in')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compile without reading or writing the cache')
+    parser.add_argument('--strict', action='store_true',
+                        help='reject templates with warnings too')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    failed = False
+    for path in args.templates:
+        start = time.perf_counter()
+        try:
+            with path.open() as fh:
+                template = json.load(fh)
+            plan = load_plan(template, None if args.no_cache else args.cache_dir)  # noqa
+        except (OSError, ValueError) as err:
+            failed = True
+            problems = getattr(err, 'problems', [str(err)])
+            print(f'{path}: INVALID')
+            for problem in problems:
+                print(f'  {problem}')
+            continue
+
+        elapsed = (time.perf_counter() - start) * 1000
+        status = 'ok'
+        if plan['warnings']:
+            status = 'INVALID' if args.strict else 'ok with warnings'
+            failed = failed or args.strict
+        print(f"{path}: {status} ({plan['id']}, {len(plan['data'])} elements, "  # noqa
+              f"{len(plan['columns'])} columns, {elapsed:.1f} ms)")
+        for warning in plan['warnings']:
+            print(f'  {warning}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+End-to-end publish latency of wis2box
+
+`LatencyTracer` follows each object from the moment it lands in
+wis2box-incoming to its WIS2 notification on the wave buoy topic:
+
+- `storage`: from the MinIO `eventTime` of the PUT until the bucket
+  notification arrives on `wis2box/storage`
+- `publish`: from the storage notification until wis2box-management
+  publishes the data notification on
+  `origin/a/wis2/au-imos/data/core/ocean/surface-based-observations/wave-buoys`
+- `total`: from the PUT until the data notification
+
+Objects and notifications are correlated by the WIGOS_<wsi>_<timestamp>
+name they share.  A CSV object yields one notification per observation;
+it is matched by the notification of its last observation, after which
+it is named, and the other notifications are counted as unmatched.
+
+The subscriber is a paho-mqtt client driven by the asyncio event loop
+through its socket callbacks, so no network thread is involved and the
+receive timestamps are taken as soon as the loop reads the socket.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from pathlib import Path
+import time
+
+import paho.mqtt.client as mqtt
+
+from aodn_pipeline import WAVE_BUOY_TOPIC, WIS2BOX_ENV
+from aodn_pipeline.backpressure import correlation_key, load_broker_config
+from aodn_pipeline.bench import latency_stats
+from aodn_pipeline.upload import load_storage_config
+
+LOGGER = logging.getLogger(__name__)
+
+STORAGE_TOPIC = 'wis2box/storage'
+DATA_TOPIC = f'origin/a/wis2/{WAVE_BUOY_TOPIC}'
+
+STAGES = ('storage', 'publish', 'total')
+PERCENTILES = (50, 95, 99)
+
+
+def event_time(value: str) -> float:
+    """
+    Parse an ISO 8601 event time
+
+    :param value: `str` of time, e.g. 2025-08-01T00:00:00.123Z
+
+    :returns: `float` of Unix time
+    """
+
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class LatencyTracer:
+    """Correlation of storage and data notifications into stage latencies"""
+
+    def __init__(self, timeout: float = 300, record=None,
+                 bucket: str = 'wis2box-incoming'):
+        """
+        :param timeout: `float` of seconds after which an object without
+                        data notification is counted as lost
+        :param record: writable text file receiving one JSON line per
+                       traced object, or None
+        :param bucket: `str` of incoming bucket whose objects are traced
+        """
+
+        self.timeout = timeout
+        self.bucket = bucket
+        self.record = record
+        self.pending = {}
+        self.samples = {stage: [] for stage in STAGES}
+        self.stored = 0
+        self.published = 0
+        self.unmatched = 0
+        self.lost = 0
+        self.first = None
+        self.last = None
+
+    def storage(self, payload: bytes, received: float) -> None:
+        """
+        Start tracing the objects of a MinIO bucket notification
+
+        Records of other buckets, such as the public bucket wis2box
+        publishes into, are ignored so they do not restart a trace.
+
+        :param payload: `bytes` of JSON event
+        :param received: `float` of Unix time the event arrived
+
+        :returns: None
+        """
+
+        for record in json.loads(payload).get('Records', []):
+            if record['s3'].get('bucket', {}).get('name') != self.bucket:
+                continue
+            key = record['s3']['object']['key']
+            uploaded = received
+            if record.get('eventTime'):
+                uploaded = event_time(record['eventTime'])
+            self.pending[correlation_key(key)] = {
+                'key': key,
+                'uploaded': uploaded,
+                'stored': received
+            }
+            self.stored += 1
+            if self.first is None:
+                self.first = uploaded
+
+    def data(self, payload: bytes, received: float) -> None:
+        """
+        Complete the trace of the object of a WIS2 data notification
+
+        :param payload: `bytes` of JSON notification
+        :param received: `float` of Unix time the notification arrived
+
+        :returns: None
+        """
+
+        message = json.loads(payload)
+        names = [message.get('properties', {}).get('data_id', '')]
+        names.extend(link.get('href', '') for link in message.get('links', []))  # noqa
+
+        trace = None
+        for name in filter(None, names):
+            trace = self.pending.pop(correlation_key(name), None)
+            if trace:
+                break
+
+        if trace is None:
+            self.unmatched += 1
+            return
+
+        latencies = {
+            'storage': trace['stored'] - trace['uploaded'],
+            'publish': received - trace['stored'],
+            'total': received - trace['uploaded']
+        }
+        for stage, seconds in latencies.items():
+            self.samples[stage].append(seconds)
+        self.published += 1
+        self.last = received
+
+        if self.record:
+            self.record.write(json.dumps({
+                'key': trace['key'],
+                'uploaded': trace['uploaded'],
+                **latencies
+            }) + '\n')
+
+    def expire(self, now: float) -> int:
+        """
+        Give up on objects waiting longer than the timeout
+
+        :param now: `float` of current Unix time
+
+        :returns: `int` of objects counted as lost
+        """
+
+        expired = [key for key, trace in self.pending.items()
+                   if now - trace['stored'] > self.timeout]
+        for key in expired:
+            LOGGER.warning(f"No data notification for {self.pending.pop(key)['key']}")  # noqa
+        self.lost += len(expired)
+
+        return len(expired)
+
+    def report(self) -> dict:
+        """
+        Summarise the stage latencies and throughput
+
+        :returns: `dict` of counts, per stage latency percentiles in
+                  milliseconds and published objects per second
+        """
+
+        elapsed = (self.last - self.first) if self.published else 0
+
+        return {
+            'stored': self.stored,
+            'published': self.published,
+            'pending': len(self.pending),
+            'lost': self.lost,
+            'unmatched': self.unmatched,
+            'elapsed': elapsed,
+            'objects_per_second': self.published / elapsed if elapsed else 0,
+            'stages': {stage: latency_stats(self.samples[stage], PERCENTILES)
+                       for stage in STAGES}
+        }
+
+
+class AsyncSubscriber:
+    """paho-mqtt subscriber driven by the asyncio event loop"""
+
+    def __init__(self, config: dict, topics: list,
+                 client_id: str = 'aodn-pipeline-tracer'):
+        """
+        :param config: `dict` from `backpressure.load_broker_config`
+        :param topics: `list` of topic filters to subscribe to
+        :param client_id: `str` of MQTT client identifier
+        """
+
+        self.config = config
+        self.topics = topics
+        self.messages = asyncio.Queue()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=client_id)
+        if config.get('username'):
+            self.client.username_pw_set(config['username'],
+                                        config.get('password'))
+        self._misc = None
+
+    async def connect(self, timeout: float = 10) -> None:
+        """
+        Connect and wait until every subscription is acknowledged
+
+        :param timeout: `float` of seconds to wait for the broker
+
+        :returns: None
+        """
+
+        loop = asyncio.get_running_loop()
+        connected = loop.create_future()
+        subscribed = loop.create_future()
+        acknowledged = []
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if reason_code.is_failure:
+                connected.set_exception(ConnectionError(str(reason_code)))
+            else:
+                connected.set_result(True)
+
+        def on_subscribe(client, userdata, mid, reason_codes, properties):
+            acknowledged.append(mid)
+            if len(acknowledged) == len(self.topics):
+                subscribed.set_result(True)
+
+        def on_message(client, userdata, message):
+            self.messages.put_nowait((time.time(), message.topic,
+                                      message.payload))
+
+        def on_socket_open(client, userdata, sock):
+            loop.add_reader(sock, client.loop_read)
+            self._misc = loop.create_task(self._housekeeping())
+
+        def on_socket_close(client, userdata, sock):
+            loop.remove_reader(sock)
+            if self._misc:
+                self._misc.cancel()
+
+        def on_socket_register_write(client, userdata, sock):
+            loop.add_writer(sock, client.loop_write)
+
+        def on_socket_unregister_write(client, userdata, sock):
+            loop.remove_writer(sock)
+
+        self.client.on_connect = on_connect
+        self.client.on_subscribe = on_subscribe
+        self.client.on_message = on_message
+        self.client.on_socket_open = on_socket_open
+        self.client.on_socket_close = on_socket_close
+        self.client.on_socket_register_write = on_socket_register_write
+        self.client.on_socket_unregister_write = on_socket_unregister_write
+
+        self.client.connect(self.config['host'], self.config['port'])
+        await asyncio.wait_for(connected, timeout)
+        for topic in self.topics:
+            self.client.subscribe(topic, qos=1)
+        await asyncio.wait_for(subscribed, timeout)
+
+    async def _housekeeping(self) -> None:
+        # keep-alive pings and retries of unacknowledged packets
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def get(self, timeout: float) -> tuple:
+        """
+        Wait for the next message
+
+        :param timeout: `float` of seconds to wait
+
+        :returns: `tuple` of (receive time, topic, payload), or None
+        """
+
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.client.disconnect()
+
+
+async def trace(config: dict, tracer: LatencyTracer, duration: float = None,
+                count: int = None, storage_topic: str = STORAGE_TOPIC,
+                data_topic: str = DATA_TOPIC, on_ready=None,
+                progress: float = 10) -> dict:
+    """
+    Trace notifications until a duration elapsed or objects were published
+
+    :param config: `dict` from `backpressure.load_broker_config`
+    :param tracer: `LatencyTracer` correlating the notifications
+    :param duration: `float` of seconds to trace, or None
+    :param count: `int` of published objects to stop after, or None
+    :param storage_topic: `str` of MinIO bucket notification topic
+    :param data_topic: `str` of WIS2 data notification topic filter
+    :param on_ready: coroutine function started once subscribed, e.g. to
+                     upload objects, or None
+    :param progress: `float` of seconds between progress log lines
+
+    :returns: `dict` from `LatencyTracer.report`
+    """
+
+    subscriber = AsyncSubscriber(config, [storage_topic, data_topic])
+    await subscriber.connect()
+    LOGGER.info(f"Tracing {storage_topic} and {data_topic} on {config['host']}:{config['port']}")  # noqa
+
+    task = asyncio.create_task(on_ready()) if on_ready else None
+    start = logged = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            if duration and now - start >= duration:
+                break
+            if count and tracer.published + tracer.lost >= count:
+                break
+
+            message = await subscriber.get(1)
+            if message:
+                received, topic, payload = message
+                try:
+                    if topic == storage_topic:
+                        tracer.storage(payload, received)
+                    else:
+                        tracer.data(payload, received)
+                except (ValueError, KeyError) as err:
+                    LOGGER.warning(f'Ignoring malformed message on {topic}: {err}')  # noqa
+
+            tracer.expire(time.time())
+            if now - logged >= progress:
+                logged = now
+                LOGGER.info(f'{tracer.published} published, {len(tracer.pending)} pending, {tracer.lost} lost')  # noqa
+    finally:
+        subscriber.close()
+        if task:
+            await task
+
+    return tracer.report()
+
+
+def standin_uploads(storage_config: dict, objects: int, size: int,
+                    concurrency: int = 8):
+    """
+    Build an `on_ready` coroutine uploading generated BUFR-named objects
+
+    :param storage_config: `dict` of S3 stand-in storage settings
+    :param objects: `int` of objects to upload
+    :param size: `int` of object size in bytes
+    :param concurrency: `int` of concurrent uploads
+
+    :returns: coroutine function
+    """
+
+    from aodn_pipeline.upload import BulkUploader
+
+    def upload():
+        payload = os.urandom(size)
+        base = time.time()
+        with BulkUploader(storage_config, concurrency) as uploader:
+            uploader.upload_many(
+                (f"{WAVE_BUOY_TOPIC}/WIGOS_0-22000-0-7811080_{datetime.fromtimestamp(base + 60 * n, timezone.utc):%Y%m%dT%H%M%S}.bufr4", payload)  # noqa
+                for n in range(objects))
+
+    async def on_ready():
+        await asyncio.get_running_loop().run_in_executor(None, upload)
+
+    return on_ready
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='trace the publish latency of objects through wis2box')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with broker settings')
+    parser.add_argument('--broker',
+                        help='broker URL (default: WIS2BOX_BROKER_HOST and WIS2BOX_BROKER_PORT)')  # noqa
+    parser.add_argument('--storage-topic', default=STORAGE_TOPIC,
+                        help='MinIO bucket notification topic')
+    parser.add_argument('--data-topic', default=DATA_TOPIC,
+                        help='WIS2 data notification topic filter')
+    parser.add_argument('--duration', type=float,
+                        help='seconds to trace (default: until interrupted)')
+    parser.add_argument('--count', type=int,
+                        help='stop after this many objects were published')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds after which an object without data notification is lost')  # noqa
+    parser.add_argument('--record', type=Path,
+                        help='append one JSON line per traced object to this file')  # noqa
+    parser.add_argument('--standin', action='store_true',
+                        help='trace uploads through in-process S3 and MQTT stand-ins')  # noqa
+    parser.add_argument('--objects', type=int, default=1000,
+                        help='objects uploaded to the stand-ins')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='size of the objects uploaded to the stand-ins')
+    parser.add_argument('--process-rate', type=float, default=500,
+                        help='notifications the stand-in publishes per second')  # noqa
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    s3 = broker = on_ready = None
+    count = args.count
+    if args.standin:
+        from aodn_pipeline.standins import (MQTTStandIn, S3StandIn,
+                                            wis2_notification)
+        broker = MQTTStandIn().start()
+        broker.process(args.process_rate, queue_max=args.objects,
+                       topic=args.storage_topic,
+                       done_topic=args.data_topic.rstrip('/#'),
+                       transform=wis2_notification)
+        s3 = S3StandIn(['wis2box-incoming']).start()
+        s3.on_put.append(broker.notify_storage(args.storage_topic))
+        config = {'host': broker.address[0], 'port': broker.address[1]}
+        on_ready = standin_uploads(
+            {'source': s3.url, 'incoming': 'wis2box-incoming',
+             'username': 'wis2box', 'password': 'wis2box'},
+            args.objects, args.size)
+        count = count or args.objects
+        bucket = 'wis2box-incoming'
+    else:
+        config = load_broker_config(args.env_file, args.broker)
+        bucket = load_storage_config(args.env_file)['incoming']
+
+    record = args.record.open('a') if args.record else None
+    tracer = LatencyTracer(args.timeout, record, bucket)
+    try:
+        report = asyncio.run(trace(config, tracer, args.duration, count,
+                                   args.storage_topic, args.data_topic,
+                                   on_ready))
+    except KeyboardInterrupt:
+        report = tracer.report()
+    finally:
+        if record:
+            record.close()
+        if s3:
+            s3.stop()
+        if broker:
+            broker.stop()
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+
+    print(f"{report['published']} of {report['stored']} objects published in "
+          f"{report['elapsed']:.2f}s ({report['objects_per_second']:.1f} objects/s), "  # noqa
+          f"{report['pending']} pending, {report['lost']} lost, "
+          f"{report['unmatched']} unmatched notifications")
+    for stage, stats in report['stages'].items():
+        if stats['count']:
+            print(f"  {stage:8} " + ' '.join(
+                f"p{p} {stats[f'p{p}_ms']:.1f}ms" for p in PERCENTILES) +
+                f" max {stats['max_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Upload of converted observations into the wis2box-incoming bucket
+
+`BulkUploader` shares one keep-alive HTTP connection pool between a
+bounded number of concurrent PUTs and streams objects from memory.  Large
+objects are split into multipart uploads whose part size keeps the parts in
+flight well inside the 512m mem_limit of the minio service.
+"""
+
+import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+import io
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import threading
+import time
+from urllib.parse import urlparse
+
+from dotenv import dotenv_values
+from minio import Minio
+import urllib3
+
+from aodn_pipeline import WIS2BOX_ENV
+
+LOGGER = logging.getLogger(__name__)
+
+# mem_limit of the minio service in wis2box/docker-compose.yml
+MINIO_MEM_LIMIT = 512 * 1024 * 1024
+
+# share of MINIO_MEM_LIMIT that parts in flight may occupy
+MINIO_MEM_SHARE = 0.25
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_COUNT = 10000
+
+CONTENT_TYPES = {
+    '.csv': 'text/csv',
+    '.bufr4': 'application/x-bufr',
+    '.json': 'application/json',
+    '.geojson': 'application/geo+json'
+}
+
+
+def load_storage_config(env_file: Path = WIS2BOX_ENV,
+                        storage_source: str = None) -> dict:
+    """
+    Read the wis2box storage settings from wis2box.env
+
+    :param env_file: `Path` of wis2box.env
+    :param storage_source: `str` of storage URL overriding
+                           WIS2BOX_STORAGE_SOURCE, which usually points at
+                           the in-compose hostname http://minio:9000
+
+    :returns: `dict` of storage settings
+    """
+
+    env = dotenv_values(env_file)
+    source = storage_source or env.get('WIS2BOX_STORAGE_SOURCE', 'http://localhost:9000')  # noqa
+
+    return {
+        'source': source,
+        'incoming': env.get('WIS2BOX_STORAGE_INCOMING', 'wis2box-incoming'),
+        'username': env.get('WIS2BOX_STORAGE_USERNAME'),
+        'password': env.get('WIS2BOX_STORAGE_PASSWORD')
+    }
+
+
+class CountingRetry(urllib3.Retry):
+    """`urllib3.Retry` calling back on every retried request"""
+
+    def __init__(self, *args, on_retry=None, **kwargs):
+        """
+        :param on_retry: callable without arguments run before each retry
+        """
+
+        super().__init__(*args, **kwargs)
+        self.on_retry = on_retry
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.on_retry = self.on_retry
+        return retry
+
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)
+        if self.on_retry:
+            self.on_retry()
+        return retry
+
+
+def connection_pool(maxsize: int = 10, timeout: float = 30,
+                    retries: int = 3,
+                    on_retry=None) -> urllib3.PoolManager:
+    """
+    Create a keep-alive HTTP connection pool for the storage client
+
+    :param maxsize: `int` of connections kept open per host
+    :param timeout: `float` of connect and read timeout in seconds
+    :param retries: `int` of retries of failed requests
+    :param on_retry: callable without arguments run before each retry
+
+    :returns: `urllib3.PoolManager`
+    """
+
+    return urllib3.PoolManager(
+        maxsize=maxsize,
+        block=True,
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        retries=CountingRetry(total=retries, backoff_factor=0.2,
+                              status_forcelist=[500, 502, 503, 504],
+                              on_retry=on_retry))
+
+
+def storage_client(config: dict, **kwargs) -> Minio:
+    """
+    Create a MinIO client for the wis2box storage
+
+    :param config: `dict` from `load_storage_config`
+    :param kwargs: extra keyword arguments passed to `minio.Minio`
+
+    :returns: `minio.Minio` client
+    """
+
+    url = urlparse(config['source'])
+
+    return Minio(url.netloc, access_key=config['username'],
+                 secret_key=config['password'],
+                 secure=url.scheme == 'https', **kwargs)
+
+
+def content_type(key: str) -> str:
+    """
+    Choose the content type of an object from its extension
+
+    :param key: `str` of object key
+
+    :returns: `str` of content type
+    """
+
+    return CONTENT_TYPES.get(os.path.splitext(key)[1], 'application/octet-stream')  # noqa
+
+
+def part_size(length: int, concurrency: int,
+              mem_limit: int = MINIO_MEM_LIMIT) -> int:
+    """
+    Size multipart upload parts so that the parts of all concurrent uploads
+    fit in a share of the minio memory limit
+
+    :param length: `int` of object size in bytes
+    :param concurrency: `int` of concurrent uploads
+    :param mem_limit: `int` of minio memory limit in bytes
+
+    :returns: `int` of part size in bytes
+    """
+
+    budget = int(mem_limit * MINIO_MEM_SHARE) // max(concurrency, 1)
+    smallest = math.ceil(length / MAX_PART_COUNT)
+
+    return max(MIN_PART_SIZE, smallest, min(budget, length))
+
+
+class BulkUploader:
+    """Concurrent in-memory uploads over a shared connection pool"""
+
+    def __init__(self, config: dict, concurrency: int = 8,
+                 mem_limit: int = MINIO_MEM_LIMIT, client: Minio = None,
+                 throttle=None):
+        """
+        :param config: `dict` from `load_storage_config`
+        :param concurrency: `int` of concurrent PUT requests
+        :param mem_limit: `int` of minio memory limit in bytes
+        :param client: `minio.Minio` client (default: created from config)
+        :param throttle: `backpressure.AIMDThrottle` pacing the uploads to
+                         what wis2box keeps up with, or None
+        """
+
+        self.bucket = config['incoming']
+        self.concurrency = concurrency
+        self.mem_limit = mem_limit
+        self.throttle = throttle
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix='upload')
+        # bound queued objects so producers cannot buffer unlimited data
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._lock = threading.Lock()
+        self.objects = 0
+        self.bytes = 0
+        self.errors = 0
+        self.retries = 0
+
+        self.client = client or storage_client(
+            config, http_client=connection_pool(maxsize=concurrency,
+                                                on_retry=self._retried))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _retried(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def upload(self, key: str, data: bytes) -> None:
+        """
+        Upload an object and wait for it to be stored
+
+        :param key: `str` of object key
+        :param data: `bytes` of object content
+
+        :returns: None
+        """
+
+        if self.throttle:
+            self.throttle.acquire()
+
+        try:
+            self.client.put_object(
+                self.bucket, key, io.BytesIO(data), len(data),
+                content_type=content_type(key),
+                part_size=part_size(len(data), self.concurrency,
+                                    self.mem_limit),
+                num_parallel_uploads=1)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+        with self._lock:
+            self.objects += 1
+            self.bytes += len(data)
+        if self.throttle:
+            self.throttle.sent(key)
+        LOGGER.debug(f'Uploaded {len(data)} bytes to {self.bucket}/{key}')
+
+    def submit(self, key: str, data: bytes) -> Future:
+        """
+        Queue an object for upload, blocking while the queue is full
+
+        :param key: `str` of object key
+        :param data: `bytes` of object content
+
+        :returns: `concurrent.futures.Future` of the upload
+        """
+
+        self._slots.acquire()
+        future = self._executor.submit(self.upload, key, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def upload_many(self, objects) -> list:
+        """
+        Upload (key, data) pairs concurrently
+
+        :param objects: iterable of (key, data) tuples
+
+        :returns: `list` of (key, exception) for failed uploads
+        """
+
+        futures = [(key, self.submit(key, data)) for key, data in objects]
+
+        return [(key, future.exception()) for key, future in futures
+                if future.exception() is not None]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def benchmark(uploader: BulkUploader, objects: int, size: int,
+              prefix: str = 'benchmark') -> dict:
+    """
+    Measure upload throughput of generated in-memory objects
+
+    :param uploader: `BulkUploader` to measure
+    :param objects: `int` of objects to upload
+    :param size: `int` of object size in bytes
+    :param prefix: `str` of key prefix of the objects
+
+    :returns: `dict` of throughput statistics
+    """
+
+    payload = os.urandom(size)
+    start = time.perf_counter()
+    failures = uploader.upload_many(
+        (f'{prefix}/object-{n:06d}.bufr4', payload) for n in range(objects))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'objects': objects,
+        'size': size,
+        'concurrency': uploader.concurrency,
+        'failures': len(failures),
+        'elapsed': elapsed,
+        'objects_per_second': objects / elapsed,
+        'mb_per_second': objects * size / elapsed / 1024 / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark bulk uploads into wis2box-incoming')
+    parser.add_argument('--objects', type=int, default=1000,
+                        help='number of objects to upload')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='object size in bytes')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent PUT requests')
+    parser.add_argument('--env-file', type=Path, default=WIS2BOX_ENV,
+                        help='wis2box.env with storage settings')
+    parser.add_argument('--storage-source',
+                        help='storage URL (default: WIS2BOX_STORAGE_SOURCE)')
+    parser.add_argument('--standin', action='store_true',
+                        help='upload to an in-process S3 stand-in')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+
+    standin = None
+    if args.standin:
+        from aodn_pipeline.standins import S3StandIn
+        standin = S3StandIn(['wis2box-incoming']).start()
+        config = {'source': standin.url, 'incoming': 'wis2box-incoming',
+                  'username': 'wis2box', 'password': 'wis2box'}
+    else:
+        config = load_storage_config(args.env_file, args.storage_source)
+
+    try:
+        with BulkUploader(config, args.concurrency) as uploader:
+            results = benchmark(uploader, args.objects, args.size)
+    finally:
+        if standin:
+            standin.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print(f"{results['objects']} objects of {results['size']} bytes "
+              f"with {results['concurrency']} concurrent PUTs in "
+              f"{results['elapsed']:.2f}s: {results['objects_per_second']:.0f} "  # noqa
+              f"objects/s, {results['mb_per_second']:.2f} MB/s, "
+              f"{results['failures']} failures")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Round-trip verification of produced BUFR messages against the source
+NetCDF
+
+Messages are decoded in parallel with pybufrkit and every templated
+element is compared with the value derived from the NetCDF, within the
+precision of its BUFR descriptor.  A whole backfill batch can be checked
+in seconds before it is published.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+import eccodes
+import numpy as np
+import pandas as pd
+from pybufrkit.dataquery import DataQuerent, NodePathParser
+from pybufrkit.decoder import Decoder
+
+from aodn_pipeline import STATION_LIST, WAVE_BUOY_TEMPLATE
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import convert_file, load_template
+
+LOGGER = logging.getLogger(__name__)
+
+# template elements identifying the observation of a subset
+KEY_ELEMENTS = ('buoyOrPlatformIdentifier', 'year', 'month', 'day', 'hour',
+                'minute')
+
+# per-process decoder state set up once by init_worker
+_WORKER = {}
+
+
+def element_name(key: str) -> str:
+    """
+    Strip the occurrence prefix of an ecCodes key, "#1#year" -> "year"
+
+    :param key: `str` of ecCodes key
+
+    :returns: `str` of element name
+    """
+
+    return re.sub(r'^#\d+#', '', key)
+
+
+def element_occurrence(key: str) -> int:
+    """
+    Zero-based occurrence of an ecCodes key, "#2#year" -> 1
+
+    :param key: `str` of ecCodes key
+
+    :returns: `int` of occurrence index
+    """
+
+    match = re.match(r'^#(\d+)#', key)
+    return int(match.group(1)) - 1 if match else 0
+
+
+def descriptor_table(encoder: BufrEncoder) -> list:
+    """
+    Look up the BUFR descriptor and scale of each templated data element
+
+    :param encoder: `BufrEncoder` of the mapping template
+
+    :returns: `list` of `dict` with key, descriptor, occurrence, the
+              largest encodable scaled value and tolerance (half the
+              descriptor precision)
+    """
+
+    handle = eccodes.codes_new_from_message(encoder.base_message())
+    try:
+        eccodes.codes_set(handle, 'unpack', True)
+        table = []
+        for element in encoder.data:
+            key = element['key']
+            scale = eccodes.codes_get(handle, f'{key}->scale')
+            reference = eccodes.codes_get(handle, f'{key}->reference')
+            width = eccodes.codes_get(handle, f'{key}->width')
+            table.append({
+                'key': key,
+                'descriptor': eccodes.codes_get(handle, f'{key}->code'),
+                'occurrence': element_occurrence(key),
+                'scale': scale,
+                'reference': reference,
+                # all bits set is reserved for missing
+                'maximum': reference + 2 ** width - 2,
+                'tolerance': 0.5 * 10.0 ** -scale + 1e-9
+            })
+    finally:
+        eccodes.codes_release(handle)
+
+    return table
+
+
+def init_worker(table: list) -> None:
+    _WORKER['table'] = table
+    _WORKER['decoder'] = Decoder()
+    _WORKER['querent'] = DataQuerent(NodePathParser())
+
+
+def decode_file(path: Path) -> dict:
+    """
+    Decode the templated elements of every subset of a BUFR file
+
+    :param path: `Path` of BUFR4 file
+
+    :returns: `dict` with `path`, `subsets` (list of value lists in
+              descriptor table order, missing as None) and `error`
+    """
+
+    result = {'path': str(path), 'subsets': [], 'error': None}
+    try:
+        message = _WORKER['decoder'].process(Path(path).read_bytes())
+        columns = []
+        for element in _WORKER['table']:
+            values = _WORKER['querent'].query(
+                message, element['descriptor']).all_values(flat=True)
+            occurrence = element['occurrence']
+            columns.append([v[occurrence] if len(v) > occurrence else None
+                            for v in values])
+        result['subsets'] = [list(row) for row in zip(*columns)]
+    except Exception as err:
+        result['error'] = f'{type(err).__name__}: {err}'
+
+    return result
+
+
+def expected_values(frames: list, encoder: BufrEncoder,
+                    table: list) -> dict:
+    """
+    Compute the expected element values of every source observation
+
+    :param frames: `list` of `pandas.DataFrame` of csv2bufr input columns
+    :param encoder: `BufrEncoder` of the mapping template
+    :param table: `list` from `descriptor_table`
+
+    :returns: `dict` of observation key tuple to `list` of expected values
+              in descriptor table order, missing as NaN
+    """
+
+    frame = pd.concat(frames, ignore_index=True)
+    elements = {e['key']: e for e in encoder.data}
+    columns = []
+    for item in table:
+        values = encoder.element_values(elements[item['key']], frame)
+        # values outside the descriptor's data width are encoded as missing
+        scaled = np.round(values * 10.0 ** item['scale'])
+        with np.errstate(invalid='ignore'):
+            values = np.where((scaled < item['reference']) |
+                              (scaled > item['maximum']), np.nan, values)
+        columns.append(values)
+
+    keys = zip(*(frame[name].astype(int) for name in KEY_ELEMENTS))
+    values = np.column_stack(columns)
+
+    return dict(zip(keys, values.tolist()))
+
+
+def compare(decoded: list, expected: dict, table: list) -> tuple:
+    """
+    Compare decoded subsets with the expected values
+
+    :param decoded: `list` of results of `decode_file`
+    :param expected: `dict` from `expected_values`
+    :param table: `list` from `descriptor_table`
+
+    :returns: `tuple` of (mismatches, unmatched, errors) lists
+    """
+
+    names = [element_name(t['key']) for t in table]
+    key_index = [names.index(name) for name in KEY_ELEMENTS]
+    tolerances = [t['tolerance'] for t in table]
+
+    mismatches, unmatched, errors = [], [], []
+    for result in decoded:
+        if result['error']:
+            errors.append({'path': result['path'], 'error': result['error']})
+            continue
+
+        for number, subset in enumerate(result['subsets'], start=1):
+            key = tuple(subset[i] for i in key_index)
+            if key not in expected:
+                unmatched.append({'path': result['path'], 'subset': number})
+                continue
+
+            for name, actual, wanted, tolerance in zip(
+                    names, subset, expected[key], tolerances):
+                missing = np.isnan(wanted)
+                if actual is None and missing:
+                    continue
+                if actual is None or missing or abs(actual - wanted) > tolerance:  # noqa
+                    mismatches.append({
+                        'path': result['path'],
+                        'subset': number,
+                        'element': name,
+                        'expected': None if missing else wanted,
+                        'actual': actual
+                    })
+
+    return mismatches, unmatched, errors
+
+
+def find_bufr_files(paths: list) -> list:
+    """
+    Expand files and directories into a sorted list of BUFR files
+
+    :param paths: `list` of `Path` of files or directories
+
+    :returns: `list` of `Path` of .bufr4 files
+    """
+
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(path.rglob('*.bufr4'))
+        else:
+            files.append(path)
+
+    return sorted(files)
+
+
+def verify(bufr_files: list, frames: list, template: dict,
+           workers: int = None) -> dict:
+    """
+    Decode BUFR files in parallel and compare them with source observations
+
+    :param bufr_files: `list` of `Path` of BUFR4 files
+    :param frames: `list` of `pandas.DataFrame` of csv2bufr input columns
+    :param template: `dict` of csv2bufr mapping template
+    :param workers: `int` of decoder processes (default: CPU count)
+
+    :returns: `dict` of verification results and decode throughput
+    """
+
+    encoder = BufrEncoder(template)
+    table = descriptor_table(encoder)
+    expected = expected_values(frames, encoder, table)
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(bufr_files) // (workers * 4))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(table,)) as executor:
+        decoded = list(executor.map(decode_file, bufr_files,
+                                    chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    mismatches, unmatched, errors = compare(decoded, expected, table)
+    subsets = sum(len(r['subsets']) for r in decoded)
+
+    return {
+        'messages': len(bufr_files),
+        'subsets': subsets,
+        'workers': workers,
+        'elapsed': elapsed,
+        'messages_per_second': len(bufr_files) / elapsed if elapsed else 0,
+        'subsets_per_second': subsets / elapsed if elapsed else 0,
+        'mismatches': mismatches,
+        'unmatched': unmatched,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='verify produced BUFR messages against the source NetCDF')
+    parser.add_argument('bufr', type=Path, nargs='+',
+                        help='BUFR4 files or directories holding them')
+    parser.add_argument('--source', type=Path, nargs='+', required=True,
+                        help='IMOS wave parameters NetCDF files')
+    parser.add_argument('--template', type=Path, default=WAVE_BUOY_TEMPLATE,
+                        help='csv2bufr mapping template')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='wis2box station list')
+    parser.add_argument('--wigos-id', dest='wigos_station_identifiers',
+                        nargs='+', default=[],
+                        help='WIGOS station identifier of each source, in order (default: match site_name)')  # noqa
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of decoder processes')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.wigos_station_identifiers and \
+            len(args.wigos_station_identifiers) != len(args.source):
+        parser.error('--wigos-id needs one identifier per --source file')
+    identifiers = args.wigos_station_identifiers or [None] * len(args.source)
+
+    template = load_template(args.template)
+    frames = []
+    for nc_file, wsi in zip(args.source, identifiers):
+        frames.append(convert_file(nc_file, template, wsi, args.station_list))
+
+    results = verify(find_bufr_files(args.bufr), frames, template,
+                     args.workers)
+
+    if args.json:
+        print(json.dumps(results, indent=4, default=str))
+    else:
+        print(f"Decoded {results['messages']} messages ({results['subsets']} "
+              f"subsets) in {results['elapsed']:.2f}s with {results['workers']} "  # noqa
+              f"workers: {results['messages_per_second']:.0f} msgs/s, "
+              f"{results['subsets_per_second']:.0f} subsets/s")
+        for error in results['errors']:
+            print(f"  ERROR {error['path']}: {error['error']}")
+        for item in results['unmatched']:
+            print(f"  UNMATCHED {item['path']} subset {item['subset']}")
+        for item in results['mismatches']:
+            print(f"  MISMATCH {item['path']} subset {item['subset']} "
+                  f"{item['element']}: expected {item['expected']}, "
+                  f"got {item['actual']}")
+        print(f"{len(results['mismatches'])} mismatches, "
+              f"{len(results['unmatched'])} unmatched subsets, "
+              f"{len(results['errors'])} decode errors")
+
+    if results['mismatches'] or results['unmatched'] or results['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
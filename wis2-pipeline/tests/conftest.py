@@ -0,0 +1,55 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+from pathlib import Path
+
+import pytest
+
+from aodn_pipeline.standins import MQTTStandIn, S3StandIn
+
+INCOMING = 'wis2box-incoming'
+
+# sample IMOS NetCDF and BUFR files of the notebooks
+SAMPLE_DATA = Path(__file__).resolve().parents[2] / 'resources' / 'wis2-notebooks' / 'data'  # noqa
+
+
+@pytest.fixture
+def s3():
+    """S3 stand-in with the incoming bucket"""
+
+    with S3StandIn([INCOMING]) as standin:
+        yield standin
+
+
+@pytest.fixture
+def storage_config(s3):
+    """Storage settings of the S3 stand-in, as from load_storage_config"""
+
+    return {'source': s3.url, 'incoming': INCOMING,
+            'username': 'wis2box', 'password': 'wis2box'}
+
+
+@pytest.fixture
+def broker():
+    """MQTT stand-in, without notification processing until configured"""
+
+    with MQTTStandIn() as standin:
+        yield standin
@@ -0,0 +1,106 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import pytest
+
+from aodn_pipeline.backfill import (Checkpoints, month_range, run,
+                                    work_units)
+from aodn_pipeline.stations import load_national_sites
+
+from conftest import SAMPLE_DATA
+
+# the sample file holds August 2025 of Apollo Bay
+MONTHS = month_range('2025-07', '2025-09')
+
+
+@pytest.fixture
+def station():
+    return next(s for s in load_national_sites()
+                if s['site_name'] == 'APOLLO-BAY')
+
+
+@pytest.fixture
+def backfill(tmp_path):
+    """Run units into a local directory, checkpointed below tmp_path"""
+
+    checkpoints = Checkpoints(tmp_path / 'backfill.sqlite3')
+
+    def backfill(units):
+        return run(units, SAMPLE_DATA, checkpoints, workers=1, rate=0,
+                   output_dir=tmp_path / 'out', output_format='csv',
+                   dedup_path=tmp_path / 'dedup.sqlite3', quiet=True)
+
+    yield backfill, checkpoints
+    checkpoints.close()
+
+
+def objects(tmp_path) -> list:
+    return sorted((tmp_path / 'out').rglob('*.csv'))
+
+
+def test_resume_skips_checkpointed_units(tmp_path, station, backfill):
+    backfill, checkpoints = backfill
+    units = work_units([station], MONTHS)
+
+    # interrupted after the first two months
+    first = backfill(units[:2])
+    assert [r['status'] for r in sorted(first, key=lambda r: r['month'])] \
+        == ['empty', 'ok']
+    sent = objects(tmp_path)
+    assert sent
+
+    remaining = work_units([station], MONTHS, checkpoints.done())
+    assert [month for _, month in remaining] == ['2025-09']
+    backfill(remaining)
+
+    assert objects(tmp_path) == sent
+    assert work_units([station], MONTHS, checkpoints.done()) == []
+    observations = sum(row['observations'] for row in checkpoints.status())
+    assert observations == first[0]['observations'] + first[1]['observations']  # noqa
+
+
+def test_failed_units_are_redone(tmp_path, station, backfill):
+    backfill, checkpoints = backfill
+    checkpoints.record({
+        'wigos_station_identifier': station['wigos_station_identifier'],
+        'month': '2025-08', 'status': 'failed', 'observations': 0,
+        'duplicates': 0, 'objects': 0, 'seconds': 0, 'error': 'killed'
+    })
+
+    remaining = work_units([station], MONTHS, checkpoints.done())
+
+    assert [month for _, month in remaining] == MONTHS
+
+
+def test_redone_units_skip_sent_observations(tmp_path, station, backfill):
+    backfill, checkpoints = backfill
+    units = work_units([station], ['2025-08'])
+    [sent] = backfill(units)
+
+    assert checkpoints.reset([(station['wigos_station_identifier'],
+                               '2025-08')]) == 1
+    [redone] = backfill(work_units([station], ['2025-08'],
+                                   checkpoints.done()))
+
+    assert sent['observations'] > 0
+    assert redone['status'] == 'ok'
+    assert redone['observations'] == 0
+    assert redone['duplicates'] == sent['observations']
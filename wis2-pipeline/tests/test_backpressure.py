@@ -0,0 +1,126 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import time
+
+import pytest
+
+from aodn_pipeline import backpressure
+from aodn_pipeline.backpressure import AIMDThrottle, BrokerMonitor, drain
+from aodn_pipeline.standins import minio_event, wis2_notification
+from aodn_pipeline.upload import BulkUploader
+
+from conftest import INCOMING
+
+DONE = 'origin/a/wis2/au-imos/data'
+
+
+def key(n: int) -> str:
+    return f'wave-buoys/WIGOS_0-22000-0-7811080_20240101T{n:06d}.bufr4'
+
+
+def notification(object_key: str) -> bytes:
+    return wis2_notification(minio_event(INCOMING, object_key, 1))
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def monitor(broker):
+    monitor = BrokerMonitor({'host': broker.address[0],
+                             'port': broker.address[1]})
+    yield monitor
+    monitor.close()
+
+
+def test_only_notifications_of_sent_objects_count(broker, monitor):
+    monitor.record_sent(key(1))
+    monitor.record_sent(key(2))
+
+    broker.publish(DONE, notification(key(99)), 1)
+    broker.publish(DONE, notification(key(1)), 1)
+    wait_for(lambda: monitor.processed == 1)
+
+    assert monitor.depth() == 1
+    broker.publish(DONE, notification(key(2)), 1)
+    wait_for(lambda: monitor.depth() == 0)
+    assert monitor.processed == 2
+
+
+def test_notification_before_recorded_upload(broker, monitor):
+    broker.publish(DONE, notification(key(1)), 1)
+    wait_for(lambda: monitor._credit)
+
+    monitor.record_sent(key(1))
+
+    assert monitor.depth() == 0
+    assert monitor.processed == 1
+
+
+def test_unmatched_notifications_are_bounded(broker, monitor, monkeypatch):
+    monkeypatch.setattr(backpressure, 'EARLY_MAX', 10)
+    monitor.record_sent(key(999))
+
+    for n in range(100):
+        broker.publish(DONE, notification(key(n)), 1)
+    # delivered in order, so the last one marks the end of the others
+    broker.publish(DONE, notification(key(999)), 1)
+    wait_for(lambda: monitor.processed == 1)
+
+    assert len(monitor._credit) == 10
+    assert monitor.depth() == 0
+
+
+def test_expired_objects_count_as_lost(monitor):
+    monitor.record_sent(key(1))
+
+    assert monitor.expire(0) == 1
+    assert monitor.lost == 1
+    assert monitor.depth() == 0
+
+
+def test_throttle_keeps_the_queue_from_overflowing(s3, storage_config,
+                                                   broker):
+    queue_max = 100
+    # the throttle reacts to the reported depth, so leave it some headroom
+    broker.process(200, 2 * queue_max, transform=wis2_notification)
+    s3.on_put.append(broker.notify_storage())
+    monitor = BrokerMonitor({'host': broker.address[0],
+                             'port': broker.address[1]})
+    throttle = AIMDThrottle(monitor, queue_max, rate=50)
+
+    try:
+        with BulkUploader(storage_config, 8, throttle=throttle) as uploader:
+            failures = uploader.upload_many(
+                (key(n), b'BUFR') for n in range(600))
+        drained = drain(monitor, 10)
+    finally:
+        throttle.close()
+
+    assert failures == []
+    assert drained
+    assert broker.dropped == 0
+    assert monitor.processed == 600
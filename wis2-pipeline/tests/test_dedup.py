@@ -0,0 +1,145 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aodn_pipeline.convert import (convert_dataset, convert_file,
+                                   load_station, load_template)
+from aodn_pipeline.dedup import FingerprintCache, fingerprints, hit_ratio
+from aodn_pipeline.ingest import ingest_dataset, storage_sink
+from aodn_pipeline.reader import open_pruned
+from aodn_pipeline.state import StateStore
+
+from conftest import INCOMING, SAMPLE_DATA
+
+WSI = '0-22000-0-7811080'
+
+
+@pytest.fixture(scope='module')
+def template():
+    return load_template()
+
+
+@pytest.fixture(scope='module')
+def frame(template):
+    [nc_file] = SAMPLE_DATA.glob('*.nc')
+    return convert_file(nc_file, template)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with FingerprintCache(tmp_path / 'dedup.sqlite3') as store:
+        yield store
+
+
+def test_fingerprints_do_not_depend_on_chunks(template, frame):
+    [nc_file] = SAMPLE_DATA.glob('*.nc')
+    station = load_station(wigos_station_identifier=WSI)
+
+    with open_pruned(nc_file, template) as ds:
+        chunks = [convert_dataset(ds.isel(TIME=slice(start, start + 100)).load(),  # noqa
+                                  station, template)
+                  for start in range(0, ds.sizes['TIME'], 100)]
+
+    assert np.array_equal(np.concatenate([fingerprints(c) for c in chunks]),
+                          fingerprints(frame))
+
+
+def test_fingerprints_ignore_column_order_and_float_noise(frame):
+    rows = frame.iloc[:10]
+    noisy = rows.assign(WSSH=rows['WSSH'] + 1e-9)[rows.columns[::-1]]
+
+    assert np.array_equal(fingerprints(noisy), fingerprints(rows))
+    assert not np.array_equal(
+        fingerprints(rows.assign(WSSH=rows['WSSH'] + 0.001)),
+        fingerprints(rows))
+
+
+def test_fingerprints_fold_signed_zero_and_missing_values():
+    first = pd.DataFrame({'value': [0.0, np.nan], 'name': ['a', 'b']})
+    second = pd.DataFrame({'value': [-0.0, np.nan], 'name': ['a', 'b']})
+
+    assert np.array_equal(fingerprints(first), fingerprints(second))
+
+
+def test_lookups_hit_the_lru_then_the_store(tmp_path, cache, frame):
+    values = fingerprints(frame)
+    cache.add(values, WSI)
+
+    assert cache.seen(values).all()
+    assert cache.lookups() == {'lru_hits': len(values), 'store_hits': 0,
+                               'misses': 0}
+
+    with FingerprintCache(tmp_path / 'dedup.sqlite3', capacity=100) as fresh:
+        assert fresh.seen(values).all()
+        # more values than a lookup chunk, counted per row
+        assert fresh.lookups() == {'lru_hits': 0,
+                                   'store_hits': len(values), 'misses': 0}
+        assert fresh.stats()['lru_size'] == 100
+        assert fresh.stats()['stored'] == len(values)
+
+
+def test_filter_keeps_only_new_rows(cache, frame):
+    cache.add(fingerprints(frame.iloc[:500]), WSI)
+
+    new, values = cache.filter(frame)
+
+    assert len(new) == len(values) == len(frame) - 500
+    assert np.array_equal(values, fingerprints(frame.iloc[500:]))
+    assert cache.lookups()['misses'] == len(frame) - 500
+    assert hit_ratio(cache.lookups()) == pytest.approx(500 / len(frame))
+
+
+def test_forget_a_station(cache, frame):
+    cache.add(fingerprints(frame), WSI)
+    cache.add(fingerprints(frame.iloc[:1].assign(WSSH=99.0)), 'other')
+
+    assert cache.forget(WSI) == len(frame)
+    assert not cache.seen(fingerprints(frame)).any()
+    assert cache.stats()['stored'] == 1
+
+
+def test_hit_ratio_without_lookups():
+    assert hit_ratio({}) == 0.0
+
+
+def test_reset_mark_skips_published_observations(tmp_path, s3,
+                                                 storage_config, cache,
+                                                 template):
+    [nc_file] = SAMPLE_DATA.glob('*.nc')
+    station = load_station(wigos_station_identifier=WSI)
+    sink = storage_sink(storage_config)
+
+    with StateStore(tmp_path / 'state.sqlite3') as state, \
+            open_pruned(nc_file, template) as ds:
+        first = ingest_dataset(ds, station, template, state, sink,
+                               dedup=cache)
+        state.reset(WSI)
+        again = ingest_dataset(ds, station, template, state, sink,
+                               dedup=cache)
+
+    assert first['observations'] == ds.sizes['TIME']
+    assert again['observations'] == again['objects'] == 0
+    assert again['duplicates'] == ds.sizes['TIME']
+    assert again['dedup']['lru_hits'] == ds.sizes['TIME']
+    assert len(s3.buckets[INCOMING]) == first['objects']
@@ -0,0 +1,170 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import re
+
+import eccodes
+import numpy as np
+import pytest
+
+from aodn_pipeline.bufr import BufrEncoder
+from aodn_pipeline.convert import convert_file, load_template
+from aodn_pipeline.es_bulk import (API_INDEX, BulkIndexer, bufr_documents,
+                                   bulk_sink, relaxed_refresh)
+from aodn_pipeline.standins import ElasticsearchStandIn, parse_bulk
+
+from conftest import SAMPLE_DATA
+
+WSI = '0-22000-0-7811080'
+RESULT_TIME = '2025-09-01T00:00:00Z'
+
+
+@pytest.fixture(scope='module')
+def encoder():
+    return BufrEncoder(load_template())
+
+
+@pytest.fixture(scope='module')
+def frame():
+    [nc_file] = SAMPLE_DATA.glob('*APOLLO-BAY*.nc')
+    return convert_file(nc_file, load_template())
+
+
+@pytest.fixture
+def es():
+    with ElasticsearchStandIn([API_INDEX]) as standin:
+        yield standin
+
+
+def uncompressed(encoder: BufrEncoder, frame) -> bytes:
+    """Encode the rows of a frame as an uncompressed BUFR4 message"""
+
+    handle = eccodes.codes_bufr_new_from_samples('BUFR4')
+    try:
+        for key, kind, value in encoder.header:
+            if kind == 'data':
+                value = int(frame[value].iloc[0])
+            if key != 'unexpandedDescriptors':
+                eccodes.codes_set(handle, key, value)
+            else:
+                descriptors = value
+        eccodes.codes_set(handle, 'numberOfSubsets', len(frame))
+        eccodes.codes_set(handle, 'compressedData', 0)
+        eccodes.codes_set_array(handle, 'unexpandedDescriptors',
+                                descriptors)
+        for element in encoder.data:
+            values = encoder.element_values(element, frame)
+            values[np.isnan(values)] = eccodes.CODES_MISSING_DOUBLE
+            rank, name = re.fullmatch(r'#(\d+)#(.+)', element['key']).groups()
+            # uncompressed messages rank occurrences across all subsets
+            per_subset = len(eccodes.codes_get_array(handle, name)) // len(frame)  # noqa
+            for subset, value in enumerate(values):
+                if element.get('type', 'float') == 'int':
+                    value = int(value)
+                eccodes.codes_set(handle, f'#{subset * per_subset + int(rank)}#{name}',  # noqa
+                                  value)
+        eccodes.codes_set(handle, 'pack', 1)
+        return eccodes.codes_get_message(handle)
+    finally:
+        eccodes.codes_release(handle)
+
+
+def test_documents_of_sample_message():
+    [message] = SAMPLE_DATA.glob('*.bufr4')
+
+    documents = bufr_documents(message.read_bytes(), WSI, RESULT_TIME)
+
+    assert documents
+    assert {d['properties']['phenomenonTime'] for d in documents} == \
+        {'2025-08-31T23:20:00Z'}
+    assert len({d['id'] for d in documents}) == len(documents)
+    assert all(d['properties']['resultTime'] == RESULT_TIME
+               for d in documents)
+
+
+def test_uncompressed_subsets_match_compressed(encoder, frame):
+    rows = frame.iloc[:3]
+
+    compressed = bufr_documents(encoder.encode(rows), WSI, RESULT_TIME)
+    documents = bufr_documents(uncompressed(encoder, rows), WSI,
+                               RESULT_TIME)
+
+    assert len({d['properties']['phenomenonTime'] for d in documents}) == 3
+    assert sorted(documents, key=lambda d: d['id']) == \
+        sorted(compressed, key=lambda d: d['id'])
+
+
+def test_rejected_batches_are_retried(encoder, frame, monkeypatch):
+    # four batches compete for one slot, backing off until it is free
+    monkeypatch.setattr('aodn_pipeline.es_bulk.REJECT_BACKOFF', 0.05)
+    documents = bufr_documents(encoder.encode(frame.iloc[:10]), WSI)
+
+    with ElasticsearchStandIn([API_INDEX], capacity=1,
+                              request_cost=0.05) as es:
+        with BulkIndexer(es.url, batch_size=20, workers=4) as indexer:
+            for document in documents:
+                indexer.add(document)
+            assert indexer.flush() == 0
+
+    # the stand-in counts rejected requests, the indexer their documents
+    assert es.rejected > 0
+    assert indexer.rejections >= es.rejected
+    assert indexer.documents == len(documents)
+    assert len(es.indices[API_INDEX]) == len(documents)
+
+
+def test_malformed_bulk_request_fails(es):
+    with pytest.raises(ValueError, match='action without a document'):
+        parse_bulk(b'{"index": {}}\n', API_INDEX)
+
+    with BulkIndexer(es.url) as indexer:
+        failed = indexer._send([b'{"delete": {"_id": "1"}}\n{}\n'])
+
+    assert failed == 1
+    assert indexer.errors == 1
+    assert es.bulk_requests == 0
+
+
+def test_refresh_interval_is_restored(es):
+    es.settings[API_INDEX]['refresh_interval'] = '1s'
+
+    with relaxed_refresh(es.url):
+        assert es.settings[API_INDEX]['refresh_interval'] == '-1'
+
+    assert es.settings[API_INDEX]['refresh_interval'] == '1s'
+    assert es.refreshes == 1
+
+
+def test_bulk_sink_indexes_station_messages(es, encoder, frame):
+    message = encoder.encode(frame.iloc[:2])
+
+    with BulkIndexer(es.url) as indexer:
+        sink = bulk_sink(indexer)
+        sink(f'wave-buoys/WIGOS_{WSI}_20250801T001500.bufr4', message)
+        sink('wave-buoys/WAVE-BUOYS_20250801T001500_batch.bufr4', message)
+        with pytest.raises(ValueError):
+            sink(f'wave-buoys/WIGOS_{WSI}_20250801T001500.csv', b'')
+        assert indexer.flush() == 0
+
+    documents = es.indices[API_INDEX].values()
+    assert len(documents) == len(bufr_documents(message, WSI))
+    assert {d['properties']['wigos_station_identifier']
+            for d in documents} == {WSI}
@@ -0,0 +1,103 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from aodn_pipeline.retention import RetentionSweeper, cutoff
+from aodn_pipeline.standins import S3StandIn
+
+from conftest import INCOMING
+
+PUBLIC = 'wis2box-public'
+NOW = datetime(2025, 8, 31, 12, tzinfo=timezone.utc)
+BEFORE = cutoff(30, NOW)
+
+
+def ago(days: int) -> datetime:
+    return NOW - timedelta(days=days)
+
+
+@pytest.fixture
+def s3():
+    """S3 stand-in with 60 daily prefixes in the public bucket"""
+
+    with S3StandIn([PUBLIC, INCOMING]) as standin:
+        for days in range(60):
+            for n in range(1200 if days == 45 else 3):
+                standin.put(PUBLIC, f'{ago(days):%Y-%m-%d}/wis/au-imos/WIGOS_{n:05d}.bufr4',  # noqa
+                            b'BUFR', ago(days).timestamp())
+        yield standin
+
+
+@pytest.fixture
+def config(s3):
+    return {'source': s3.url, 'username': 'wis2box', 'password': 'wis2box'}
+
+
+def days(s3, bucket: str) -> set:
+    return {key.split('/')[0] for key in s3.buckets[bucket]}
+
+
+def test_expired_daily_prefixes_are_deleted(s3, config):
+    stats = RetentionSweeper(config, concurrency=2).sweep(PUBLIC, BEFORE)
+
+    # the day of the cutoff itself is kept
+    assert stats['prefixes_expired'] == 29
+    assert stats['prefixes_kept'] == 31
+    assert stats['objects'] == 28 * 3 + 1200
+    assert stats['bytes'] == stats['objects'] * 4
+    assert stats['errors'] == 0
+    assert days(s3, PUBLIC) == {f'{ago(d):%Y-%m-%d}' for d in range(31)}
+    assert len(s3.buckets[PUBLIC]) == 31 * 3
+
+
+def test_deletes_are_batched(s3, config):
+    stats = RetentionSweeper(config, batch_size=2).sweep(PUBLIC, BEFORE)
+
+    # each prefix is batched on its own
+    assert stats['batches'] == 28 * 2 + 600
+    assert s3.delete_requests == stats['batches']
+
+
+def test_dry_run_deletes_nothing(s3, config):
+    objects = len(s3.buckets[PUBLIC])
+
+    stats = RetentionSweeper(config, dry_run=True).sweep(PUBLIC, BEFORE)
+
+    assert stats['objects'] == 28 * 3 + 1200
+    assert len(s3.buckets[PUBLIC]) == objects
+    assert s3.delete_requests == 0
+
+
+def test_undated_objects_expire_by_modification_time(s3, config):
+    for n in range(50):
+        s3.put(INCOMING, f'au-imos/data/WIGOS_{n:02d}.csv', b'csv',
+               ago(n).timestamp())
+    s3.put(INCOMING, 'stray.csv', b'csv', ago(40).timestamp())
+
+    stats = RetentionSweeper(config).sweep(INCOMING, BEFORE)
+
+    assert stats['prefixes_expired'] == stats['prefixes_kept'] == 0
+    assert stats['objects'] == 19 + 1
+    assert sorted(s3.buckets[INCOMING]) == \
+        [f'au-imos/data/WIGOS_{n:02d}.csv' for n in range(31)]
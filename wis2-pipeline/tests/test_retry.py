@@ -0,0 +1,189 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import json
+import sys
+
+import pytest
+
+from aodn_pipeline import retry
+from aodn_pipeline.ingest import storage_sink
+from aodn_pipeline.retry import (BASE_DELAY, MAX_DELAY, RetryQueue, backoff,
+                                 queued_sink, station_of)
+
+from conftest import INCOMING
+
+KEY = 'wave-buoys/WIGOS_0-22000-0-7811080_20250801T001500.csv'
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with RetryQueue(tmp_path / 'retry.sqlite3', max_attempts=3) as store:
+        yield store
+
+
+@pytest.fixture
+def immediate(monkeypatch):
+    """Make every queued object due at once"""
+
+    monkeypatch.setattr(retry, 'backoff', lambda attempts: 0)
+
+
+def failing(key, data):
+    raise ConnectionError('storage unavailable')
+
+
+def run(monkeypatch, *args) -> None:
+    monkeypatch.setattr(sys, 'argv', ['retry', *map(str, args)])
+    retry.main()
+
+
+@pytest.mark.parametrize('attempts', range(0, 14, 3))
+def test_backoff_stays_within_the_jitter_bounds(attempts):
+    bound = min(MAX_DELAY, BASE_DELAY * 2 ** attempts)
+
+    delays = [backoff(attempts) for _ in range(1000)]
+
+    assert 0 <= min(delays) and max(delays) <= bound
+    # full jitter spreads the delays over the whole window
+    assert max(delays) - min(delays) > bound / 2
+
+
+def test_station_of_object_key():
+    assert station_of(KEY) == '0-22000-0-7811080'
+    assert station_of('wave-buoys/WAVE-BUOYS_20250801T001500_batch.bufr4') is None  # noqa
+
+
+def test_put_replaces_an_object_by_key(queue):
+    queue.put(KEY, b'first', 'timeout')
+    queue.put(KEY, b'second', 'refused', attempts=2)
+
+    [item] = queue.items()
+    assert item['attempts'] == 2
+    assert item['last_error'] == 'refused'
+    assert item['wigos_station_identifier'] == '0-22000-0-7811080'
+    assert queue.get(item['id'])[1] == b'second'
+
+
+def test_put_revives_a_dead_object(queue, immediate):
+    queue.put(KEY, b'data')
+    [(item_id, *_)] = queue.due()
+    assert queue.failed(item_id, 3, 'refused')
+
+    queue.put(KEY, b'data')
+
+    assert queue.counts() == {'pending': 1, 'dead': 0}
+
+
+def test_objects_wait_for_their_backoff(queue, monkeypatch):
+    monkeypatch.setattr(retry, 'backoff', lambda attempts: 60)
+
+    queue.put(KEY, b'data')
+
+    assert queue.due() == []
+    assert queue.counts() == {'pending': 1, 'dead': 0}
+
+
+def test_drain_stops_at_the_first_failure(queue, immediate):
+    for n in range(3):
+        queue.put(f'{KEY}.{n}', b'data')
+
+    counts = queue.drain(failing)
+
+    assert counts == {'replayed': 0, 'failed': 1, 'dead': 0}
+    assert [item['attempts'] for item in queue.items()] == [2, 1, 1]
+
+
+def test_dead_letter_after_max_attempts(queue, immediate):
+    queue.put(KEY, b'data')
+
+    dead = [queue.drain(failing)['dead'] for _ in range(2)]
+
+    assert dead == [0, 1]
+    assert queue.due() == []
+    assert queue.counts() == {'pending': 0, 'dead': 1}
+    assert queue.items(dead=True)[0]['last_error'] == \
+        'ConnectionError: storage unavailable'
+
+
+def test_drain_uploads_due_objects(s3, storage_config, queue, immediate):
+    for n in range(5):
+        queue.put(f'{KEY}.{n}', f'{n}'.encode())
+
+    counts = queue.drain(storage_sink(storage_config))
+
+    assert counts == {'replayed': 5, 'failed': 0, 'dead': 0}
+    assert s3.buckets[INCOMING][f'{KEY}.3'] == b'3'
+    assert queue.counts() == {'pending': 0, 'dead': 0}
+
+
+def test_queued_sink_bypasses_a_failing_sink(queue, monkeypatch):
+    calls = []
+
+    def sink(key, data):
+        calls.append(key)
+        failing(key, data)
+
+    now = [0.0]
+    monkeypatch.setattr(retry.time, 'monotonic', lambda: now[0])
+    wrapper = queued_sink(sink, queue, open_seconds=60)
+
+    wrapper(f'{KEY}.0', b'data')
+    now[0] = 30
+    wrapper(f'{KEY}.1', b'data')
+    now[0] = 61
+    wrapper(f'{KEY}.2', b'data')
+
+    assert calls == [f'{KEY}.0', f'{KEY}.2']
+    assert [item['attempts'] for item in queue.items()] == [1, 0, 1]
+
+
+def test_queued_sink_passes_stored_objects(s3, storage_config, queue):
+    wrapper = queued_sink(storage_sink(storage_config), queue)
+
+    wrapper(KEY, b'data')
+
+    assert s3.buckets[INCOMING][KEY] == b'data'
+    assert queue.items() == []
+
+
+def test_cli_requeues_and_drains_dead_objects(tmp_path, s3, queue,
+                                              immediate, monkeypatch,
+                                              capsys):
+    queue.put(KEY, b'data')
+    queue.drain(failing)
+    queue.drain(failing)
+    env_file = tmp_path / 'wis2box.env'
+    env_file.write_text(f'WIS2BOX_STORAGE_SOURCE={s3.url}\n'
+                        'WIS2BOX_STORAGE_USERNAME=wis2box\n'
+                        'WIS2BOX_STORAGE_PASSWORD=wis2box\n')
+
+    run(monkeypatch, '--queue', queue.path, 'list', '--dead', '--json')
+    [item] = json.loads(capsys.readouterr().out)
+    assert item['dead'] == 1
+
+    run(monkeypatch, '--queue', queue.path, 'requeue')
+    assert capsys.readouterr().out == 'Requeued 1 objects\n'
+
+    run(monkeypatch, '--queue', queue.path, 'drain', '--env-file', env_file)
+    assert capsys.readouterr().out.startswith('Replayed 1 objects')
+    assert s3.buckets[INCOMING][KEY] == b'data'
+    assert queue.counts() == {'pending': 0, 'dead': 0}
@@ -0,0 +1,80 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import threading
+
+import pytest
+
+from aodn_pipeline import WAVE_BUOY_TEMPLATE, WAVE_BUOY_TOPIC, runner
+from aodn_pipeline.retry import RetryQueue
+from aodn_pipeline.stations import load_national_sites
+
+from conftest import INCOMING, SAMPLE_DATA
+
+
+@pytest.fixture
+def station():
+    return next(s for s in load_national_sites()
+                if s['site_name'] == 'APOLLO-BAY')
+
+
+@pytest.fixture
+def worker(tmp_path, storage_config, monkeypatch):
+    """Worker context uploading through a retry queue, set up in-process"""
+
+    monkeypatch.setattr(runner, '_WORKER', {})
+
+    def init(timeout):
+        runner.init_worker(WAVE_BUOY_TEMPLATE, tmp_path / 'state.sqlite3',
+                           storage_config, None, WAVE_BUOY_TOPIC, True,
+                           timeout, retry_path=tmp_path / 'retry.sqlite3')
+        return runner._WORKER
+
+    yield init
+    if runner._WORKER:
+        runner._WORKER['state'].close()
+
+
+def test_station_uploads_every_object(s3, station, worker):
+    worker(60)
+
+    result = runner.process_station(station, SAMPLE_DATA)
+
+    assert result['status'] == 'ok'
+    assert result['objects'] == len(s3.buckets[INCOMING]) > 0
+
+
+def test_timeout_inside_queued_sink_ends_station(tmp_path, s3, station,
+                                                 worker):
+    hung = threading.Event()
+    s3.on_put.append(lambda *_: hung.wait(30))
+    worker(0.5)
+
+    try:
+        result = runner.process_station(station, SAMPLE_DATA)
+    finally:
+        hung.set()
+
+    assert result['status'] == 'timeout'
+    assert result['seconds'] < 5
+    # the alarm is not an upload failure
+    with RetryQueue(tmp_path / 'retry.sqlite3') as queue:
+        assert queue.counts() == {'pending': 0, 'dead': 0}
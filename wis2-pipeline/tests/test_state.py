@@ -0,0 +1,118 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+from minio.error import S3Error
+import numpy as np
+import pytest
+
+from aodn_pipeline.convert import load_station, load_template
+from aodn_pipeline.ingest import ingest_dataset, storage_sink
+from aodn_pipeline.reader import open_pruned
+from aodn_pipeline.state import StateStore
+
+from conftest import INCOMING, SAMPLE_DATA
+
+WSI = '0-22000-0-7811080'
+
+
+@pytest.fixture
+def state(tmp_path):
+    with StateStore(tmp_path / 'state.sqlite3') as store:
+        yield store
+
+
+@pytest.fixture(scope='module')
+def template():
+    return load_template()
+
+
+@pytest.fixture
+def sample(template):
+    [nc_file] = SAMPLE_DATA.glob('*.nc')
+    with open_pruned(nc_file, template) as ds:
+        yield ds
+
+
+def test_high_water_mark_only_moves_forward(state):
+    assert state.get(WSI) is None
+
+    state.advance(WSI, np.datetime64('2025-08-02T00:00'))
+    state.advance(WSI, np.datetime64('2025-08-01T00:00'))
+    assert state.get(WSI) == np.datetime64('2025-08-02T00:00')
+
+    state.advance(WSI, np.datetime64('2025-08-03T00:00'))
+    assert state.get(WSI) == np.datetime64('2025-08-03T00:00')
+
+    state.reset(WSI)
+    assert state.get(WSI) is None
+
+
+def test_high_water_mark_persists(tmp_path, state):
+    state.advance(WSI, np.datetime64('2025-08-31T23:20:00.5'))
+    state.close()
+
+    with StateStore(tmp_path / 'state.sqlite3') as store:
+        assert store.get(WSI) == np.datetime64('2025-08-31T23:20:00.5')
+        assert [row[0] for row in store.items()] == [WSI]
+
+
+def test_ingestion_resumes_after_the_mark(s3, storage_config, state,
+                                          template, sample):
+    station = load_station(wigos_station_identifier=WSI)
+    sink = storage_sink(storage_config)
+
+    first = ingest_dataset(sample.isel(TIME=slice(0, 100)), station,
+                           template, state, sink)
+    assert first['observations'] == 100
+    assert state.get(WSI) == sample['TIME'].values[99]
+
+    second = ingest_dataset(sample, station, template, state, sink)
+    assert second['observations'] == sample.sizes['TIME'] - 100
+    assert state.get(WSI) == sample['TIME'].values[-1]
+
+    again = ingest_dataset(sample, station, template, state, sink)
+    assert again['observations'] == again['objects'] == 0
+    assert len(s3.buckets[INCOMING]) == first['objects'] + second['objects']  # noqa
+
+
+def test_failed_upload_keeps_the_mark(s3, storage_config, state, template,
+                                      sample):
+    station = load_station(wigos_station_identifier=WSI)
+    state.advance(WSI, sample['TIME'].values[99])
+    storage_config = dict(storage_config, incoming='missing-bucket')
+
+    with pytest.raises(S3Error):
+        ingest_dataset(sample, station, template, state,
+                       storage_sink(storage_config))
+
+    assert state.get(WSI) == sample['TIME'].values[99]
+    assert not s3.buckets[INCOMING]
+
+
+def test_dry_run_leaves_the_mark(s3, storage_config, state, template,
+                                 sample):
+    station = load_station(wigos_station_identifier=WSI)
+
+    summary = ingest_dataset(sample, station, template, state,
+                             storage_sink(storage_config), advance=False)
+
+    assert summary['observations'] == sample.sizes['TIME']
+    assert state.get(WSI) is None
@@ -0,0 +1,83 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import sys
+
+import pytest
+
+from aodn_pipeline import STATION_LIST, stations
+from aodn_pipeline.stations import StationRegistry
+
+
+def run(monkeypatch, *args) -> None:
+    monkeypatch.setattr(sys, 'argv', ['stations', *map(str, args)])
+    stations.main()
+
+
+@pytest.fixture
+def invalid_station_list(tmp_path):
+    station_list = tmp_path / 'invalid.csv'
+    station_list.write_text(STATION_LIST.read_text().rstrip('\n') + '\n'
+                            'Nowhere,0-22000-0-bad,123,seaFixed,-40,150,1,1,'
+                            'AUS,southWestPacific\n')
+    return station_list
+
+
+def test_station_list_replaces_national_site_with_warning():
+    registry = StationRegistry.from_files()
+
+    conflicts = [p for p in registry.validate()
+                 if 'national site' in p['problem']]
+
+    assert [p['severity'] for p in conflicts] == ['warning']
+    assert registry.by_name('Apollo Bay')['wigos_station_identifier'] == \
+        '0-22000-0-7811080'
+
+
+def test_output_is_written_without_errors(tmp_path, monkeypatch, capsys):
+    output = tmp_path / 'station_list.csv'
+
+    run(monkeypatch, '--output', output)
+
+    assert output.read_text() == StationRegistry.from_files().to_station_list()  # noqa
+    assert 'WARNING' in capsys.readouterr().out
+
+
+def test_output_to_stdout_holds_only_the_csv(monkeypatch, capsys):
+    run(monkeypatch, '--output', '-')
+
+    captured = capsys.readouterr()
+    assert captured.out == StationRegistry.from_files().to_station_list()
+    assert 'WARNING' in captured.err
+
+
+@pytest.mark.parametrize('output', ['-', 'station_list.csv'])
+def test_errors_prevent_output(tmp_path, monkeypatch, capsys,
+                               invalid_station_list, output):
+    with pytest.raises(SystemExit) as exit:
+        run(monkeypatch, '--station-list', invalid_station_list,
+            '--output', output if output == '-' else tmp_path / output)
+
+    captured = capsys.readouterr()
+    assert exit.value.code == 1
+    assert 'ERROR 0-22000-0-bad' in captured.out + captured.err
+    assert 'station_name,' not in captured.out
+    assert not (tmp_path / 'station_list.csv').exists()
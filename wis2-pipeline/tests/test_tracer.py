@@ -0,0 +1,124 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import asyncio
+import io
+import json
+
+import numpy as np
+import pytest
+
+from aodn_pipeline import WAVE_BUOY_TOPIC
+from aodn_pipeline.standins import minio_event, wis2_notification
+from aodn_pipeline.tracer import (DATA_TOPIC, STORAGE_TOPIC, LatencyTracer,
+                                  standin_uploads, trace)
+
+from conftest import INCOMING
+
+UPLOADED = 1754006400.0
+
+
+def key(n: int) -> str:
+    return f'{WAVE_BUOY_TOPIC}/WIGOS_0-22000-0-7811080_20250801T{n:06d}.bufr4'  # noqa
+
+
+def event(object_key: str, bucket: str = INCOMING,
+          uploaded: float = UPLOADED) -> bytes:
+    """MinIO event with a fixed eventTime"""
+
+    message = json.loads(minio_event(bucket, object_key, 1))
+    message['Records'][0]['eventTime'] = f'{uploaded:.3f}'
+    return json.dumps(message).encode()
+
+
+@pytest.fixture
+def unix_event_time(monkeypatch):
+    # eventTime is written as Unix seconds so the expected latencies are
+    # exact, rather than rounded through ISO 8601
+    monkeypatch.setattr('aodn_pipeline.tracer.event_time', float)
+
+
+def test_stage_percentiles(unix_event_time):
+    tracer = LatencyTracer()
+    publish = np.arange(1, 101) / 100
+    for n, seconds in enumerate(publish):
+        tracer.storage(event(key(n)), UPLOADED + 0.5)
+        tracer.data(wis2_notification(event(key(n))),
+                    UPLOADED + 0.5 + seconds)
+
+    report = tracer.report()
+
+    assert report['stored'] == report['published'] == 100
+    assert report['pending'] == report['lost'] == report['unmatched'] == 0
+    assert report['stages']['storage']['p99_ms'] == pytest.approx(500)
+    for percentile in (50, 95, 99):
+        assert report['stages']['publish'][f'p{percentile}_ms'] == \
+            pytest.approx(np.percentile(publish, percentile) * 1000)
+        assert report['stages']['total'][f'p{percentile}_ms'] == \
+            pytest.approx(np.percentile(publish + 0.5, percentile) * 1000)
+
+
+def test_other_buckets_do_not_restart_a_trace(unix_event_time):
+    tracer = LatencyTracer()
+    tracer.storage(event(key(1)), UPLOADED + 1)
+    tracer.storage(event(key(1), 'wis2box-public', UPLOADED + 5),
+                   UPLOADED + 6)
+    tracer.data(wis2_notification(event(key(1))), UPLOADED + 7)
+
+    report = tracer.report()
+
+    assert report['stored'] == 1
+    assert report['stages']['total']['max_ms'] == pytest.approx(7000)
+
+
+def test_unmatched_and_lost_objects(unix_event_time):
+    record = io.StringIO()
+    tracer = LatencyTracer(timeout=60, record=record)
+    tracer.storage(event(key(1)), UPLOADED)
+    tracer.storage(event(key(2)), UPLOADED)
+    tracer.data(wis2_notification(event(key(1))), UPLOADED + 1)
+    tracer.data(wis2_notification(event(key(3))), UPLOADED + 1)
+
+    assert tracer.expire(UPLOADED + 30) == 0
+    assert tracer.expire(UPLOADED + 61) == 1
+
+    report = tracer.report()
+    assert report['published'] == report['unmatched'] == report['lost'] == 1
+    assert report['pending'] == 0
+    assert [json.loads(line)['key'] for line in
+            record.getvalue().splitlines()] == [key(1)]
+
+
+def test_trace_through_standins(s3, storage_config, broker):
+    broker.process(1000, queue_max=100, topic=STORAGE_TOPIC,
+                   done_topic=DATA_TOPIC, transform=wis2_notification)
+    s3.on_put.append(broker.notify_storage(STORAGE_TOPIC))
+    config = {'host': broker.address[0], 'port': broker.address[1]}
+    tracer = LatencyTracer(timeout=10)
+
+    report = asyncio.run(trace(config, tracer, duration=20, count=50,
+                               on_ready=standin_uploads(storage_config,
+                                                        50, 64)))
+
+    assert report['published'] == 50
+    assert report['lost'] == report['unmatched'] == 0
+    assert report['stages']['total']['count'] == 50
+    assert report['stages']['total']['p99_ms'] > 0
@@ -0,0 +1,85 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import os
+
+from aodn_pipeline.standins import S3Handler
+from aodn_pipeline.upload import (MIN_PART_SIZE, MINIO_MEM_SHARE,
+                                  BulkUploader, benchmark, part_size)
+
+from conftest import INCOMING
+
+
+def test_upload_many_stores_every_object(s3, storage_config):
+    objects = [(f'wave-buoys/object-{n:03d}.bufr4', os.urandom(1024))
+               for n in range(50)]
+
+    with BulkUploader(storage_config, concurrency=4) as uploader:
+        failures = uploader.upload_many(objects)
+
+    assert failures == []
+    assert uploader.objects == 50
+    assert uploader.bytes == 50 * 1024
+    assert s3.buckets[INCOMING] == dict(objects)
+
+
+def test_large_object_is_sent_in_parts(s3, storage_config, monkeypatch):
+    initiated = []
+    do_post = S3Handler.do_POST
+
+    def count_initiations(handler):
+        if handler.path.endswith('?uploads') or 'uploads=' in handler.path:
+            initiated.append(handler.path)
+        do_post(handler)
+
+    monkeypatch.setattr(S3Handler, 'do_POST', count_initiations)
+    data = os.urandom(3 * MIN_PART_SIZE + 1)
+    # a memory limit leaving one minimum-sized part per upload
+    mem_limit = int(MIN_PART_SIZE * 2 / MINIO_MEM_SHARE)
+
+    with BulkUploader(storage_config, concurrency=2,
+                      mem_limit=mem_limit) as uploader:
+        uploader.upload('wave-buoys/large.bufr4', data)
+
+    assert len(initiated) == 1
+    assert s3.buckets[INCOMING]['wave-buoys/large.bufr4'] == data
+    assert not s3.uploads
+
+
+def test_part_size_stays_within_memory_share():
+    mem_limit = 512 * 1024 * 1024
+    for concurrency in (1, 8, 32):
+        size = part_size(10 * 1024 ** 3, concurrency, mem_limit)
+        assert size >= MIN_PART_SIZE
+        assert size * concurrency <= max(mem_limit * MINIO_MEM_SHARE,
+                                         MIN_PART_SIZE * concurrency)
+
+    # small objects are sent whole
+    assert part_size(1024, 8, mem_limit) == MIN_PART_SIZE
+
+
+def test_benchmark_reports_throughput(storage_config):
+    with BulkUploader(storage_config, concurrency=4) as uploader:
+        results = benchmark(uploader, objects=20, size=512)
+
+    assert results['failures'] == 0
+    assert results['objects'] == 20
+    assert results['objects_per_second'] > 0
@@ -0,0 +1,151 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import json
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+CREATE_CONFIG = Path(__file__).resolve().parents[2] / 'wis2box' / 'wis2box-create-config.py'  # noqa
+
+grp = pytest.importorskip('grp')
+try:
+    grp.getgrnam('docker')
+except KeyError:
+    pytest.skip('wis2box-create-config.py needs a docker group',
+                allow_module_level=True)
+
+
+TEMPLATE = """identification:
+    title: ${CENTRE_NAME} ${CENTRE_ID}
+    country: ${COUNTRY_NAME}
+    bbox: ${BOUNDING_BOX}
+    email: ${WIS2BOX_EMAIL}
+    dates: ${PUBLICATION_DATE} ${START_DATE} ${CREATION_DATE}
+"""
+
+
+@pytest.fixture
+def create_config(tmp_path):
+    """
+    wis2box-create-config.py next to the config-templates it reads, which
+    come with the wis2box release rather than this repository
+    """
+
+    script = tmp_path / 'release' / CREATE_CONFIG.name
+    templates = script.parent / 'config-templates'
+    templates.mkdir(parents=True)
+    shutil.copy(CREATE_CONFIG, script)
+    (templates / 'countries.json').write_text(json.dumps({'countries': {
+        'au': {'name': 'Australia', 'bbox': {'minx': 112, 'miny': -44,
+                                             'maxx': 154, 'maxy': -10}}
+    }}))
+    for template in ('synop', 'temp'):
+        (templates / f'metadata-{template}.yml.tmpl').write_text(TEMPLATE)
+
+    return script
+
+
+def node(tmp_path: Path, name: str, **answers) -> dict:
+    return {
+        'host_datadir': str(tmp_path / name),
+        'wis2box_url': 'http://localhost',
+        'env_file': f'{name}.env',
+        'centres': [{
+            'centre_id': 'au-aodn',
+            'country_code': 'au',
+            'centre_name': 'Australian Ocean Data Network',
+            'email': 'info@aodn.org.au'
+        }],
+        **answers
+    }
+
+
+def provision(script: Path, answers) -> subprocess.CompletedProcess:
+    answers_file = script.parent / 'answers.json'
+    answers_file.write_text(answers if isinstance(answers, str)
+                            else json.dumps(answers))
+    return subprocess.run([sys.executable, str(script), '--answers',
+                           str(answers_file)], cwd=script.parents[1],
+                          capture_output=True, text=True)
+
+
+def test_answers_provision_every_node(tmp_path, create_config):
+    result = provision(create_config, [node(tmp_path, 'node1'),
+                                       node(tmp_path, 'node2')])
+
+    assert result.returncode == 0, result.stdout
+    for name in ('node1', 'node2'):
+        env = (tmp_path / f'{name}.env').read_text()
+        assert f"WIS2BOX_HOST_DATADIR={tmp_path / name}" in env
+        discovery = tmp_path / name / 'metadata' / 'discovery'
+        assert sorted(p.name for p in discovery.iterdir()) == \
+            ['metadata-synop-au-aodn.yml', 'metadata-temp-au-aodn.yml']
+        assert 'Australia' in (discovery / 'metadata-synop-au-aodn.yml').read_text()  # noqa
+
+
+def test_existing_datadir_fails_before_writing(tmp_path, create_config):
+    (tmp_path / 'node2').mkdir()
+
+    result = provision(create_config, [node(tmp_path, 'node1'),
+                                       node(tmp_path, 'node2')])
+
+    assert result.returncode == 1
+    assert 'answers[1]: host_datadir' in result.stdout
+    assert not (tmp_path / 'node1').exists()
+    assert not (tmp_path / 'node1.env').exists()
+
+
+def test_existing_datadir_is_reused_when_asked(tmp_path, create_config):
+    station_list = tmp_path / 'node1' / 'metadata' / 'station' / 'station_list.csv'  # noqa
+    station_list.parent.mkdir(parents=True)
+    station_list.write_text('kept')
+
+    result = provision(create_config,
+                       node(tmp_path, 'node1', reuse_datadir=True))
+
+    assert result.returncode == 0, result.stdout
+    assert station_list.read_text() == 'kept'
+
+
+@pytest.mark.parametrize('answers', [
+    'not json',
+    ['node'],
+    [{'wis2box_url': 'localhost'}]
+])
+def test_invalid_answers_exit_non_zero(create_config, answers):
+    result = provision(create_config, answers)
+
+    assert result.returncode == 1
+    assert 'ERROR' in result.stdout
+
+
+def test_shared_datadir_is_refused(tmp_path, create_config):
+    second = node(tmp_path, 'node2', host_datadir=str(tmp_path / 'node1'))
+
+    result = provision(create_config, [node(tmp_path, 'node1'), second])
+
+    assert result.returncode == 1
+    assert 'its own host_datadir' in result.stdout
+    assert not (tmp_path / 'node1').exists()
@@ -0,0 +1,120 @@
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+import importlib.util
+from pathlib import Path
+import sys
+
+import pytest
+
+from aodn_pipeline.standins import GitHubReleasesStandIn
+
+CTL = Path(__file__).resolve().parents[2] / 'wis2box' / 'wis2box-ctl.py'
+REPO = 'World-Meteorological-Organization/wis2box-release'
+
+
+def load_ctl(monkeypatch, *argv):
+    """Load wis2box-ctl.py as a module, which parses its arguments"""
+
+    monkeypatch.setattr(sys, 'argv', [CTL.name, *argv])
+    spec = importlib.util.spec_from_file_location('wis2box_ctl', CTL)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def ctl(monkeypatch):
+    """wis2box-ctl.py loaded as a module, its arguments parsed at import"""
+
+    return load_ctl(monkeypatch, 'status')
+
+
+@pytest.fixture
+def github(ctl, tmp_path):
+    """GitHub API stand-in with 250 releases, newest first"""
+
+    releases = [{'tag_name': f'1.0.{patch}'} for patch in range(250, 0, -1)]
+    with GitHubReleasesStandIn({REPO: releases}) as standin:
+        ctl.GITHUB_API_URL = standin.url
+        ctl.HTTP = ctl.HTTPClient(str(tmp_path / 'http'))
+        yield standin
+
+
+def test_fetch_releases_follows_pagination(ctl, github):
+    releases = ctl.fetch_releases()
+
+    assert len(releases) == 250
+    assert releases[0]['tag_name'] == '1.0.250'
+    assert releases[-1]['tag_name'] == '1.0.1'
+    assert github.requests == 3
+    assert github.not_modified == 0
+
+
+def test_unchanged_listing_is_revalidated_with_304(ctl, github):
+    first = ctl.fetch_releases()
+    second = ctl.fetch_releases()
+
+    assert second == first
+    assert github.requests == 6
+    assert github.not_modified == 3
+
+
+def test_changed_page_is_fetched_again(ctl, github):
+    ctl.fetch_releases()
+    github.releases[REPO].insert(0, {'tag_name': '1.0.251'})
+    releases = ctl.fetch_releases()
+
+    assert len(releases) == 251
+    assert releases[0]['tag_name'] == '1.0.251'
+    # every page shifted by one release, so none is answered from cache
+    assert github.not_modified == 0
+
+
+def test_resolved_version_is_the_highest_patch(ctl, github, tmp_path,
+                                               monkeypatch):
+    (tmp_path / 'VERSION.txt').write_text('1.0\n')
+    monkeypatch.chdir(tmp_path)
+
+    assert ctl.get_resolved_version() == '1.0.250'
+
+
+@pytest.mark.parametrize('argv', [
+    ['--parallel', '8', 'update', '--restart'],
+    ['update', '--parallel', '8', '--restart'],
+    ['update', '--restart', '--parallel=8']
+])
+def test_image_options_before_or_after_the_command(monkeypatch, argv):
+    ctl = load_ctl(monkeypatch, *argv)
+
+    parallel, cache, remaining = ctl.image_options(ctl.args.args)
+
+    assert parallel == 8
+    assert cache == ctl.BUILDKIT_CACHE_DIR
+    assert remaining == ['--restart']
+
+
+def test_buildkit_cache_disabled_after_the_command(monkeypatch):
+    ctl = load_ctl(monkeypatch, 'build', '--buildkit-cache', '')
+
+    parallel, cache, remaining = ctl.image_options(ctl.args.args)
+
+    assert (parallel, cache, remaining) == (ctl.DOCKER_PARALLEL, '', [])
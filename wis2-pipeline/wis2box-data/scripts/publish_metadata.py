@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+###############################################################################
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+###############################################################################
+
+"""
+Publish discovery and station metadata to wis2box, skipping what has not
+changed since the last run
+
+Runs inside the wis2box-management container, next to the `wis2box` CLI,
+and only needs the Python standard library.  A manifest of SHA-256 hashes
+records the discovery files and station rows that were last published
+successfully; only new or changed ones are published again.  Discovery
+collections are independent of each other and are published
+concurrently, before the changed station rows.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DATA_DIR = Path(__file__).resolve().parent.parent
+DISCOVERY_DIR = DATA_DIR / 'metadata' / 'discovery'
+STATION_LIST = DATA_DIR / 'metadata' / 'station' / 'station_list.csv'
+MANIFEST = DATA_DIR / 'metadata' / '.publish_manifest.json'
+
+TOPIC_HIERARCHY = 'origin/a/wis2/au-imos/data/core/ocean/surface-based-observations/wave-buoys'  # noqa
+
+RED = '\033[0;31m'
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'
+
+
+def print_status(message: str) -> None:
+    print(f'{BLUE}[INFO]{NC} {message}', flush=True)
+
+
+def print_success(message: str) -> None:
+    print(f'{GREEN}[SUCCESS]{NC} {message}', flush=True)
+
+
+def print_warning(message: str) -> None:
+    print(f'{YELLOW}[WARNING]{NC} {message}', flush=True)
+
+
+def print_error(message: str) -> None:
+    print(f'{RED}[ERROR]{NC} {message}', flush=True)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(path: Path) -> dict:
+    """
+    Load the manifest of published content hashes
+
+    :param path: `Path` of manifest file
+
+    :returns: `dict` with `discovery` (file name -> hash) and `stations`
+              (topic hierarchy -> WIGOS identifier -> hash)
+    """
+
+    try:
+        manifest = json.loads(path.read_text())
+    except FileNotFoundError:
+        manifest = {}
+    except ValueError:
+        print_warning(f'Ignoring unreadable manifest {path}')
+        manifest = {}
+
+    manifest.setdefault('discovery', {})
+    manifest.setdefault('stations', {})
+
+    return manifest
+
+
+def save_manifest(path: Path, manifest: dict) -> None:
+    """
+    Write the manifest atomically, so an interrupted run leaves the
+    previous one in place
+
+    :param path: `Path` of manifest file
+    :param manifest: `dict` of published content hashes
+
+    :returns: None
+    """
+
+    tmp = path.with_name(f'{path.name}.tmp')
+    tmp.write_text(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def run_wis2box(*args) -> tuple:
+    """
+    Run a wis2box CLI command
+
+    :param args: `str` arguments of the wis2box command
+
+    :returns: `tuple` of (`bool` of success, `str` of output)
+    """
+
+    result = subprocess.run(['wis2box', *args], capture_output=True,
+                            text=True)
+
+    return result.returncode == 0, (result.stdout + result.stderr).strip()
+
+
+def publish_discovery(path: Path) -> tuple:
+    """
+    Add the collection of a discovery metadata file and publish it to the
+    catalogue
+
+    :param path: `Path` of discovery metadata file
+
+    :returns: `tuple` of (`bool` of success, `str` of output, `float` of
+              seconds taken)
+    """
+
+    start = time.perf_counter()
+    ok, output = run_wis2box('data', 'add-collection', str(path))
+    if ok:
+        ok, output = run_wis2box('metadata', 'discovery', 'publish',
+                                 str(path))
+
+    return ok, output, time.perf_counter() - start
+
+
+def station_rows(path: Path) -> tuple:
+    """
+    Read station_list.csv and hash every row
+
+    :param path: `Path` of station list
+
+    :returns: `tuple` of (`list` of header fields, `dict` of WIGOS
+              identifier -> (row `dict`, hash))
+    """
+
+    with path.open(newline='', encoding='utf-8-sig') as fh:
+        reader = csv.DictReader(fh)
+        rows = {}
+        for row in reader:
+            wsi = (row.get('wigos_station_identifier') or '').strip()
+            if wsi:
+                rows[wsi] = (row, sha256(json.dumps(row, sort_keys=True).encode()))  # noqa
+
+    return reader.fieldnames, rows
+
+
+def publish_stations(fieldnames: list, rows: list,
+                     topic_hierarchy: str) -> tuple:
+    """
+    Publish station rows to a topic through a temporary station list
+
+    :param fieldnames: `list` of station_list.csv header fields
+    :param rows: `list` of row `dict` to publish
+    :param topic_hierarchy: `str` of topic hierarchy stations belong to
+
+    :returns: `tuple` of (`bool` of success, `str` of output)
+    """
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames,
+                            lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.csv',
+                                     prefix='station_list_') as fh:
+        fh.write(buffer.getvalue())
+        fh.flush()
+        return run_wis2box('metadata', 'station', 'publish-collection',
+                           '-p', fh.name, '-th', topic_hierarchy)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='publish changed discovery and station metadata to wis2box')  # noqa
+    parser.add_argument('--discovery-dir', type=Path, default=DISCOVERY_DIR,
+                        help='directory of discovery metadata .yml files')
+    parser.add_argument('--station-list', type=Path, default=STATION_LIST,
+                        help='station list to publish')
+    parser.add_argument('--topic-hierarchy', default=TOPIC_HIERARCHY,
+                        help='topic hierarchy the stations are published to')  # noqa
+    parser.add_argument('--manifest', type=Path, default=MANIFEST,
+                        help='manifest of published content hashes')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of collections published concurrently')  # noqa
+    parser.add_argument('--force', action='store_true',
+                        help='publish everything, ignoring the manifest')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list what would be published')
+
+    args = parser.parse_args()
+
+    if not args.dry_run and shutil.which('wis2box') is None:
+        print_error('wis2box command not found, run this script in the wis2box-management container')  # noqa
+        print_warning('Login to the container first: python3 wis2box-ctl.py login')  # noqa
+        sys.exit(1)
+
+    start = time.perf_counter()
+    manifest = {'discovery': {}, 'stations': {}} if args.force else \
+        load_manifest(args.manifest)
+    failures = 0
+
+    print_status('Starting WIS2Box metadata publishing process...')
+
+    # -------------------------------------------------------------------------
+    # 1. Publish changed discovery metadata, one collection per worker
+    # -------------------------------------------------------------------------
+    discovery = {}
+    for path in sorted(args.discovery_dir.glob('*.yml')):
+        digest = sha256(path.read_bytes())
+        if manifest['discovery'].get(path.name) != digest:
+            discovery[path] = digest
+
+    removed = set(manifest['discovery']) - \
+        {p.name for p in args.discovery_dir.glob('*.yml')}
+    for name in sorted(removed):
+        print_warning(f'{name} was removed, unpublish it with unpublish_metadata.sh')  # noqa
+        manifest['discovery'].pop(name)
+
+    if not discovery:
+        print_status('Discovery metadata unchanged')
+    elif args.dry_run:
+        for path in discovery:
+            print_status(f'Would publish discovery metadata {path.name}')
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = executor.map(publish_discovery, discovery)
+            for (path, digest), (ok, output, elapsed) in zip(discovery.items(), results):  # noqa
+                if ok:
+                    manifest['discovery'][path.name] = digest
+                    save_manifest(args.manifest, manifest)
+                    print_success(f'{path.stem} metadata published in {elapsed:.1f}s')  # noqa
+                else:
+                    failures += 1
+                    print_error(f'Failed to publish {path.stem} metadata')
+                    print(output)
+
+    # -------------------------------------------------------------------------
+    # 2. Publish new or changed station rows
+    # -------------------------------------------------------------------------
+    if args.station_list.exists():
+        fieldnames, rows = station_rows(args.station_list)
+        published = manifest['stations'].setdefault(args.topic_hierarchy, {})
+        changed = {wsi: (row, digest) for wsi, (row, digest) in rows.items()
+                   if published.get(wsi) != digest}
+
+        for wsi in sorted(set(published) - set(rows)):
+            print_warning(f'Station {wsi} was removed from {args.station_list.name}, '  # noqa
+                          'delete it in the wis2box-webapp')
+            published.pop(wsi)
+
+        if not changed:
+            print_status('Station metadata unchanged')
+        elif args.dry_run:
+            print_status(f'Would publish {len(changed)} of {len(rows)} stations: '  # noqa
+                         f"{', '.join(sorted(changed))}")
+        else:
+            print_status(f'Publishing {len(changed)} of {len(rows)} stations...')  # noqa
+            ok, output = publish_stations(
+                fieldnames, [row for row, _ in changed.values()],
+                args.topic_hierarchy)
+            if ok:
+                published.update({wsi: digest for wsi, (_, digest) in changed.items()})  # noqa
+                print_success('Wave buoy station metadata published successfully')  # noqa
+            else:
+                failures += 1
+                print_error('Failed to publish station metadata')
+                print(output)
+    else:
+        print_warning(f'{args.station_list} not found, skipping stations')
+
+    if not args.dry_run:
+        save_manifest(args.manifest, manifest)
+
+    print_status(f'Metadata publishing process completed in '
+                 f'{time.perf_counter() - start:.1f}s!')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@
 # =============================================================================
 # This script is used to publish dataset discovery metadata and weather station
 # metadata to WIS2Box instead of manually creating metadata from WIS2Box webapp.
+# It delegates to publish_metadata.py, which skips unchanged metadata.
 #
 # Metadata File locations:
 # - Discovery metadata: .yml files stored in ../metadata/discovery/
@@ -13,71 +14,11 @@
 
 set -e  # Exit on any error
 
-# Colors for output formatting
-RED='\033[0;31m'
-GREEN='\033[0;32m'
-YELLOW='\033[1;33m'
-BLUE='\033[0;34m'
-NC='\033[0m' # No Color
-
-# Function to print colored output
-print_status() {
-    echo -e "${BLUE}[INFO]${NC} $1"
-}
-
-print_success() {
-    echo -e "${GREEN}[SUCCESS]${NC} $1"
-}
-
-print_warning() {
-    echo -e "${YELLOW}[WARNING]${NC} $1"
-}
-
-print_error() {
-    echo -e "${RED}[ERROR]${NC} $1"
-}
-
-publish_metadata(){
-    WIS2_BUOY_SITE_NAME=$1
-    print_status "Publishing discovery metadata for $WIS2_BUOY_SITE_NAME ..."
-
-    wis2box data add-collection /data/wis2box/metadata/discovery/$WIS2_BUOY_SITE_NAME.yml && \
-    wis2box metadata discovery publish /data/wis2box/metadata/discovery/$WIS2_BUOY_SITE_NAME.yml && \
-    print_success "$WIS2_BUOY_SITE_NAME metadata published successfully" || \
-    print_error "Failed to publish $WIS2_BUOY_SITE_NAME metadata"
-
-}
-
-# List all discovery metadata files from ../metadata/discovery/
-list_discovery_metadata(){
-    ls ../metadata/discovery/*.yml | xargs -n 1 basename | sed 's/\.yml$//'
-}
-
-# =============================================================================
-# MAIN EXECUTION
-# =============================================================================
-
-print_status "Starting WIS2Box metadata publishing process..."
-
-# -----------------------------------------------------------------------------
-# 1. Publish Discovery Metadata for all files in ../metadata/discovery/
-# -----------------------------------------------------------------------------
-for site in $(list_discovery_metadata); do
-    publish_metadata $site
-done
-
-
-# -----------------------------------------------------------------------------
-# 2. Publish Station Metadata for Wave Buoys
-# -----------------------------------------------------------------------------
-print_status "Publishing station metadata for wave buoys..."
-
-#TODO: if more topics will be published, can refactor codes here to manage weather station metadata.
-wis2box metadata station publish-collection \
-    -p /data/wis2box/metadata/station/station_list.csv \
-    -th origin/a/wis2/au-imos/data/core/ocean/surface-based-observations/wave-buoys && print_success "Wave buoy station metadata published successfully" || print_error "Failed to publish station metadata"
-
-print_status "Metadata publishing process completed!"
+# Discovery files and station rows are hashed into
+# ../metadata/.publish_manifest.json and only new or changed ones are
+# published again, discovery collections concurrently. See
+# publish_metadata.py --help for options such as --force and --dry-run.
+exec python3 "$(dirname "$0")/publish_metadata.py" "$@"
 
 # =============================================================================
 # MANUAL ALTERNATIVE
@@ -18,7 +18,9 @@
 # under the License.
 #
 ###############################################################################
+import argparse
 import datetime
+from functools import lru_cache
 import json
 import os
 import platform
@@ -26,6 +28,7 @@ from pathlib import Path
 import random
 import string
 from string import Template
+import sys
 from typing import Tuple, Union
 
 # Identify platform type
@@ -40,6 +43,47 @@ if not WINDOWS:
 
 OTHER_TLDS = ['org', 'int']
 
+CONFIG_TEMPLATES = Path(__file__).parent / 'config-templates'
+
+METADATA_TEMPLATES = ['synop', 'temp']
+
+PASSWORD_NAMES = [
+    'WIS2BOX_WEBAPP_PASSWORD',
+    'WIS2BOX_STORAGE_PASSWORD',
+    'WIS2BOX_BROKER_PASSWORD'
+]
+
+GLOBAL_BOUNDING_BOX = '-180, -90, 180, 90'
+
+
+@lru_cache(maxsize=None)
+def load_countries() -> dict:
+    """
+    load and index config-templates/countries.json once per run
+
+    :returns: `dict` of country data keyed by TLD code
+    """
+
+    with (CONFIG_TEMPLATES / 'countries.json').open() as fh:
+        return json.load(fh)['countries']
+
+
+@lru_cache(maxsize=None)
+def load_metadata_template(template: str) -> Template:
+    """
+    load a discovery metadata template once per run
+
+    :param template: `str` of template name, e.g. synop or temp
+
+    :returns: `string.Template` of
+              config-templates/metadata-<template>.yml.tmpl
+    """
+
+    template_file = CONFIG_TEMPLATES / f'metadata-{template}.yml.tmpl'
+
+    with template_file.open() as fh:
+        return Template(fh.read())
+
 
 def get_country_name(country_code: str) -> str:
     """
@@ -52,21 +96,49 @@ def get_country_name(country_code: str) -> str:
     :returns: `str` of country name
     """
 
+    try:
+        return load_countries()[country_code]['name']
+    except KeyError:
+        return 'NA'
+
+
+def lookup_bounding_box(country_code: str) -> Tuple[str, str]:
+    """
+    look up the initial bounding box for the wis2box
+    using the country's TLD code
+
+    use bounding box for the whole world if no value is found in
+    the config-templates/countries.json file
+
+    :param country_code: `str` of TLD code of the country
+
+    :returns: `tuple` of (country_name, bbox)
+    """
+
     country_name = 'NA'
-    # get the path to the data
-    data_path = Path(__file__).parent / 'config-templates' / 'countries.json'
+    bounding_box = GLOBAL_BOUNDING_BOX
 
-    # open the file
-    with data_path.open() as fh:
-        # load the data
-        data = json.load(fh)
-        # get the bounding box for the country
-        try:
-            country_name = data['countries'][country_code]['name']
-        except KeyError:
-            pass
+    print(f'Getting bounding box for "{country_code}".')
 
-    return country_name
+    country = load_countries().get(country_code, {})
+    if 'bbox' in country:
+        country_name = country['name']
+        bbox = country['bbox']
+        if not {'minx', 'miny', 'maxx', 'maxy'} <= bbox.keys():
+            print(f'Bounding box for "{country_code}" is invalid.')
+            print('Using global bounding box.')
+        else:
+            minx = bbox['minx']
+            miny = bbox['miny']
+            maxx = bbox['maxx']
+            maxy = bbox['maxy']
+            # create bounding box as a CSV of four numbers
+            bounding_box = f'{minx},{miny},{maxx},{maxy}'
+    else:
+        print(f'No bounding box found for "{country_code}".')
+        print('Using the bounding box for the whole world.')
+
+    return country_name, bounding_box
 
 
 def get_bounding_box(country_code: str) -> Tuple[str, str]:
@@ -83,35 +155,7 @@ def get_bounding_box(country_code: str) -> Tuple[str, str]:
     :returns: `tuple` of (country_name, bbox)
     """
 
-    country_name = 'NA'
-    bounding_box = '-180, -90, 180, 90'
-
-    print(f'Getting bounding box for "{country_code}".')
-
-    # get the path to the data
-    data_path = Path(__file__).parent / 'config-templates' / 'countries.json'
-
-    # open the file
-    with data_path.open() as fh:
-        # load the data
-        data = json.load(fh)
-        # get the bounding box for the country
-        if country_code in data['countries'] and 'bbox' in data['countries'][country_code]:  # noqa
-            country_name = data['countries'][country_code]['name']
-            bbox = data['countries'][country_code]['bbox']
-            if not {'minx', 'miny', 'maxx', 'maxy'} <= bbox.keys():
-                print(f'Bounding box for "{country_code}" is invalid.')
-                print('Using global bounding box.')
-            else:
-                minx = bbox['minx']
-                miny = bbox['miny']
-                maxx = bbox['maxx']
-                maxy = bbox['maxy']
-                # create bounding box as a CSV of four numbers
-                bounding_box = f'{minx},{miny},{maxx},{maxy}'
-        else:
-            print(f'No bounding box found for "{country_code}".')
-            print('Using the bounding box for the whole world.')
+    country_name, bounding_box = lookup_bounding_box(country_code)
 
     # ask the user to accept the bounding box or to enter a new one
     print(f'bounding box: {bounding_box}.')
@@ -202,6 +246,16 @@ def get_tld_and_centre_id() -> Tuple[str, str]:
     return (country_code, centre_id)
 
 
+def random_password() -> str:
+    """
+    generates a random password
+
+    :returns: `str` of 8 random letters and digits
+    """
+
+    return ''.join(random.choice(string.ascii_letters + string.digits) for i in range(8)) # noqa
+
+
 def get_password(password_name: str) -> str:
     """
     asks the user to enter a password or to use a randomly generated password
@@ -222,7 +276,7 @@ def get_password(password_name: str) -> str:
         answer = input()
 
     if answer == 'y':
-        password = ''.join(random.choice(string.ascii_letters + string.digits) for i in range(8)) # noqa
+        password = random_password()
         print(f'{password_name}={password}')
 
     while answer != 'y':
@@ -317,16 +371,27 @@ def get_default_ui_language() -> Union[str, None]:
             print(f"Invalid language. Please choose from: {', '.join(valid_languages)}.") # noqa
 
 
-def create_wis2box_env(host_datadir: str) -> None:
+def create_wis2box_env(host_datadir: str, wis2box_url: str = None,
+                       passwords: dict = None,
+                       env_file: str = 'wis2box.env') -> None:
     """
     creates the wis2box.env file in the host_datadir
 
     :param host_datadir: `str` of path to the config directory
+    :param wis2box_url: `str` of wis2box URL, asked for if None
+    :param passwords: `dict` of password name to password, asked for if
+                      None, randomly generated if missing from the `dict`
+    :param env_file: `str` of path to the file to create
 
     :returns: None
     """
 
-    wis2box_env = Path('wis2box.env')
+    wis2box_env = Path(env_file)
+
+    def password(password_name):
+        if passwords is None:
+            return get_password(password_name)
+        return f"{password_name}={passwords.get(password_name) or random_password()}\n" # noqa
 
     with wis2box_env.open('w') as fh:
         fh.write('# directory on the host with wis2box-configuration\n') # noqa
@@ -334,7 +399,7 @@ def create_wis2box_env(host_datadir: str) -> None:
         fh.write(f'# directory in the wis2box container with wis2box-configuration\n') # noqa
         fh.write('WIS2BOX_DATADIR=/data/wis2box\n')
         fh.write('\n')
-        wis2box_url = get_wis2box_url()
+        wis2box_url = wis2box_url or get_wis2box_url()
         fh.write('# wis2box public URL\n')
         fh.write(f'WIS2BOX_URL={wis2box_url}\n')
         fh.write('WIS2BOX_UI_CLUSTER=false\n')
@@ -357,7 +422,7 @@ def create_wis2box_env(host_datadir: str) -> None:
         fh.write('# WIS2BOX WEBAPP credentials\n')
         fh.write('WIS2BOX_WEBAPP_USERNAME=wis2box-user\n')
         # get password for WIS2BOX_WEBAPP_PASSWORD and write it to wis2box.env
-        fh.write(get_password('WIS2BOX_WEBAPP_PASSWORD'))
+        fh.write(password('WIS2BOX_WEBAPP_PASSWORD'))
         fh.write('\n')
         fh.write('# map settings for wis2box-ui, wis2box-api and wis2box-webapp\n') # noqa
         fh.write('WIS2BOX_BASEMAP_URL=https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png\n') # noqa
@@ -373,7 +438,7 @@ def create_wis2box_env(host_datadir: str) -> None:
         # use the default username wis2box for WIS2BOX_STORAGE_USERNAME
         fh.write('WIS2BOX_STORAGE_USERNAME=wis2box\n')
         # get password for WIS2BOX_STORAGE_PASSWORD and write it to wis2box.env
-        fh.write(get_password('WIS2BOX_STORAGE_PASSWORD'))
+        fh.write(password('WIS2BOX_STORAGE_PASSWORD'))
         fh.write('\n')
         # write default port and host for WIS2BOX_BROKER
         fh.write('# broker settings\n')
@@ -383,7 +448,7 @@ def create_wis2box_env(host_datadir: str) -> None:
         fh.write('WIS2BOX_BROKER_USERNAME=wis2box\n')
         fh.write('WIS2BOX_BROKER_QUEUE_MAX=1000\n')
         # get password for WIS2BOX_BROKER_PASSWORD and write it to wis2box.env
-        fh.write(get_password('WIS2BOX_BROKER_PASSWORD'))
+        fh.write(password('WIS2BOX_BROKER_PASSWORD'))
         fh.write('\n')
         # update WIS2BOX_BROKER_PUBLIC settings after updating broker defaults
         fh.write('# update WIS2BOX_BROKER_PUBLIC settings after updating broker defaults\n') # noqa
@@ -417,7 +482,7 @@ def create_wis2box_env(host_datadir: str) -> None:
         fh.write('\n')
 
     print('*' * 80)
-    print('The file wis2box.env has been created in the current directory.')
+    print(f'The file {wis2box_env} has been created.')
     print('*' * 80)
 
 
@@ -450,16 +515,33 @@ def create_host_datadir() -> str:
         print("Is this correct? (y/n/exit)")
         answer = input()
 
+    return make_host_datadir(host_datadir)
+
+
+def make_host_datadir(host_datadir: str, reuse: bool = False) -> Path:
+    """
+    Creates the directory wis2box_host_datadir with its mappings and
+    downloads directories
+
+    :param host_datadir: `str` of path to directory for wis2box_host_datadir
+    :param reuse: `bool` whether to keep using an existing directory
+
+    :returns: `Path` of directory for wis2box_host_datadir
+    """
+
     # check if the directory exists
     try:
         host_datadir = Path(host_datadir)
-        if host_datadir.is_dir():
+        if host_datadir.is_dir() and reuse:
+            print(f"The directory {host_datadir} already exists, reusing it.")
+            return host_datadir
+        elif host_datadir.is_dir():
             # if it exists warn the user
             # tell them that the directory needs to be remove to continue
             print("WARNING:")
             print(f"The directory {host_datadir} already exists.")
             print("Please remove the directory to restart the configuration process.") # noqa
-            exit()
+            exit(1)
         else:
             # if it does not exist, create it
             host_datadir.mkdir(parents=True)
@@ -468,14 +550,14 @@ def create_host_datadir() -> str:
                 print("ERROR:")
                 print(f"The directory {host_datadir} could not be created.")
                 print("Please check the path and your permissions.")
-                exit()
+                exit(1)
         print(f"The directory {host_datadir} has been created.")
     except Exception:
         print("ERROR:")
         print(f"The directory {host_datadir} could not be created.")
         print("Please provide an absolute path to the directory.")
         print("and check your permissions.")
-        exit()
+        exit(1)
 
     # failing to create mappings and downloads directories is not critical
     try:
@@ -522,7 +604,6 @@ def create_metadata_file(host_datadir: str, country_name: str,
         discovery_metadata_dir.mkdir(parents=True)
 
     new_config_file = discovery_metadata_dir / f'metadata-{template}-{centre_id}.yml' # noqa
-    template_file = Path('config-templates') / f'metadata-{template}.yml.tmpl'  # noqa
 
     template_vars = {
         'PUBLICATION_DATE': current_date,
@@ -535,12 +616,10 @@ def create_metadata_file(host_datadir: str, country_name: str,
         'BOUNDING_BOX': bounding_box
     }
 
-    with template_file.open() as fh:
-        config_file = Template(fh.read())
-        result = config_file.substitute(template_vars)
-        with new_config_file.open("w") as fh2:
-            fh2.write(result)
-            print(f"Created new metadata file: {new_config_file}")
+    result = load_metadata_template(template).substitute(template_vars)
+    with new_config_file.open("w") as fh:
+        fh.write(result)
+        print(f"Created new metadata file: {new_config_file}")
 
     return new_config_file.name
 
@@ -661,6 +740,180 @@ def get_host_datadir() -> str:
     return host_datadir
 
 
+def validate_centre(centre: dict) -> list:
+    """
+    checks a centre of an answers file against the rules of the prompts
+
+    :param centre: `dict` with centre_id, country_code, centre_name and email
+
+    :returns: `list` of `str` error messages
+    """
+
+    errors = []
+    for key in ['centre_id', 'country_code', 'centre_name', 'email']:
+        if not centre.get(key):
+            errors.append(f'missing {key}')
+    if errors:
+        return errors
+
+    country_code = centre['country_code'].lower()
+    centre_id = centre['centre_id'].lower()
+
+    if country_code not in OTHER_TLDS and len(country_code) != 2:
+        errors.append(f'the country code must be a 2-letter ISO code or another relevant TLD (e.g. {OTHER_TLDS})') # noqa
+    if not centre_id.startswith(country_code + '-'):
+        errors.append(f'the centre-id must start with {country_code}-')
+    if any([x in centre_id for x in ['#', '+', ' ']]):
+        errors.append('the centre-id cannot contain spaces or the "+" or "#" characters') # noqa
+    if len(centre_id) < 6:
+        errors.append('the centre-id must be at least 6 characters long')
+    for template in centre.get('templates', METADATA_TEMPLATES):
+        if not (CONFIG_TEMPLATES / f'metadata-{template}.yml.tmpl').is_file():  # noqa
+            errors.append(f'no metadata template {template}')
+    if 'bounding_box' in centre and len(str(centre['bounding_box']).split(',')) != 4: # noqa
+        errors.append('the bounding box must be a comma-separated list of four numbers') # noqa
+
+    return errors
+
+
+def validate_answers(node: dict) -> list:
+    """
+    checks the answers for one wis2box against the rules of the prompts
+
+    :param node: `dict` of answers with host_datadir, wis2box_url,
+                 passwords and centres
+
+    :returns: `list` of `str` error messages
+    """
+
+    errors = []
+    if not node.get('host_datadir'):
+        errors.append('missing host_datadir')
+    elif Path(node['host_datadir']).exists():
+        if not Path(node['host_datadir']).is_dir():
+            errors.append(f"host_datadir {node['host_datadir']} is not a directory") # noqa
+        elif not node.get('reuse_datadir', False):
+            errors.append(f"host_datadir {node['host_datadir']} already exists, remove it or set reuse_datadir") # noqa
+    if not str(node.get('wis2box_url', '')).startswith(('http://', 'https://')): # noqa
+        errors.append('the wis2box_url must start with http:// or https://')
+    for password_name, password in node.get('passwords', {}).items():
+        if password_name not in PASSWORD_NAMES:
+            errors.append(f'unknown password {password_name}')
+        elif password and len(password) < 8:
+            errors.append(f'{password_name} must be at least 8 characters long') # noqa
+    for centre in node.get('centres', []):
+        name = centre.get('centre_id', '?')
+        errors.extend(f'{name}: {error}' for error in validate_centre(centre))
+
+    return errors
+
+
+def provision(node: dict) -> None:
+    """
+    creates the host datadir, wis2box.env, station list and the metadata
+    files of every centre of one wis2box from its answers, without prompts
+
+    :param node: `dict` of validated answers
+
+    :returns: None
+    """
+
+    host_datadir = make_host_datadir(node['host_datadir'],
+                                     reuse=node.get('reuse_datadir', False))
+
+    # never truncate the station list of a reused directory
+    if not (host_datadir / 'metadata' / 'station' / 'station_list.csv').is_file(): # noqa
+        create_station_list(host_datadir)
+
+    create_wis2box_env(host_datadir, node['wis2box_url'],
+                       node.get('passwords', {}),
+                       node.get('env_file', 'wis2box.env'))
+
+    # render every template of every centre in one pass
+    for centre in node.get('centres', []):
+        country_code = centre['country_code'].lower()
+        centre_id = centre['centre_id'].lower()
+
+        country_name, bounding_box = lookup_bounding_box(country_code)
+        bounding_box = centre.get('bounding_box', bounding_box)
+
+        for template in centre.get('templates', METADATA_TEMPLATES):
+            create_metadata_file(host_datadir, country_name, centre_id,
+                                 centre['centre_name'], centre['email'],
+                                 bounding_box, template)
+
+
+def provision_from_answers(answers_file: str) -> None:
+    """
+    provisions one or more wis2box from a JSON answers file
+
+    The file holds one `dict` of answers, or a `list` of them to set up
+    several wis2box in one run, e.g.:
+
+    {
+        "host_datadir": "/home/wis2box-user/wis2box-data",
+        "wis2box_url": "http://localhost",
+        "passwords": {"WIS2BOX_WEBAPP_PASSWORD": "..."},
+        "centres": [{
+            "centre_id": "au-aodn",
+            "country_code": "au",
+            "centre_name": "Australian Ocean Data Network",
+            "email": "info@aodn.org.au",
+            "templates": ["synop", "temp"]
+        }]
+    }
+
+    Passwords left out are randomly generated.  Every node is validated
+    before any file is written, including that its host_datadir does not
+    exist yet unless `reuse_datadir` is set, and every failure exits with
+    status 1.
+
+    :param answers_file: `str` of path to the answers file, - for stdin
+
+    :returns: None
+    """
+
+    try:
+        if answers_file == '-':
+            answers = json.load(sys.stdin)
+        else:
+            with Path(answers_file).open() as fh:
+                answers = json.load(fh)
+    except (OSError, ValueError) as err:
+        print("ERROR:")
+        print(f"  cannot read the answers file {answers_file}: {err}")
+        exit(1)
+
+    nodes = answers if isinstance(answers, list) else [answers]
+    if not all(isinstance(node, dict) for node in nodes):
+        print("ERROR:")
+        print("  the answers must be an object or a list of objects")
+        exit(1)
+
+    errors = []
+    env_files = [node.get('env_file', 'wis2box.env') for node in nodes]
+    if len(set(env_files)) != len(env_files):
+        errors.append('every wis2box needs its own env_file')
+    host_datadirs = [Path(node['host_datadir']).resolve() for node in nodes
+                     if node.get('host_datadir')]
+    if len(set(host_datadirs)) != len(host_datadirs):
+        errors.append('every wis2box needs its own host_datadir')
+    for number, node in enumerate(nodes):
+        errors.extend(f'answers[{number}]: {error}'
+                      for error in validate_answers(node))
+
+    if errors:
+        print("ERROR:")
+        for error in errors:
+            print(f"  {error}")
+        exit(1)
+
+    for node in nodes:
+        provision(node)
+
+    print("The configuration is complete.")
+
+
 def main():
     """
     mainline function
@@ -669,6 +922,16 @@ def main():
     and sets up the directory for WIS2BOX_HOST_DATADIR
     """
 
+    parser = argparse.ArgumentParser(
+        description='create the wis2box configuration')
+    parser.add_argument('--answers',
+                        help='JSON answers file (- for stdin) to provision without prompts') # noqa
+    args = parser.parse_args()
+
+    if args.answers:
+        provision_from_answers(args.answers)
+        exit()
+
     host_datadir = None
     dev_env = Path("wis2box.env")
 
@@ -21,17 +21,22 @@
 ###############################################################################
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import glob
+import hashlib
 import http.client
+import inspect
 import json
 import os
+import re
+import shutil
+import socket
 import subprocess
-from urllib.parse import urlparse
+import time
+from urllib.parse import urljoin, urlparse
 
-if subprocess.call(['docker', 'compose'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) > 0:
-    DOCKER_COMPOSE_COMMAND = 'docker-compose'
-else:
-    DOCKER_COMPOSE_COMMAND = 'docker compose'
+# detected on first use by compose_command(), see StartupCache
+DOCKER_COMPOSE_COMMAND = None
 
 DOCKER_COMPOSE_ARGS = """
     --file docker-compose.yml
@@ -41,10 +46,47 @@ DOCKER_COMPOSE_ARGS = """
     --project-name wis2box_project
     """
 
+# endpoints probed by `health`, as in the compose healthchecks: service ->
+# (kind, address in the compose network, path, address published on the host)
+# nginx is probed through its /oapi proxy, so its latency less that of
+# wis2box-api is the proxy overhead
+HEALTH_ENDPOINTS = {
+    'wis2box-minio': ('http', 'minio:9000', '/minio/health/live', 'localhost:9000'),
+    'elasticsearch': ('http', 'elasticsearch:9200', '/', None),
+    'wis2box-api': ('http', 'wis2box-api:80', '/oapi/admin/resources', None),
+    'mosquitto': ('tcp', 'mosquitto:1883', None, 'localhost:1883'),
+    'nginx': ('http', 'web-proxy:80', '/oapi/admin/resources', 'localhost:80'),
+}
+
 GITHUB_RELEASE_REPO = 'World-Meteorological-Organization/wis2box-release'
 
+# overridable to resolve releases against a local stand-in
+GITHUB_API_URL = os.environ.get('WIS2BOX_GITHUB_API_URL', 'https://api.github.com')
+
+# startup cache of the compose command and rendered compose configuration
+CTL_CACHE_DIR = os.environ.get(
+    'WIS2BOX_CTL_CACHE', os.path.expanduser('~/.cache/wis2box/ctl'))
+
+# rendered compose configurations hold the secrets of wis2box.env, so they
+# are kept owner-only next to it rather than in the user cache
+RENDERED_CONFIG_DIR = '.wis2box-ctl'
+
+# conditional request cache of GitHub API responses
+HTTP_CACHE_DIR = os.environ.get(
+    'WIS2BOX_HTTP_CACHE', os.path.expanduser('~/.cache/wis2box/http'))
+
 LOCAL_BUILD_IMAGES = ['wis2box-broker', 'wis2box-management', 'wis2box-mqtt-metrics-collector']
 
+# number of concurrent docker pull/build processes
+DOCKER_PARALLEL = int(os.environ.get('WIS2BOX_DOCKER_PARALLEL', 4))
+
+# BuildKit builder and cache shared by local builds, one cache subdirectory
+# per image. The default docker driver cannot export caches, so cached
+# builds run on a docker-container builder
+BUILDKIT_BUILDER = 'wis2box-builder'
+BUILDKIT_CACHE_DIR = os.environ.get(
+    'WIS2BOX_BUILDKIT_CACHE', os.path.expanduser('~/.cache/wis2box/buildkit'))
+
 parser = argparse.ArgumentParser(
     description='manage a composition of docker containers to implement a WIS2-in-a-box',
     formatter_class=argparse.RawTextHelpFormatter)
@@ -66,6 +108,7 @@ commands = [
     'config',
     'down',
     'execute',
+    'health',
     'lint',
     'logs',
     'login',
@@ -83,19 +126,33 @@ parser.add_argument('command',
                     choices=commands,
                     help="""
     - config: validate and view Docker configuration
-    - build [containers]: build all services
+    - build [--parallel N] [--buildkit-cache DIR]: build all services (concurrently, with a BuildKit cache)
     - start [containers]: start system
     - start-dev [containers]: start system in local development mode
     - login [container]: login to the container (default: wis2box-management)
     - login-root [container]: login to the container as root
     - stop: stop [container] system
-    - update: update Docker images
+    - update [--parallel N] [--restart]: update Docker images (pulled concurrently)
     - prune: cleanup dangling containers and images
     - restart [containers]: restart one or all containers
     - status [containers|-a]: view status of wis2box containers
+    - health [--samples N] [--json] [--host]: probe service endpoints and report latency percentiles
     - lint: run PEP8 checks against local Python code
     """)
 
+parser.add_argument(
+    '--parallel',
+    dest='parallel',
+    type=int,
+    default=DOCKER_PARALLEL,
+    help='number of images pulled or built concurrently (default: %(default)s)')
+
+parser.add_argument(
+    '--buildkit-cache',
+    dest='buildkit_cache',
+    default=BUILDKIT_CACHE_DIR,
+    help='BuildKit cache directory for local builds, "" to disable (default: %(default)s)')
+
 parser.add_argument('args', nargs=argparse.REMAINDER)
 
 args = parser.parse_args()
@@ -141,6 +198,602 @@ def run(cmd, silence_stderr=False) -> None:
     return None
 
 
+def read_env(path: str) -> dict:
+    """
+    Parses a docker compose env file
+
+    :param path: `str` of env file path
+
+    :returns: `dict` of variables, without comments, `export` prefixes or
+              quotes around values
+    """
+
+    env = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            name, value = line.split('=', 1)
+            name = name.strip()
+            if name.startswith('export '):
+                name = name[len('export '):].strip()
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+                value = value[1:-1]
+            env[name] = value
+
+    return env
+
+
+class StartupCache:
+    """
+    Remembers the detected compose command and rendered compose
+    configuration between invocations
+
+    Entries are keyed on the contents of the compose and env files in the
+    working directory, on the shell environment variables the compose files
+    interpolate and on the docker binary, so changing any of them or
+    upgrading docker invalidates the cache.  Rendered configurations are
+    written with mode 0600 to RENDERED_CONFIG_DIR in the wis2box directory.
+    """
+
+    def __init__(self, cache_dir: str = CTL_CACHE_DIR):
+        # one subdirectory per wis2box directory
+        self.cache_dir = os.path.join(
+            cache_dir, hashlib.sha256(os.getcwd().encode()).hexdigest()[:12])
+        self.key = self.fingerprint()
+        self.path = os.path.join(self.cache_dir, f'{self.key}.json')
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def fingerprint() -> str:
+        """
+        Hashes the compose files, wis2box.env and .env, the values of the
+        variables the compose files reference and the docker binary stat
+
+        :returns: `str` of cache key
+        """
+
+        digest = hashlib.sha256()
+        variables = set()
+        for file_ in sorted(glob.glob('docker-compose*.yml') + ['wis2box.env', '.env']):
+            if os.path.exists(file_):
+                digest.update(file_.encode())
+                with open(file_, 'rb') as f:
+                    content = f.read()
+                digest.update(hashlib.sha256(content).digest())
+                if file_.endswith('.yml'):
+                    variables.update(re.findall(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)',
+                                                content.decode(errors='replace')))
+
+        # compose interpolates from the shell environment before env files
+        for name in sorted(variables):
+            digest.update(f'{name}={os.environ.get(name)}\n'.encode())
+
+        # the binary changes whenever docker is upgraded
+        docker = shutil.which('docker')
+        if docker:
+            stat = os.stat(docker)
+            digest.update(f'{os.path.realpath(docker)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+
+        return digest.hexdigest()[:16]
+
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    def set(self, name: str, value) -> None:
+        self.entries[name] = value
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # only the entries of the current files are kept
+        for file_ in glob.glob(os.path.join(self.cache_dir, '*')):
+            if os.path.basename(file_) != f'{self.key}.json':
+                os.remove(file_)
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def compose_command(self) -> str:
+        """
+        Detects whether docker compose v2 or docker-compose is available
+
+        :returns: `str` of compose command
+        """
+
+        command = self.get('compose_command')
+        if command is None:
+            if subprocess.call(['docker', 'compose'], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL) > 0:
+                command = 'docker-compose'
+            else:
+                command = 'docker compose'
+            self.set('compose_command', command)
+
+        return command
+
+    def rendered_config(self, compose_args: str, render: bool = False) -> str:
+        """
+        Returns a file holding the fully merged `docker compose config`
+        output for the given compose arguments
+
+        :param compose_args: `str` of compose file and env arguments
+        :param render: `bool` of whether to render the configuration if
+                       it is not cached
+
+        :returns: `str` of rendered configuration path, or None
+        """
+
+        name = 'config-' + hashlib.sha256(' '.join(split(compose_args)).encode()).hexdigest()[:16]
+        path = os.path.join(RENDERED_CONFIG_DIR, f'{self.key}-{name}.yml')
+        if self.get(name) and os.path.exists(path):
+            return path
+        if not render:
+            return None
+
+        result = subprocess.run(split(f'{self.compose_command()} {compose_args} config'),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+
+        os.makedirs(RENDERED_CONFIG_DIR, mode=0o700, exist_ok=True)
+        for file_ in glob.glob(os.path.join(RENDERED_CONFIG_DIR, '*.yml')):
+            if not os.path.basename(file_).startswith(self.key):
+                os.remove(file_)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(result.stdout)
+        self.set(name, True)
+
+        return path
+
+
+def human_size(size: int) -> str:
+    """
+    Formats a number of bytes for display
+
+    :param size: `int` of bytes
+
+    :returns: `str` of size, e.g. 1.2 GB
+    """
+
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1000 or unit == 'GB':
+            break
+        size /= 1000
+
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+
+
+def image_info(image: str) -> tuple:
+    """
+    Looks up the id and size of a local docker image
+
+    :param image: `str` of image reference
+
+    :returns: `tuple` of image id and size in bytes, (None, 0) if the
+              image is not present
+    """
+
+    result = subprocess.run(
+        ['docker', 'image', 'inspect', '--format', '{{.Id}} {{.Size}}', image],
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, 0
+
+    image_id, size = result.stdout.split()
+    return image_id, int(size)
+
+
+def pull_image(image: str) -> dict:
+    """
+    Pulls a docker image, measuring how long it took and how much was
+    downloaded
+
+    :param image: `str` of image reference
+
+    :returns: `dict` of image, ok, seconds, bytes and output. `bytes` is
+              the size of the image if it was new or changed, 0 otherwise
+    """
+
+    old_id, _ = image_info(image)
+    start = time.perf_counter()
+    result = subprocess.run(['docker', 'pull', '--quiet', image],
+                            capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    new_id, size = image_info(image)
+
+    return {
+        'image': image,
+        'ok': result.returncode == 0,
+        'seconds': seconds,
+        'bytes': size if new_id != old_id else 0,
+        'output': (result.stdout + result.stderr).strip()
+    }
+
+
+def buildx_builder(name: str = BUILDKIT_BUILDER) -> bool:
+    """
+    Ensures a docker-container BuildKit builder exists, creating it if
+    needed
+
+    :param name: `str` of builder name
+
+    :returns: `bool` of whether the builder is available
+    """
+
+    def docker(*cmd):
+        return subprocess.call(['docker', *cmd], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL) == 0
+
+    if not docker('buildx', 'version'):
+        return False
+
+    return docker('buildx', 'inspect', name) or \
+        docker('buildx', 'create', '--name', name, '--driver', 'docker-container')
+
+
+def build_image(image: str, cache_dir: str = None) -> dict:
+    """
+    Builds a local docker image, with a BuildKit cache if given
+
+    BuildKit never prunes a local cache it exports into, so each build
+    exports into a fresh directory that then replaces the previous cache.
+
+    :param image: `str` of image name, also the build context directory
+    :param cache_dir: `str` of BuildKit cache directory, or None
+
+    :returns: `dict` of image, ok, seconds, bytes and output
+    """
+
+    if cache_dir:
+        cache = os.path.join(cache_dir, image)
+        cache_new = f'{cache}.new'
+        shutil.rmtree(cache_new, ignore_errors=True)
+        cmd = ['docker', 'buildx', 'build', '--builder', BUILDKIT_BUILDER,
+               '--load', '-t', image,
+               '--cache-to', f'type=local,dest={cache_new},mode=max']
+        if os.path.isdir(cache):
+            cmd += ['--cache-from', f'type=local,src={cache}']
+        cmd.append(f'./{image}')
+    else:
+        cmd = split(f'docker build -t {image} ./{image}')
+
+    start = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+
+    if cache_dir and result.returncode == 0 and os.path.isdir(cache_new):
+        shutil.rmtree(cache, ignore_errors=True)
+        os.rename(cache_new, cache)
+
+    return {
+        'image': image,
+        'ok': result.returncode == 0,
+        'seconds': seconds,
+        'bytes': image_info(image)[1],
+        'output': (result.stdout + result.stderr).strip()
+    }
+
+
+def run_concurrently(task, images: list, doing: str, done: str,
+                     parallel: int) -> list:
+    """
+    Runs a docker task over images with bounded concurrency, reporting the
+    progress and timing of each image and a summary
+
+    :param task: callable taking an image and returning a `dict` with
+                 image, ok, seconds, bytes and output
+    :param images: `list` of images
+    :param doing: `str` of the task in progress, for messages (Pulling)
+    :param done: `str` of the completed task, for messages (pulled)
+    :param parallel: `int` of concurrent tasks
+
+    :returns: `list` of task results
+    """
+
+    if not images:
+        return []
+
+    print(f'{doing} {len(images)} images, {parallel} at a time')
+    start = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [executor.submit(task, image) for image in images]
+        for count, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            status = done if result['ok'] else 'FAILED'
+            print(f"[{count}/{len(images)}] {status} {result['image']} "
+                  f"in {result['seconds']:.1f}s ({human_size(result['bytes'])})")
+            if not result['ok']:
+                print('\n'.join(result['output'].splitlines()[-20:]))
+
+    failed = [r['image'] for r in results if not r['ok']]
+    print(f'{done.capitalize()} {len(images) - len(failed)}/{len(images)} images '
+          f'in {time.perf_counter() - start:.1f}s, '
+          f"{human_size(sum(r['bytes'] for r in results))} {done}")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+
+    return results
+
+
+class HTTPClient:
+    """
+    Minimal HTTP client keeping one keep-alive connection per host, with an
+    on-disk cache revalidated by ETag / If-None-Match
+    """
+
+    def __init__(self, cache_dir: str = HTTP_CACHE_DIR, timeout: float = 30):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.connections = {}
+
+    def connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        key = (scheme, netloc)
+        if key not in self.connections:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            self.connections[key] = conn
+        return self.connections[key]
+
+    def request(self, url: str, headers: dict = {}, max_redirects: int = 5) -> tuple:
+        """
+        GET a URL over a reused connection, following redirects
+
+        :param url: `str` of URL
+        :param headers: `dict` of request headers
+        :param max_redirects: `int` of redirects to follow
+
+        :returns: `tuple` of status, `http.client.HTTPMessage` of response
+                  headers and `bytes` of body
+        """
+
+        for _ in range(max_redirects + 1):
+            parsed_url = urlparse(url)
+            full_path = parsed_url.path or '/'
+            if parsed_url.query:  # Include query string if it exists
+                full_path += '?' + parsed_url.query
+
+            for attempt in range(2):
+                conn = self.connection(parsed_url.scheme, parsed_url.netloc)
+                try:
+                    conn.request('GET', full_path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # the server closed the idle keep-alive connection
+                    conn.close()
+                    if attempt:
+                        raise
+
+            # Follow redirect, over the connection of the target host
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            return response.status, response.headers, body
+
+        raise http.client.HTTPException(f'Too many redirects fetching {url}')
+
+    def cache_paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return (os.path.join(self.cache_dir, f'{key}.json'),
+                os.path.join(self.cache_dir, f'{key}.body'))
+
+    def get(self, url: str, headers: dict = {}) -> tuple:
+        """
+        GET a URL, answering from the disk cache when the server confirms
+        with 304 Not Modified that the cached copy is current
+
+        :param url: `str` of URL
+        :param headers: `dict` of request headers
+
+        :returns: `tuple` of status, `dict` of response headers and `bytes`
+                  of body
+        """
+
+        meta_file, body_file = self.cache_paths(url)
+        cached = None
+        if os.path.exists(meta_file) and os.path.exists(body_file):
+            with open(meta_file) as f:
+                cached = json.load(f)
+            headers = dict(headers, **{'If-None-Match': cached['etag']})
+
+        status, response_headers, body = self.request(url, headers)
+
+        if status == 304 and cached:
+            with open(body_file, 'rb') as f:
+                return 200, cached['headers'], f.read()
+
+        response_headers = dict(response_headers.items())
+        etag = response_headers.get('ETag') or response_headers.get('Etag')
+        if status == 200 and etag:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(body_file + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(body_file + '.tmp', body_file)
+            with open(meta_file + '.tmp', 'w') as f:
+                json.dump({'url': url, 'etag': etag, 'headers': response_headers}, f)
+            os.replace(meta_file + '.tmp', meta_file)
+
+        return status, response_headers, body
+
+
+HTTP = HTTPClient()
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Nearest-rank percentile
+
+    :param values: `list` of numbers
+    :param pct: `float` of percentile, 0-100
+
+    :returns: `float` of percentile value, None if there are no values
+    """
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def probe(kind: str, address: str, path: str, timeout: float) -> float:
+    """
+    Probes an endpoint once over a new connection, like the compose
+    healthchecks do
+
+    :param kind: `str` of probe kind, http or tcp
+    :param address: `str` of host:port
+    :param path: `str` of HTTP path
+    :param timeout: `float` of seconds
+
+    :returns: `float` of latency in seconds
+    """
+
+    host, port = address.rsplit(':', 1)
+    start = time.perf_counter()
+    if kind == 'tcp':
+        socket.create_connection((host, int(port)), timeout=timeout).close()
+    else:
+        conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+        if response.status >= 400:
+            raise http.client.HTTPException(f'HTTP {response.status}')
+    return time.perf_counter() - start
+
+
+def probe_endpoint(service: str, kind: str, address: str, path: str,
+                   samples: int, timeout: float) -> dict:
+    """
+    Probes an endpoint a number of times and summarises the latencies
+
+    :param service: `str` of service name
+    :param kind: `str` of probe kind, http or tcp
+    :param address: `str` of host:port
+    :param path: `str` of HTTP path
+    :param samples: `int` of probes
+    :param timeout: `float` of seconds per probe
+
+    :returns: `dict` of service, endpoint, ok/failed counts, latency
+              percentiles in milliseconds and last error
+    """
+
+    latencies = []
+    error = None
+    for _ in range(samples):
+        try:
+            latencies.append(probe(kind, address, path, timeout) * 1000)
+        except Exception as err:
+            error = f'{type(err).__name__}: {err}'
+
+    return {
+        'service': service,
+        'endpoint': f'{kind}://{address}{path or ""}',
+        'ok': len(latencies),
+        'failed': samples - len(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else None,
+        'error': error
+    }
+
+
+def probe_services(endpoints: dict, samples: int, timeout: float) -> list:
+    """
+    Probes all endpoints concurrently
+
+    :param endpoints: `dict` of service -> (kind, address, path)
+    :param samples: `int` of probes per endpoint
+    :param timeout: `float` of seconds per probe
+
+    :returns: `list` of `probe_endpoint` results
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, len(endpoints))) as executor:
+        futures = [executor.submit(probe_endpoint, service, *endpoint, samples, timeout)
+                   for service, endpoint in endpoints.items()]
+        return [future.result() for future in futures]
+
+
+def health(options: list) -> None:
+    """
+    Probes the service endpoints and prints latency percentiles
+
+    By default the probes run inside the wis2box-management container, on
+    the compose network, so internal services such as elasticsearch are
+    reachable; --host probes the ports published on the host instead.
+
+    :param options: `list` of health command arguments
+
+    :returns: None.
+    """
+
+    health_parser = argparse.ArgumentParser(prog='wis2box-ctl.py health')
+    health_parser.add_argument('--samples', type=int, default=10, help='probes per service')
+    health_parser.add_argument('--timeout', type=float, default=5, help='seconds per probe')
+    health_parser.add_argument('--json', action='store_true', help='print results as JSON')
+    health_parser.add_argument('--host', action='store_true',
+                               help='probe published ports from the host')
+    health_parser.add_argument('services', nargs='*', help='services to probe (default: all)')
+    options = health_parser.parse_args(options)
+
+    services = options.services or list(HEALTH_ENDPOINTS)
+    if options.host:
+        endpoints = {s: (HEALTH_ENDPOINTS[s][0], HEALTH_ENDPOINTS[s][3], HEALTH_ENDPOINTS[s][2])
+                     for s in services if HEALTH_ENDPOINTS[s][3]}
+        results = probe_services(endpoints, options.samples, options.timeout)
+    else:
+        endpoints = {s: HEALTH_ENDPOINTS[s][:3] for s in services}
+        source = '\n\n'.join(inspect.getsource(f) for f in
+                             (percentile, probe, probe_endpoint, probe_services))
+        script = ('import http.client, json, socket, time\n'
+                  'from concurrent.futures import ThreadPoolExecutor\n\n'
+                  f'{source}\n'
+                  'print(json.dumps(probe_services('
+                  f'{endpoints!r}, {options.samples}, {options.timeout})))\n')
+        result = subprocess.run(['docker', 'exec', '-i', 'wis2box-management', 'python3', '-'],
+                                input=script, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr.strip())
+            print('ERROR: could not run probes in wis2box-management, '
+                  'is wis2box running? (or use --host)')
+            exit(1)
+        results = json.loads(result.stdout)
+
+    if options.json:
+        print(json.dumps(results, indent=4))
+    else:
+        def ms(value):
+            return f'{value:.2f}' if value is not None else '-'
+
+        print(f"{'service':<16}{'ok':>5}{'failed':>8}{'p50 ms':>10}"
+              f"{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for r in sorted(results, key=lambda r: -(r['p50_ms'] or float('inf'))):
+            print(f"{r['service']:<16}{r['ok']:>5}{r['failed']:>8}{ms(r['p50_ms']):>10}"
+                  f"{ms(r['p90_ms']):>10}{ms(r['p99_ms']):>10}{ms(r['max_ms']):>10}")
+            if r['error']:
+                print(f"  {r['endpoint']}: {r['error']}")
+
+    if any(r['failed'] for r in results):
+        exit(1)
+
+
 def fetch_data_from_url(url: str, headers: dict = {}) -> bytes:
     """
     Fetch data from a given URL.
@@ -151,28 +804,66 @@ def fetch_data_from_url(url: str, headers: dict = {}) -> bytes:
     :returns: bytes. The response data.
     """
 
-    parsed_url = urlparse(url)
-    full_path = parsed_url.path
-    if parsed_url.query:  # Include query string if it exists
-        full_path += '?' + parsed_url.query
     try:
-        conn = http.client.HTTPSConnection(parsed_url.netloc)
-        conn.request("GET", full_path, headers=headers)
-        response = conn.getresponse()
-        # Follow redirect if status is 301 or 302
-        if response.status in (301, 302):
-            location = response.getheader('Location')
-            if location:
-                conn.close()
-                return fetch_data_from_url(location, headers)
-        elif response.status != 200:
-            print(f"Error fetching URL: {response.status}")
-            exit(1)
-        return response.read()
+        status, _, data = HTTP.request(url, headers)
     except Exception as e:
         print(f"Error fetching URL: {e}")
         exit(1)
 
+    if status != 200:
+        print(f"Error fetching URL: {status}")
+        exit(1)
+    return data
+
+
+def next_page_url(link_header: str) -> str:
+    """
+    Extract the rel="next" URL of a Link pagination header.
+
+    :param link_header: `str` of Link header, or None
+
+    :returns: `str` of next page URL, or None on the last page
+    """
+
+    for link in (link_header or '').split(','):
+        match = re.match(r'\s*<([^>]+)>\s*;.*rel="?next"?', link)
+        if match:
+            return match.group(1)
+    return None
+
+
+def fetch_releases(repo: str = GITHUB_RELEASE_REPO) -> list:
+    """
+    Fetch all releases of a GitHub repository, following pagination.
+    Pages are revalidated from the disk cache, and 304 responses do not
+    count against the GitHub API rate limit.
+
+    :param repo: `str` of owner/repository
+
+    :returns: `list` of release objects
+    """
+
+    headers = {
+        'Accept': 'application/vnd.github.v3+json',
+        'User-Agent': 'wis2box'
+    }
+
+    releases = []
+    url = f'{GITHUB_API_URL}/repos/{repo}/releases?per_page=100'
+    while url:
+        try:
+            status, response_headers, data = HTTP.get(url, headers)
+        except Exception as e:
+            print(f"Error fetching URL: {e}")
+            exit(1)
+        if status != 200:
+            print(f"Error fetching URL: {status}")
+            exit(1)
+        releases.extend(json.loads(data.decode('utf-8')))
+        url = next_page_url(response_headers.get('Link') or response_headers.get('link'))
+
+    return releases
+
 def get_resolved_version() -> str:
     """
     Determine the latest matching release tag from the wis2box-release repository.
@@ -194,16 +885,8 @@ def get_resolved_version() -> str:
     if base_version == 'LOCAL_BUILD':
         return base_version
     # otherwise, fetch the latest release tag from GITHUB_RELEASE_REPO
-    url = f'https://api.github.com/repos/{GITHUB_RELEASE_REPO}/releases'
-    headers = {
-        'Accept': 'application/vnd.github.v3+json',
-        'User-Agent': 'wis2box'
-    }
-
     options = []
-    data = fetch_data_from_url(url, headers)
-    releases = json.loads(data.decode('utf-8'))
-    for release in releases:
+    for release in fetch_releases():
         if base_version in release['tag_name']:
             options.append(release['tag_name'])
 
@@ -266,10 +949,27 @@ def remove_old_docker_images() -> None:
         if response == 'y':
             os.remove(file_)
 
-def build_local_images() -> None:
-    for image in LOCAL_BUILD_IMAGES:
-        print(f'Building {image}')
-        run(split(f'docker build -t {image} ./{image}'))
+def build_local_images(parallel: int = DOCKER_PARALLEL,
+                       cache_dir: str = BUILDKIT_CACHE_DIR) -> None:
+    """
+    Build LOCAL_BUILD_IMAGES concurrently and use them in the
+    docker-compose.images-*.yml file
+
+    :param parallel: `int` of concurrent builds
+    :param cache_dir: `str` of BuildKit cache directory, or None
+
+    :return: None.
+    """
+
+    if cache_dir and not buildx_builder():
+        print('docker buildx not available, building without BuildKit cache')
+        cache_dir = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        print(f'Using BuildKit cache {cache_dir}')
+
+    run_concurrently(lambda image: build_image(image, cache_dir),
+                     LOCAL_BUILD_IMAGES, 'Building', 'built', parallel)
 
     image_file = glob.glob('docker-compose.images-*.yml')[0]
     # overwrite the image tag with the local image
@@ -284,11 +984,13 @@ def build_local_images() -> None:
                     line = f'    image: {image_name}\n'
             f.write(line)
 
-def update_images_yml() -> str:
+def update_images_yml(parallel: int = DOCKER_PARALLEL) -> str:
     """
 
     Update the docker-compose.images-*.yml file to the latest release tag.
 
+    :param parallel: `int` of concurrent image pulls
+
     :return: The latest release tag or an error message if not found.
     """
 
@@ -310,14 +1012,15 @@ def update_images_yml() -> str:
     if current_version == version:
         print(f'Current version={version}, no update of images file required')
         # docker pull the images to ensure they are up to date
+        images = []
         with open(f'docker-compose.images-{version}.yml') as f:
             for line in f:
                 if 'image:' in line:
                     image = line.split(':', 1)[1].strip()
-                    if image in LOCAL_BUILD_IMAGES:
+                    if image in LOCAL_BUILD_IMAGES or image in images:
                         continue
-                    print(f'Pulling {image}')
-                    run(split(f'docker pull {image}'))
+                    images.append(image)
+        run_concurrently(pull_image, images, 'Pulling', 'pulled', parallel)
         return
 
     if version not in ['LOCAL_BUILD', 'Undefined']:
@@ -347,6 +1050,25 @@ def update_images_yml() -> str:
         if file_ != f'docker-compose.images-{version}.yml':
             os.rename(file_, file_ + '.bak')
 
+def image_options(options: list) -> tuple:
+    """
+    Parses --parallel and --buildkit-cache given after the build or update
+    command, which argparse otherwise leaves among the command arguments
+
+    :param options: `list` of command arguments
+
+    :returns: `tuple` of (parallel, buildkit_cache, remaining arguments)
+    """
+
+    image_parser = argparse.ArgumentParser(add_help=False)
+    image_parser.add_argument('--parallel', type=int, default=args.parallel)
+    image_parser.add_argument('--buildkit-cache', dest='buildkit_cache',
+                              default=args.buildkit_cache)
+    parsed, remaining = image_parser.parse_known_args(options)
+
+    return parsed.parallel, parsed.buildkit_cache, remaining
+
+
 def make(args) -> None:
     """
     Serves as pseudo Makefile using Python subprocesses.
@@ -356,33 +1078,44 @@ def make(args) -> None:
     :returns: None.
     """
 
+    if args.command in ['build', 'update']:
+        args.parallel, args.buildkit_cache, args.args = image_options(args.args)
+
     if not os.path.exists('wis2box.env'):
         print("ERROR: wis2box.env file does not exist.  Please create one manually or by running `python3 wis2box-create-config.py`")
         exit(1)
+    global DOCKER_COMPOSE_COMMAND
+    cache = StartupCache()
+    DOCKER_COMPOSE_COMMAND = cache.compose_command()
+
     # check if WIS2BOX_SSL_KEY and WIS2BOX_SSL_CERT are set
-    ssl_key = None
-    ssl_cert = None
-    with open('wis2box.env') as f:
-        for line in f:
-            if 'WIS2BOX_SSL_KEY' in line:
-                ssl_key = line.split('=')[1].strip()
-            if 'WIS2BOX_SSL_CERT' in line:
-                ssl_cert = line.split('=')[1].strip()
+    env = read_env('wis2box.env')
+    ssl_key = env.get('WIS2BOX_SSL_KEY')
+    ssl_cert = env.get('WIS2BOX_SSL_CERT')
 
-    if not glob.glob('docker-compose.images-*.yml'):
+    image_files = glob.glob('docker-compose.images-*.yml')
+    if not image_files:
         print("No docker-compose.images-*.yml files found, creating one")
-        update_images_yml()
-        # update docker_compose_args with the latest docker-compose.images-*.yml file
-        docker_image_file = glob.glob('docker-compose.images-*.yml')[0]
-        docker_compose_args = DOCKER_COMPOSE_ARGS + f' --file {docker_image_file}'
+        update_images_yml(args.parallel)
+        image_files = glob.glob('docker-compose.images-*.yml')
+        cache = StartupCache()
 
-    docker_image_file = glob.glob('docker-compose.images-*.yml')[0]
+    docker_image_file = image_files[0]
     docker_compose_args = DOCKER_COMPOSE_ARGS + f' --file {docker_image_file}'
     if args.ssl or (ssl_key and ssl_cert):
         docker_compose_args +=" --file docker-compose.ssl.yml"
     if args.ssl and not (ssl_key and ssl_cert):
         print("ERROR: SSL is enabled but WIS2BOX_SSL_KEY and WIS2BOX_SSL_CERT are not set in wis2box.env")
         exit(1)
+
+    # the merged configuration spares compose re-reading and interpolating
+    # every file, it is rendered by `config` and the first `start`
+    rendered = cache.rendered_config(docker_compose_args,
+                                     render=args.command in ['config', 'up', 'start'])
+    rendered_args = docker_compose_args
+    if rendered:
+        rendered_args = f'--file {rendered} --project-name wis2box_project'
+
     # if you selected a bunch of them, default to all
     containers = "" if not args.args else ' '.join(args.args)
 
@@ -390,9 +1123,13 @@ def make(args) -> None:
     container = "wis2box-management" if not args.args else ' '.join(args.args)
 
     if args.command == "config":
-        run(split(f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} config'))
+        if rendered:
+            with open(rendered) as f:
+                print(f.read(), end='')
+        else:
+            run(split(f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} config'))
     elif args.command == "build":
-        build_local_images()
+        build_local_images(args.parallel, args.buildkit_cache or None)
     elif args.command in ["up", "start", "start-dev"]:
         # if no docker-compose.images-*.yml files exist, run get_images()
         run(split(
@@ -400,13 +1137,15 @@ def make(args) -> None:
             silence_stderr=True)
         run(split('docker plugin enable loki'), silence_stderr=True)
         if containers:
-            run(split(f"{DOCKER_COMPOSE_COMMAND} {docker_compose_args} start {containers}"))
+            run(split(f"{DOCKER_COMPOSE_COMMAND} {rendered_args} start {containers}"))
         else:
             if args.command == 'start-dev':
                 run(split(f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} --file docker-compose.dev.yml up -d'))
             else:
-                run(split(f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} up -d'))
+                run(split(f'{DOCKER_COMPOSE_COMMAND} {rendered_args} up -d'))
                 remove_old_docker_images()
+    elif args.command == "health":
+        health(args.args)
     elif args.command == "execute":
         run(['docker', 'exec', '-i', 'wis2box-management', 'sh', '-c', containers])
     elif args.command == "login":
@@ -415,7 +1154,7 @@ def make(args) -> None:
         run(split(f'docker exec -u -0 -it {container} /bin/bash'))
     elif args.command == "logs":
         run(split(
-            f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} logs --follow {containers}'))
+            f'{DOCKER_COMPOSE_COMMAND} {rendered_args} logs --follow {containers}'))
     elif args.command in ["stop", "down"]:
         if containers:
             run(split(f"{DOCKER_COMPOSE_COMMAND} {docker_compose_args} {containers}"))
@@ -423,7 +1162,7 @@ def make(args) -> None:
             run(split(
                 f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} down --remove-orphans {containers}'))
     elif args.command == "update":
-        update_images_yml()
+        update_images_yml(args.parallel)
         # update docker_compose_args with the latest docker-compose.images-*.yml file
         docker_image_file = glob.glob('docker-compose.images-*.yml')[0]
         docker_compose_args = DOCKER_COMPOSE_ARGS + f' --file {docker_image_file}'
@@ -445,9 +1184,9 @@ def make(args) -> None:
     elif args.command == "restart":
         if containers:
             run(split(
-                f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} stop {containers}'))
+                f'{DOCKER_COMPOSE_COMMAND} {rendered_args} stop {containers}'))
             run(split(
-                f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} start {containers}'))
+                f'{DOCKER_COMPOSE_COMMAND} {rendered_args} start {containers}'))
         else:
             run(split(
                 f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} down --remove-orphans'))
@@ -455,7 +1194,7 @@ def make(args) -> None:
                 f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} up -d'))
     elif args.command == "status":
         run(split(
-            f'{DOCKER_COMPOSE_COMMAND} {docker_compose_args} ps {containers}'))
+            f'{DOCKER_COMPOSE_COMMAND} {rendered_args} ps {containers}'))
     elif args.command == "lint":
         files = find_files(".", '.py')
         run(('python3', '-m', 'flake8', *files))